@@ -31,12 +31,33 @@ $ python3 LUT_build.py {options}
 
 --filter      : a spectral filter function (only valid if wavelength pair defined)
 
+--spectral    : builds a spectrally resolved LUT, i.e. 6S runs at each 2.5 nm
+              : from the first to the second wavelength, channel LUTs are then
+              : derived for any spectral response with LUT_convolve.py
+
 --aerosol     : aerosol profile to use (default = Continental), for options see..
               : https://github.com/robintw/Py6S/blob/master/Py6S/Params/aeroprofile.py
+              : or Mixture, i.e. one LUT with an extra aerosol mixture axis
+              : from Maritime (0) to Continental (1) to Urban (2), built
+              : from the basic aerosol components (x5 the 6S runs)
 
 --build_type  : defines parameter space of input variables (default = test)
-              : options are: test, test2, validation and full
+              : options are: test, test2, validation, coarse and full
               : ! MUST use full to build functioning LUT but this can take hours !
+              : (or coarse, ~15 % of the runs, for cubic interpolation)
+
+--progressive : builds coarse to fine, publishing a valid LUT of each stage
+              : (the grid corners, every other level, then the full grid)
+              : that can be used while the build goes on, an interrupted
+              : build resumes from its latest stage
+
+--profile     : (optional) profiles the build, i.e. writes cProfile statistics
+              : and tracemalloc peak memory and top allocations of each
+              : phase next to the LUT (.profile.txt and .prof files)
+
+--store       : (optional) keep the LUT in a content-addressed store, e.g. a
+              : shared cache outside the repo, see bin/LUT_store.py
+              : (root directory defaults to $SIXS_EMULATOR_STORE)
 
 Example Usage
 -------------
@@ -64,6 +85,14 @@ Example Usage
 6) Build a full LUT for Sentinel 2, channel 1
 
   $ py LUT_build.py --channel S2A_MSI_01 --build_type full
+
+7) Build a full spectral LUT from 0.4 to 2.5 microns (i.e. for any channel)
+
+  $ py LUT_build.py --wavelength 0.4 2.5 --spectral --build_type full
+
+8) Build a full LUT progressively (usable LUTs after ~0.5 % and ~14 % of the runs)
+
+  $ py LUT_build.py --channel S2A_MSI_01 --build_type full --progressive
   
 """
 
@@ -73,143 +102,239 @@ import argparse
 import time
 import numpy as np
 import math
-from itertools import product
 import pickle
 from Py6S import *
 
-def mid_points(elements):
-  x = np.array(elements)
-  return (x[1:] + x[:-1]) / 2
-
-def input_variables(build_type):
-  """
-  Defines the input variables (i.e. parameter space) for
-  a given build_type
-  
-  The input variables are:
-  - solar zenith angle (degrees)
-  - water vapour column (g/m2)
-  - ozone column (cm-atm)
-  - aerosol optical thickness
-  - altitude (km above sealevel)
-  """
- 
-  test = {
-    'solar_zs':[0],
-    'H2Os':[0],
-    'O3s':[0],
-    'AOTs':[0],
-    'alts':[0]
-  }
-  
-  test2 = {
-    'solar_zs':[0,10,20],
-    'H2Os':[0,2,3],
-    'O3s':[0,0.4,0.8],
-    'AOTs':[0,1.0],
-    'alts':[0,2,4]
-  }
-  
-  full = {
-    'solar_zs': [0, 10, 20, 30, 40, 50, 60, 65, 70, 75],  
-    'H2Os': [0, 0.25, 0.5, 1, 1.5, 2, 3, 5, 8.5],  
-    'O3s': [0.0, 0.8],  
-    'AOTs': [0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.25, 3],
-    'alts': [0,1,4,7.75]
-  }
-  # Maximum altitude is set to 7.75 km to avoid 6S's 8 km scale height. 
-  # Note, only 30 mountain peaks in the world are higher than 7.75 km:
-  # https://en.wikipedia.org/wiki/List_of_highest_mountains
-  # and can probably safely model targets >7.75 km as being at 7.75 km
-  
-  validation = {
-    'solar_zs':mid_points(full['solar_zs']),  
-    'H2Os':mid_points(full['H2Os']),  
-    'O3s':mid_points(full['O3s']),  
-    'AOTs':mid_points(full['AOTs']),
-    'alts':mid_points(full['alts'])
-  }
-  # This 'validation' parameter space uses the midpoints between the 
-  # normal, i.e. 'full', build because we expect it to be the toughest test.
-  # We also test using a Monte Carlo approach (an easier test).
-
-  build_selector = {
-    'test':test,
-    'test2':test2,
-    'validation':validation,
-    'full':full    
-  }
-
-  return build_selector[build_type]
-
-def permutate_invars(invars):
-  """
-  permutation of input variables for LUT
-  """
-  return list(product(invars['solar_zs'],
-                      invars['H2Os'],
-                      invars['O3s'],
-                      invars['AOTs'],
-                      invars['alts']))  
-
-def build_LUT(config):
+# input variables (i.e. parameter space) are shared with the interpolation
+# and correction modules, which live in the bin directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'bin'))
+from parameter_space import (input_variables, permutate_invars,
+                             progressive_invars, aerosol_components)
+from LUT_store import LUT_Store, atomic_write, config_key
+from profiling import Profiler
+import spectral
+
+
+# 6S outputs kept in LUTs (i.e. columns), besides the correction coefficients,
+# so that other correction models do not need a new build
+OUTPUT_COLUMNS = {
+  'path_radiance':lambda o: o.atmospheric_intrinsic_radiance,
+  'background_radiance':lambda o: o.background_radiance,
+  'direct_solar_irradiance':lambda o: o.direct_solar_irradiance,
+  'diffuse_solar_irradiance':lambda o: o.diffuse_solar_irradiance,
+  'environmental_irradiance':lambda o: o.environmental_irradiance,
+  'solar_spectrum':lambda o: o.int_solar_spectrum,
+  'spherical_albedo':lambda o: o.spherical_albedo.total,
+  'optical_depth':lambda o: o.optical_depth_total.total,
+  'gas_transmittance_down':lambda o: o.trans['global_gas'].downward,
+  'gas_transmittance_up':lambda o: o.trans['global_gas'].upward,
+  'scattering_transmittance_down':lambda o: o.trans['total_scattering'].downward,
+  'scattering_transmittance_up':lambda o: o.trans['total_scattering'].upward,
+  'rayleigh_transmittance_down':lambda o: o.trans['rayleigh_scattering'].downward,
+  'rayleigh_transmittance_up':lambda o: o.trans['rayleigh_scattering'].upward,
+  'aerosol_transmittance_down':lambda o: o.trans['aerosol_scattering'].downward,
+  'aerosol_transmittance_up':lambda o: o.trans['aerosol_scattering'].upward
+}
+
+def build_LUT(config, store=None, progressive=False, profiler=None):
   """
   Builds a lookup table for a given configuration
+
+  progressive : run the grid coarse to fine (see progressive_invars) and
+                publish a valid LUT of each stage, i.e. of a subgrid, that
+                can be used (with lower accuracy) while the build goes on
+  profiler    : (optional) Profiler, profiles the 6S runs and the saving
+                of (each stage of) the LUT
   """
+  profiler = profiler or Profiler()
 
   # initiate 6S object with constants
   s = SixS()
   s.altitudes.set_sensor_satellite_level()
-  s.aero_profile = AeroProfile.__dict__[config['aerosol_profile']]
+  if 'aerosol_mixtures' not in config['invars']:
+    s.aero_profile = AeroProfile.__dict__[config['aerosol_profile']]
   s.geometry = Geometry.User()
   s.geometry.view_z = config['view_zenith']
   s.geometry.month = 1 # Earth-sun distance correction is later
   s.geometry.day = 4   # applied from perihelion, i.e. Jan 4th.
 
-  # calculate permutation of input variables
-  perms = permutate_invars(config['invars']) 
-                       
-  #run 6S for each permutation
-  outputs = []
-  for perm in perms:      
-    print('{0}: solar_z = {1[0]:02}, H2O = {1[1]:.2f}, O3 = {1[2]:.1f},'
-          'AOT = {1[3]:.2f}, alt = {1[4]:.2f}'.format(config['filename'],perm))
-    
-    # update input variables
-    s.geometry.solar_z = perm[0]
-    s.atmos_profile = AtmosProfile.UserWaterAndOzone(perm[1],perm[2])
-    s.aot550 = perm[3]
-    s.altitudes.set_target_custom_altitude(perm[4])
-    s.wavelength = config['spectrum']
-    
-    # run 6S
-    s.run()
-    
-    # solar irradiance
-    Edir = s.outputs.direct_solar_irradiance             # direct solar irradiance
-    Edif = s.outputs.diffuse_solar_irradiance            # diffuse solar irradiance
-    E = Edir + Edif                                      # total solar irraduance
-    # transmissivity
-    absorb  = s.outputs.trans['global_gas'].upward       # absorption transmissivity
-    scatter = s.outputs.trans['total_scattering'].upward # scattering transmissivity
-    tau2 = absorb*scatter                                # transmissivity (from surface to sensor)
-    # path radiance
-    Lp   = s.outputs.atmospheric_intrinsic_radiance      # path radiance
-    
-    # correction coefficients for this configuration
-    # i.e. surface_reflectance = (L - a) / b,
-    #      where, L is at-sensor radiance
-    a = Lp
-    b = (tau2*E)/math.pi
-    outputs.append((a,b))
-  
+  stages = [config['invars']]
+  if progressive:
+    stages = progressive_invars(config['invars'])
+
+  # 6S results of each permutation of input variables (from an earlier
+  # stage or an interrupted progressive build)
+  results, resumed = {}, 0
+  if progressive:
+    with profiler.phase('resume'):
+      results, resumed = previous_results(config, store)
+
+  for k, invars in enumerate(stages):
+    stage = 'stage {} of {}'.format(k + 1, len(stages))
+
+    # (stages up to the resumed one are published already)
+    if k < resumed:
+      continue
+
+    # calculate permutation of input variables
+    perms = permutate_invars(invars)
+
+    #run 6S for each permutation (not run yet)
+    with profiler.phase('6S runs, ' + stage):
+      for perm in perms:
+        if perm not in results:
+          results[perm] = run_6S(s, config, perm)
+
+    # LUT of this stage (a subgrid unless it is the last)
+    stage_config = dict(config)
+    stage_config['invars'] = invars
+    if k < len(stages) - 1:
+      stage_config['stage'] = [k + 1, len(stages)]
+    with profiler.phase('save LUT, ' + stage):
+      save_LUT(stage_config, [results[perm] for perm in perms], store)
+    if progressive:
+      print('Published stage {} of {} ({} points): {}'
+            .format(k + 1, len(stages), len(perms), stage_config['filepath']))
+
+  return
+
+def run_6S(s, config, perm):
+  """
+  Runs 6S for one permutation of input variables, i.e. returns the
+  correction coefficients and the other outputs kept in the LUT
+  """
+  print('{0}: solar_z = {1[0]:02}, H2O = {1[1]:.2f}, O3 = {1[2]:.1f},'
+        'AOT = {1[3]:.2f}, alt = {1[4]:.2f}'.format(config['filename'],perm))
+
+  # update input variables
+  s.geometry.solar_z = perm[0]
+  s.atmos_profile = AtmosProfile.UserWaterAndOzone(perm[1],perm[2])
+  s.aot550 = perm[3]
+  s.altitudes.set_target_custom_altitude(perm[4])
+
+  # aerosol mixture, i.e. fractions of the basic components
+  if len(perm) > 5:
+    print('  aerosol mixture = {:.2f}'.format(perm[5]))
+    s.aero_profile = AeroProfile.User(**aerosol_components(perm[5]))
+
+  # spectral LUT, i.e. (a, b) at each wavelength
+  if 'wavelengths' in config:
+    spectrum = []
+    spectral_columns = {name:[] for name in OUTPUT_COLUMNS}
+    for wavelength in config['wavelengths']:
+      s.wavelength = Wavelength(wavelength)
+      s.run()
+      spectrum.append(correction_coefficients(s))
+      for name, value in output_columns(s).items():
+        spectral_columns[name].append(value)
+    return spectrum, spectral_columns
+
+  s.wavelength = config['spectrum']
+
+  # run 6S
+  s.run()
+  return correction_coefficients(s), output_columns(s)
+
+def save_LUT(config, results, store=None):
+  """
+  Saves a LUT from the 6S results of each permutation (atomically, i.e.
+  never a partial file) to its filepath or, in a store, under its own key
+  """
+
+  LUT = {'config':config,'outputs':[outputs for outputs, columns in results],
+         'columns':{name:np.array([columns[name] for outputs, columns in results])
+                    for name in OUTPUT_COLUMNS}}
+
   # LUT built! save to pickle file =)
-  LUT = {'config':config,'outputs':outputs}
-  pickle.dump( LUT, open(config['filepath'], 'wb') )
+  write = lambda f: pickle.dump(LUT, f)
+  if store is None:
+    atomic_write(config['filepath'], write)
+    return
+
+  meta = {'sensor':config['sensor'], 'filename':config['filename'],
+          'aerosol_profile':config['aerosol_profile'],
+          'view_zenith':config['view_zenith'], 'build_type':config.get('build_type')}
+  if 'stage' in config:
+    meta['stage'] = config['stage']
+  config['filepath'] = store.put(config, 'lut', write, **meta)
+
+def previous_results(config, store=None):
+  """
+  6S results of the latest stage published by an earlier (interrupted)
+  progressive build of this configuration, i.e. ({permutation: (outputs,
+  columns)}, stage number), stage 0 if there is none
+  """
+  filepaths = [config['filepath']]
+  if store is not None:
+    filepaths = [f for key, f in store.find('lut', filename=config['filename'])]
+
+  LUT = None
+  for filepath in filepaths:
+    try:
+      previous = pickle.load(open(filepath, 'rb'))
+    except Exception:
+      continue
+    stage = previous['config'].get('stage')
+    same_build = config_key(dict(previous['config'], invars=config['invars'])) == config_key(config)
+    if stage and same_build and (LUT is None or stage[0] > LUT['config']['stage'][0]):
+      LUT = previous
+  if LUT is None:
+    return {}, 0
+
+  perms = permutate_invars(LUT['config']['invars'])
+  columns = LUT.get('columns', {})
+  print('Resuming from stage {0[0]} of {0[1]} ({1} points)'.format(LUT['config']['stage'], len(perms)))
+  results = {perm:(outputs, {name:columns[name][i] for name in OUTPUT_COLUMNS})
+             for i, (perm, outputs) in enumerate(zip(perms, LUT['outputs']))}
+  return results, LUT['config']['stage'][0]
+
+def correction_coefficients(s):
+  """
+  Atmospheric correction coefficients (a, b) from the outputs of a 6S run
+  """
   
-  return
+  # solar irradiance
+  Edir = s.outputs.direct_solar_irradiance             # direct solar irradiance
+  Edif = s.outputs.diffuse_solar_irradiance            # diffuse solar irradiance
+  E = Edir + Edif                                      # total solar irraduance
+  # transmissivity
+  absorb  = s.outputs.trans['global_gas'].upward       # absorption transmissivity
+  scatter = s.outputs.trans['total_scattering'].upward # scattering transmissivity
+  tau2 = absorb*scatter                                # transmissivity (from surface to sensor)
+  # path radiance
+  Lp   = s.outputs.atmospheric_intrinsic_radiance      # path radiance
+  
+  # correction coefficients for this configuration
+  # i.e. surface_reflectance = (L - a) / b,
+  #      where, L is at-sensor radiance
+  a = Lp
+  b = (tau2*E)/math.pi
+  return (a,b)
+
+def output_columns(s):
+  """
+  Outputs of a 6S run that are kept in the LUT (see OUTPUT_COLUMNS)
+  """
+  return {name:float(output(s.outputs)) for name, output in OUTPUT_COLUMNS.items()}
 
-def IO_handler(config,args):
+def LUT_is_current(config, store=None):
+  """
+  Checks whether a complete LUT already exists for this configuration
+  (i.e. not a partial file or one built with a different configuration)
+  """
+
+  if store is not None:
+    return store.get(config, 'lut') is not None
+
+  if not os.path.isfile(config['filepath']):
+    return False
+  try:
+    LUT = pickle.load(open(config['filepath'], 'rb'))
+    return config_key(LUT['config']) == config_key(config)
+  except Exception:
+    return False
+
+def IO_handler(config,args,store=None):
   """
   Handles output directory and filename
   """
@@ -221,6 +346,8 @@ def IO_handler(config,args):
     filename.append('_'.join(args.wavelength))
   if args.filter:
     filename.append('_f')
+  if args.spectral:
+    filename = ['spectral_', '_'.join(args.wavelength)]
   filename = ''.join(filename)
   
   # predefined sensor channel filename
@@ -230,22 +357,30 @@ def IO_handler(config,args):
   # sensor name
   if args.channel:
     sensor_name = '_'.join(filename.split('_')[:-1])
+  elif args.spectral:
+    sensor_name = 'spectral'
   else:
     sensor_name = 'user-defined-sensor'
 
   # outdir
-  base_path = os.path.dirname(os.path.abspath(__file__))
-  outdir = os.path.join(base_path,'files','LUTs',sensor_name,
-  config['aerosol_profile'],'view_zenith_{}'.format(config['view_zenith']))
+  if store is not None:
+    filepath = store.filepath(config_key(config), 'lut')
+    outdir = os.path.dirname(filepath)
+  else:
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    outdir = os.path.join(base_path,'files','LUTs',sensor_name,
+    config['aerosol_profile'],'view_zenith_{}'.format(config['view_zenith']))
+    filepath = os.path.join(outdir,filename+'.lut')
   if not os.path.exists(outdir):
     print('\nCreating new output directory!\n'+outdir+'\n')
     os.makedirs(outdir)
   os.chdir(outdir)
 
   # update config
+  config['sensor'] = sensor_name
   config['outdir'] = outdir
   config['filename'] = filename+'.lut'
-  config['filepath'] = os.path.join(outdir,filename+'.lut')
+  config['filepath'] = filepath
 
   return 
   
@@ -256,8 +391,12 @@ def main():
   parser.add_argument('--channel','-c')
   parser.add_argument('--wavelength','-w', nargs='*')
   parser.add_argument('--filter','-f', nargs='*')
+  parser.add_argument('--spectral', action='store_true')
+  parser.add_argument('--progressive', action='store_true')
   parser.add_argument('--aerosol','-a')
   parser.add_argument('--build_type','-b')
+  parser.add_argument('--store','-s', nargs='?', const='')
+  parser.add_argument('--profile', action='store_true')
   args = parser.parse_args()
   channel = args.channel
   wavelength = args.wavelength
@@ -293,6 +432,15 @@ def main():
       spectrum = Wavelength(start_wavelength)
 
 
+  # spectral LUT, i.e. monochromatic runs at 2.5 nm from first to second wavelength
+  wavelengths = None
+  if args.spectral:
+    if not wavelength or len(wavelength) != 2 or spectral_filter or channel:
+      print('spectral LUTs need a wavelength pair (and no filter or channel)')
+      sys.exit(1)
+    wavelengths = [float(w) for w in spectral.wavelengths(start_wavelength, end_wavelength)]
+    spectrum = {'spectral':[start_wavelength, end_wavelength, spectral.STEP]}
+
   # predefined sensor channel, for complete list see Py6S 'PredefinedWavelengths':
   # https://github.com/robintw/Py6S/blob/master/Py6S/Params/wavelength.py
   if channel:
@@ -309,19 +457,20 @@ def main():
     print('must define wavelength(s) or sensor channel, returning..')
     sys.exit(1)
 
-  # aerosol profile (default to Continental)
-  if aerosol_profile:
+  # aerosol profile (default to Continental), Mixture adds an aerosol
+  # mixture axis from Maritime to Continental to Urban
+  if aerosol_profile and aerosol_profile != 'Mixture':
     try:
       test = AeroProfile.__dict__[aerosol_profile]
     except:
       print('Aerosol profile not recognized: ',aerosol_profile)
       sys.exit(1)
-  else:
+  elif not aerosol_profile:
     aerosol_profile = 'Continental'
   
   # build type (default to smallest test build)
   if build_type:
-    if build_type not in ['test','test2','full','validation']:
+    if build_type not in ['test','test2','coarse','full','validation']:
       print('Build type not recognized: ',build_type)
       sys.exit(1)
   else:
@@ -334,22 +483,32 @@ def main():
   'aerosol_profile':aerosol_profile,
   'view_zenith':int(0),
   'build_type':build_type,
-  'invars':input_variables(build_type)
+  'invars':input_variables(build_type, aerosol_mixture=aerosol_profile == 'Mixture')
   }
+  if wavelengths:
+    config['wavelengths'] = wavelengths
    
+  # (optional) content-addressed LUT store, root directory defaults to
+  # $SIXS_EMULATOR_STORE (see bin/LUT_store.py)
+  store = None
+  if args.store is not None:
+    store = LUT_Store(args.store or None)
+
   # handle output directory and filename
-  IO_handler(config, args)
+  IO_handler(config, args, store)
   
   # time check
   time0 = time.time()
   
   # BUILD the look up table!
-  if os.path.isfile(config['filepath']):
+  if LUT_is_current(config, store):
     print('LUT file already exists, skipping build for: '+config['filepath'])
   else:
     print('Building LUT:\n'+config['filepath'])
-    build_LUT(config)
+    profiler = Profiler(enabled=args.profile)
+    build_LUT(config, store, progressive=args.progressive, profiler=profiler)
     # .. this might take a while ..
+    profiler.write(config['filepath'])
       
   # time check
   T = time.time() - time0
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+LUT convolve
+
+Derives channel look up tables (.lut) from a spectral LUT (built with
+LUT_build.py --spectral) and spectral response functions, i.e. in seconds
+and without new 6S runs (see bin/spectral.py).
+
+Usage
+------
+
+$ python3 LUT_convolve.py path/to/spectral.lut {options}
+
+{options} include:
+
+--channel : name(s) of predefined Py6S sensor channels, e.g. S2A_MSI_01
+
+--srf     : csv file(s) of spectral response functions, first column is
+          : wavelength (microns), each other column is a channel (i.e. one
+          : file can hold all channels of a hyperspectral instrument)
+
+--sensor  : sensor name of --srf channels (default = user-defined-sensor)
+
+--store   : (optional) keep the LUTs in a content-addressed store,
+          : see bin/LUT_store.py
+
+Example Usage
+-------------
+
+  $ python3 LUT_convolve.py files/LUTs/spectral/Continental/view_zenith_0/spectral_0.4_2.5.lut --channel S2A_MSI_01 S2A_MSI_02
+
+  $ python3 LUT_convolve.py path/to/spectral.lut --srf my_sensor.csv --sensor MY_SENSOR
+
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'bin'))
+import spectral
+from LUT_store import LUT_Store, atomic_write, config_key
+
+
+def read_srfs(filepath):
+  """
+  Spectral response functions from a csv file, {name: (wavelengths, response)}
+  """
+  data = np.loadtxt(filepath, delimiter=',', comments='#', ndmin=2)
+  stem = os.path.splitext(os.path.basename(filepath))[0]
+  n = data.shape[1] - 1
+  digits = max(2, len(str(n)))
+  return {'{}_{:0{}d}'.format(stem, k+1, digits):(data[:, 0], data[:, k+1])
+          for k in range(n)}
+
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('spectral_LUT')
+  parser.add_argument('--channel','-c', nargs='*', default=[])
+  parser.add_argument('--srf', nargs='*', default=[])
+  parser.add_argument('--sensor')
+  parser.add_argument('--store','-s', nargs='?', const='')
+  args = parser.parse_args()
+
+  try:
+    with open(args.spectral_LUT, 'rb') as f:
+      spectral_LUT = pickle.load(f)
+  except Exception:
+    print('could not load spectral LUT: '+args.spectral_LUT)
+    sys.exit(1)
+  if 'wavelengths' not in spectral_LUT['config']:
+    print('not a spectral LUT (build with LUT_build.py --spectral): '+args.spectral_LUT)
+    sys.exit(1)
+
+  # spectral response functions (and sensor name) of each channel
+  channels = {}
+  sensors = {}
+  for channel in args.channel:
+    try:
+      channels[channel] = spectral.py6S_srf(channel)
+    except KeyError:
+      print('Satellite sensor channel not recognized: ',channel)
+      sys.exit(1)
+    sensors[channel] = '_'.join(channel.split('_')[:-1])
+  for filepath in args.srf:
+    srfs = read_srfs(filepath)
+    channels.update(srfs)
+    sensors.update(dict.fromkeys(srfs, args.sensor or 'user-defined-sensor'))
+
+  if not channels:
+    print('must define channel(s) or spectral response function file(s), returning..')
+    sys.exit(1)
+
+  # convolve (all channels at once)
+  time0 = time.time()
+  LUTs = spectral.channel_LUTs(spectral_LUT, channels)
+  print('Convolution of {} channel(s) took {:.2f} (secs)'.format(len(LUTs), time.time()-time0))
+
+  store = None
+  if args.store is not None:
+    store = LUT_Store(args.store or None)
+
+  # save channel LUTs (same layout as LUT_build)
+  base_path = os.path.dirname(os.path.abspath(__file__))
+  for name, LUT in LUTs.items():
+    config = LUT['config']
+    config['sensor'] = sensors[name]
+    if store is not None:
+      filepath = store.filepath(config_key(config), 'lut')
+    else:
+      filepath = os.path.join(base_path,'files','LUTs',config['sensor'],
+      config['aerosol_profile'],'view_zenith_{}'.format(config['view_zenith']),
+      config['filename'])
+    config['outdir'] = os.path.dirname(filepath)
+    config['filepath'] = filepath
+
+    write = lambda f: pickle.dump(LUT, f)
+    if store is not None:
+      store.put(config, 'lut', write, sensor=config['sensor'],
+                filename=config['filename'],
+                aerosol_profile=config['aerosol_profile'],
+                view_zenith=config['view_zenith'],
+                build_type=config.get('build_type'))
+    else:
+      atomic_write(filepath, write)
+    print('Saved: '+filepath)
+
+if __name__ == '__main__':
+  main()
@@ -8,7 +8,14 @@ in N dimensions.
 Purpose: Allows discrete look up tables to be used to calulate continuous
 solutions for atmospheric correction :)
 
-Output: Pickled interpolator object with file extension (.ilut)
+Output: Interpolated LUT files (.ilut), i.e. the grid and (a, b) values of
+each band as plain arrays (see bin/iLUT_io.py)
+
+Usage: $ python3 LUT_interpolate.py path/to/LUT_directory [--profile]
+
+--profile : writes cProfile statistics and tracemalloc peak memory and top
+            allocations of loading, interpolating and saving each LUT next
+            to its iLUT (.profile.txt and .prof files, see bin/profiling.py)
 
 """
 
@@ -16,39 +23,41 @@ import glob
 import os
 import pickle
 import sys
-import time
 import re
 
-from LUT_build import permutate_invars
-
-import numpy as np
-from scipy.interpolate import LinearNDInterpolator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'bin'))
+from parameter_space import permutate_invars
+import iLUT_io
+from profiling import Profiler
 
-def create_interpolator(filename):
+def create_interpolator(filename, profiler=None):
   """
   Loads a LUT file and creates an interpolated LUT object.
-  The interpolant is constructed by triangulating the input data using Qhull
-  and performing linear barycentric interpolation on each triangle
+  The interpolant splits each cell of the regular input grid into simplices
+  (Kuhn triangulation) and performs linear barycentric interpolation on each
+  simplex, so there is no triangulation to compute or store
   
+  profiler : (optional) Profiler of loading and interpolation
   """
+  profiler = profiler or Profiler()
   
   #load LUT
-  LUT = pickle.load(open(filename,"rb"))
+  with profiler.phase('load LUT'):
+    LUT = pickle.load(open(filename,"rb"))
 
   # LUT inputs (H2O, O3, etc.) and outputs (i.e. atmcorr coeffs)
   inputs = permutate_invars(LUT['config']['invars'])
   outputs = LUT['outputs']
 
   # piecewise linear interpolant in N dimensions
-  t = time.time()
-  interpolator = LinearNDInterpolator(inputs,outputs)
-  print('Interpolation took {:.2f} (secs) = '.format(time.time()-t))
+  with profiler.phase('interpolate'):
+    interpolator = iLUT_io.interpolate(LUT)
 
   # sanity check
   print('Quick check..')
   i = 0
   true   = (outputs[i][0],outputs[i][1])
-  interp = interpolator(inputs[i][0],inputs[i][1],inputs[i][2],inputs[i][3],inputs[i][4]) 
+  interp = interpolator(*inputs[i])
   print('true   = {0[0]:.2f} {0[1]:.2f}'.format(true))
   print('interp = {0[0]:.2f} {0[1]:.2f}'.format(interp))
   
@@ -58,9 +67,11 @@ def create_interpolator(filename):
 def main():
   
   args = sys.argv[1:]
+  profiler = Profiler(enabled='--profile' in args)
+  args = [arg for arg in args if arg != '--profile']
   
   if len(args) != 1:
-    print('usage: $ python3 LUT_interpolate.py  path/to/LUT_directory')
+    print('usage: $ python3 LUT_interpolate.py  path/to/LUT_directory [--profile]')
     sys.exit(1)
   else:
     lut_path = args[0]
@@ -92,14 +103,17 @@ def main():
     fid, ext = os.path.splitext(fname)
     ilut_filepath = os.path.join(ilut_path,fid+'.ilut')
     
-    if os.path.isfile(ilut_filepath):
+    # (a LUT newer than its iLUT is a later stage of a progressive build)
+    if os.path.isfile(ilut_filepath) and os.path.getmtime(ilut_filepath) >= os.path.getmtime(fname):
       print('iLUT file already exists (skipping interpolation): {}'
       .format(os.path.basename(ilut_filepath)))
     else:
       print('Interpolating: '+fname)
-      interpolator = create_interpolator(fname)
+      interpolator = create_interpolator(fname, profiler)
       
-      pickle.dump(interpolator, open(ilut_filepath, 'wb' ))
+      with profiler.phase('save iLUT'):
+        iLUT_io.save_iLUT(ilut_filepath, interpolator)
+      profiler.write(ilut_filepath)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+LUT surrogate
+
+Fits smooth surrogates (tensor product Chebyshev series, see
+bin/surrogate.py) to look up table (.lut) files, i.e. a few KB per band that
+can be used instead of an interpolated LUT (.ilut).
+
+Usage
+------
+
+$ python3 LUT_surrogate.py path/to/LUT_directory {options}
+
+{options} include:
+
+--degree     : degree of the series, one for all input variables or one
+             : per variable (solar_z, H2O, O3, AOT, alt and the aerosol
+             : mixture of mixture builds), default = 4
+
+--validation : (optional) directory of validation LUTs (i.e. built with
+             : --build_type validation), the relative error in surface
+             : reflectance of the surrogate (and of the linear iLUT) is
+             : measured and kept in the surrogate file
+
+Output: surrogate files (.surrogate) in the iLUTs directory
+
+Example Usage
+-------------
+
+  $ python3 LUT_surrogate.py files/LUTs/S2A_MSI/Continental/view_zenith_0 --validation files/LUTs/validation/S2A_MSI/Continental/view_zenith_0
+
+"""
+
+import argparse
+import glob
+import os
+import pickle
+import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'bin'))
+from surrogate import ChebyshevSurrogate, validation_error
+import iLUT_io
+
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('LUT_directory')
+  parser.add_argument('--degree', '-d', type=int, nargs='+', default=[4])
+  parser.add_argument('--validation', '-v')
+  args = parser.parse_args()
+
+  if len(args.degree) not in (1, 5, 6):
+    print('degree must be one number or one per input variable (five, or six with an aerosol mixture)')
+    sys.exit(1)
+  degree = args.degree[0] if len(args.degree) == 1 else args.degree
+
+  lut_path = os.path.abspath(args.LUT_directory)
+  fnames = sorted(glob.glob(os.path.join(lut_path, '*.lut')))
+  if len(fnames) == 0:
+    print('could not find .lut files in path: ' + lut_path)
+    sys.exit(1)
+
+  # surrogates are kept next to iLUTs (i.e. swap '/LUTs/' with '/iLUTs/')
+  match = re.search('LUTs', lut_path)
+  if match is None:
+    print('not a LUT directory (expected a path with /LUTs/): ' + lut_path)
+    sys.exit(1)
+  out_path = lut_path[0:match.start()]+'iLUTs'+lut_path[match.end():]
+  os.makedirs(out_path, exist_ok=True)
+
+  for fname in fnames:
+
+    fid = os.path.splitext(os.path.basename(fname))[0]
+    print('Fitting: '+os.path.basename(fname))
+    LUT = pickle.load(open(fname, 'rb'))
+    model = ChebyshevSurrogate.from_LUT(LUT, degree=degree)
+    print('  degrees = {}, size = {} bytes'.format(model.degrees, model.nbytes))
+
+    # error at the validation grid (compared to the linear iLUT)
+    if args.validation is not None:
+      validation_fname = os.path.join(args.validation, os.path.basename(fname))
+      if os.path.isfile(validation_fname):
+        validation_LUT = pickle.load(open(validation_fname, 'rb'))
+        model.validation = validation_error(model, validation_LUT)
+        linear = validation_error(iLUT_io.interpolate(LUT), validation_LUT)
+        print('  validation error: surrogate max = {:.2e}, mean = {:.2e} | linear max = {:.2e}, mean = {:.2e}'
+              .format(model.validation['max'], model.validation['mean'], linear['max'], linear['mean']))
+      else:
+        print('  validation LUT not found: '+validation_fname)
+
+    filepath = model.save(os.path.join(out_path, fid+'.surrogate'))
+    print('Saved: '+filepath)
+
+if __name__ == '__main__':
+  main()
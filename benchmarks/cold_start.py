@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+cold_start.py
+
+Measures the start up time of short-lived correction jobs, i.e. a fresh
+python process that imports the correction modules, constructs
+Interpolated_LUTs and loads iLUTs.
+
+Usage
+------
+
+$ python3 benchmarks/cold_start.py {mission} {runs}
+
+mission : satellite mission (default = COPERNICUS/S2)
+runs    : number of fresh processes per stage (default = 10)
+
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+bin_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'bin')
+
+# each stage runs in a fresh interpreter and includes the stages before it
+stages = [
+  ('python', 'pass'),
+  ('import interpolated_LUTs', 'from interpolated_LUTs import Interpolated_LUTs'),
+  ('construct', 'iLUTs = Interpolated_LUTs({mission!r})'),
+  ('import atmcorr', 'import atmcorr'),
+  ('get iLUTs', 'iLUTs.get()'),
+]
+
+# modules that should not be imported before they are needed
+heavy_modules = ['Py6S', 'scipy', 'urllib.request']
+
+def run(code):
+  """
+  wall time (secs) of a fresh python process running code
+  """
+  t = time.time()
+  subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL)
+  return time.time() - t
+
+def main():
+
+  args = sys.argv[1:]
+  mission = args[0] if len(args) > 0 else 'COPERNICUS/S2'
+  runs = int(args[1]) if len(args) > 1 else 10
+
+  lines = ['import sys', 'sys.path.insert(0, {!r})'.format(bin_path)]
+  print('{:<26} {:>10} {:>10}'.format('stage', 'median', 'min'))
+
+  for name, line in stages:
+    lines.append(line.format(mission=mission))
+    code = '\n'.join(lines)
+    times = [run(code) for i in range(runs)]
+    print('{:<26} {:>8.1f}ms {:>8.1f}ms'.format(name, 1000*np.median(times), 1000*np.min(times)))
+
+    # report heavy modules imported by this stage
+    check = code + '\nprint("imported:", *[m for m in {!r} if m in sys.modules])'.format(heavy_modules)
+    stdout = subprocess.run([sys.executable, '-c', check], check=True,
+                            capture_output=True, text=True).stdout
+    imported = stdout.split('imported:')[-1].split()
+    if imported:
+      print('{:<26} imported: {}'.format('', ', '.join(imported)))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,285 @@
+"""
+LUT_store.py
+
+Content-addressed storage of look up table files (.lut) and artifacts
+derived from them (e.g. interpolated .ilut files).
+
+Files are keyed by a hash of their build configuration (spectrum, aerosol
+profile, view zenith, input variables and code version), so a LUT built
+with a different configuration is never mistaken for an existing one.
+
+- writes are atomic (temporary file + rename), i.e. no partial files
+- an index file (index.json) maps keys to files for O(1) lookup
+- derived artifacts are evicted (least recently used first) to keep them
+  below a size limit, LUTs themselves are never evicted
+- the root directory can be anywhere (e.g. a shared NFS cache), set with
+  the SIXS_EMULATOR_STORE environment variable or the root argument
+
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+
+# bump when LUT_build output changes (i.e. invalidates existing LUTs)
+CODE_VERSION = '1'
+
+# artifacts that can be rebuilt from LUTs (and therefore evicted)
+DERIVED_KINDS = ['ilut', 'coupled_ilut']
+
+# umask of this process, read once (os.umask sets it process wide, i.e.
+# for all threads) to give atomically written files the usual permissions
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def config_key(config):
+  """
+  Hash of the parts of a build configuration that determine its LUT
+  """
+  identity = {
+    'spectrum':config['spectrum'],
+    'aerosol_profile':config['aerosol_profile'],
+    'view_zenith':config['view_zenith'],
+    'invars':{k:[float(x) for x in v] for k, v in config['invars'].items()},
+    'code_version':CODE_VERSION
+  }
+  canonical = json.dumps(identity, sort_keys=True, default=repr)
+  return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def atomic_write(filepath, write, mode='wb'):
+  """
+  Writes a file atomically, write(f) writes the content to a file object
+  """
+  dirname = os.path.dirname(filepath)
+  if dirname and not os.path.isdir(dirname):
+    os.makedirs(dirname, exist_ok=True)
+  fd, tmp_filepath = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+  try:
+    with os.fdopen(fd, mode) as f:
+      write(f)
+      f.flush()
+      os.fsync(f.fileno())
+      # (mkstemp creates files readable by their owner only)
+      if hasattr(os, 'fchmod'):
+        os.fchmod(f.fileno(), 0o666 & ~UMASK)
+    os.replace(tmp_filepath, filepath)
+  except BaseException:
+    if os.path.exists(tmp_filepath):
+      os.remove(tmp_filepath)
+    raise
+
+
+def file_sha256(filepath):
+  """
+  sha256 checksum of a file
+  """
+  h = hashlib.sha256()
+  with open(filepath, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+class LUT_Store:
+  """
+  Content-addressed store of (i)LUT files
+
+  root      : store directory (default = $SIXS_EMULATOR_STORE or files/store)
+  max_bytes : (optional) size limit of derived artifacts (e.g. .ilut files)
+  """
+
+  def __init__(self, root=None, max_bytes=None):
+
+    if root is None:
+      root = os.environ.get('SIXS_EMULATOR_STORE')
+    if root is None:
+      base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+      root = os.path.join(base_path, 'files', 'store')
+    self.root = os.path.abspath(os.path.expanduser(root))
+    self.max_bytes = max_bytes
+    self.index_path = os.path.join(self.root, 'index.json')
+
+  def filepath(self, key, kind):
+    """
+    Location of an artifact in the store
+    """
+    return os.path.join(self.root, 'objects', key[:2], '{}.{}'.format(key, kind))
+
+  @contextlib.contextmanager
+  def _locked(self):
+    """
+    Exclusive lock of the index (shared between processes and hosts)
+    """
+    os.makedirs(self.root, exist_ok=True)
+    with open(os.path.join(self.root, 'index.lock'), 'a') as lock:
+      if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        if fcntl is not None:
+          fcntl.flock(lock, fcntl.LOCK_UN)
+
+  def index(self):
+    """
+    Index of the store, {key: {kind: entry}}
+    """
+    try:
+      with open(self.index_path, 'r') as f:
+        return json.load(f)
+    except (FileNotFoundError, ValueError):
+      return {}
+
+  def _write_index(self, index):
+    atomic_write(self.index_path, lambda f: json.dump(index, f), mode='w')
+
+  def get(self, config, kind='lut', verify=False):
+    """
+    Path of a stored artifact for a build configuration, or None if it is
+    missing or invalid (i.e. stale or partial). verify=True also compares
+    the file checksum.
+    """
+    return self.lookup(config_key(config), kind, verify=verify)
+
+  def lookup(self, key, kind='lut', verify=False, index=None):
+    """
+    Path of a stored artifact by key (see get), index is an (optional)
+    index already read
+    """
+
+    if index is None:
+      index = self.index()
+    entry = index.get(key, {}).get(kind)
+    if entry is None:
+      return None
+
+    filepath = self.filepath(key, kind)
+    try:
+      if os.path.getsize(filepath) != entry['size']:
+        return None
+      if verify and file_sha256(filepath) != entry['sha256']:
+        return None
+    except OSError:
+      return None
+
+    # last access (for eviction), best-effort as files in a shared store
+    # may belong to another user
+    with contextlib.suppress(OSError):
+      os.utime(filepath)
+
+    return filepath
+
+  def put(self, config, kind, write, **meta):
+    """
+    Stores an artifact atomically, write(f) writes its content to a file
+    object. Extra keyword arguments are kept in the index (e.g. filename).
+    """
+
+    key = config_key(config)
+    filepath = self.filepath(key, kind)
+    atomic_write(filepath, write)
+    self.register(config, kind, **meta)
+
+    if kind in DERIVED_KINDS:
+      self.evict(keep=[(key, kind)])
+
+    return filepath
+
+  def register(self, config, kind, **meta):
+    """
+    Adds an artifact that was (atomically) written to its store path
+    """
+
+    key = config_key(config)
+    filepath = self.filepath(key, kind)
+    entry = {
+      'size':os.path.getsize(filepath),
+      'sha256':file_sha256(filepath),
+      'created':time.time(),
+      'meta':meta
+    }
+
+    with self._locked():
+      index = self.index()
+      index.setdefault(key, {})[kind] = entry
+      self._write_index(index)
+
+    return filepath
+
+  def refresh(self, filepath):
+    """
+    Updates the index entry of an artifact that was rewritten in place
+    (e.g. converted to a new file format)
+    """
+
+    key, ext = os.path.splitext(os.path.basename(filepath))
+    kind = ext[1:]
+
+    with self._locked():
+      index = self.index()
+      entry = index.get(key, {}).get(kind)
+      if entry is not None:
+        entry['size'] = os.path.getsize(filepath)
+        entry['sha256'] = file_sha256(filepath)
+        self._write_index(index)
+
+  def find(self, kind='lut', **meta):
+    """
+    (key, path) of stored artifacts of a kind with matching meta data,
+    e.g. find('lut', sensor='S2A_MSI')
+    """
+    found = []
+    for key, entries in sorted(self.index().items()):
+      entry = entries.get(kind)
+      if entry and all(entry['meta'].get(k) == v for k, v in meta.items()):
+        found.append((key, self.filepath(key, kind)))
+    return found
+
+  def evict(self, keep=()):
+    """
+    Removes least recently used derived artifacts until they fit in max_bytes
+    (except those in keep, i.e. a list of (key, kind))
+    """
+
+    if self.max_bytes is None:
+      return
+
+    with self._locked():
+      index = self.index()
+
+      derived = []
+      for key, entries in index.items():
+        for kind in DERIVED_KINDS:
+          if kind in entries:
+            filepath = self.filepath(key, kind)
+            try:
+              last_access = os.path.getmtime(filepath)
+            except OSError:
+              last_access = 0
+            derived.append((last_access, key, kind, entries[kind]['size']))
+
+      total = sum(d[3] for d in derived)
+      for last_access, key, kind, size in sorted(derived):
+        if total <= self.max_bytes:
+          break
+        if (key, kind) in keep:
+          continue
+        with contextlib.suppress(FileNotFoundError):
+          os.remove(self.filepath(key, kind))
+        del index[key][kind]
+        if not index[key]:
+          del index[key]
+        total -= size
+
+      self._write_index(index)
@@ -0,0 +1,145 @@
+"""
+async_LUTs.py
+
+Asyncio versions of loading, interpolating and downloading look up tables,
+for use in event loops (e.g. ingest services) that must not be blocked.
+
+Blocking work (file reads, unpickling, interpolation, downloads) runs in an
+executor, with a limit on how many files are handled at once. Downloads for
+several missions run concurrently and stop at the next chunk if cancelled.
+Loading, interpolating and downloading are profiled as in Interpolated_LUTs
+(profile=True), see profiling.py.
+
+Example
+-------
+
+  import asyncio
+  from async_LUTs import AsyncInterpolated_LUTs, download_all_LUTs
+
+  async def provision():
+    await download_all_LUTs(['COPERNICUS/S2', 'LANDSAT/LC8'])
+    iLUTs = AsyncInterpolated_LUTs('COPERNICUS/S2')
+    await iLUTs.interpolate_LUTs_async()
+    return await iLUTs.get_async()
+
+"""
+
+import asyncio
+import functools
+import threading
+
+from interpolated_LUTs import Interpolated_LUTs
+
+
+class AsyncInterpolated_LUTs(Interpolated_LUTs):
+  """
+  Interpolated_LUTs with coroutine versions of get, interpolate_LUTs
+  and download_LUTs
+
+  max_concurrency : number of (i)LUT files loaded or interpolated at once
+  executor        : (optional) concurrent.futures executor, e.g. a process
+                    pool for interpolation, default is the loop's executor
+
+  Other options (e.g. coupled, aerosol_profile) are those of Interpolated_LUTs.
+  """
+
+  def __init__(self, mission, max_concurrency=4, executor=None, store=None, **kwargs):
+    super().__init__(mission, store=store, **kwargs)
+    self.max_concurrency = max_concurrency
+    self.executor = executor
+
+  async def _run(self, semaphore, func, *args, **kwargs):
+    """
+    Runs a blocking function in the executor (once semaphore allows)
+    """
+    async with semaphore:
+      loop = asyncio.get_running_loop()
+      return await loop.run_in_executor(self.executor,
+                                        functools.partial(func, *args, **kwargs))
+
+  async def get_async(self, dtype=None, method=None):
+    """
+    Loads interpolated look up tables, see Interpolated_LUTs.get()
+    """
+
+    filepaths = await asyncio.to_thread(self.iLUT_filepaths)
+    if not filepaths:
+      print('Looked for iLUTs but did not find in:\n{}'.format(self.iLUTs_dir))
+      self.iLUTs = {}
+      return self.iLUTs
+
+    semaphore = asyncio.Semaphore(self.max_concurrency)
+    load = functools.partial(self._load_profiled, dtype=dtype, method=method)
+    tasks = [asyncio.ensure_future(self._run(semaphore, load, f)) for f in filepaths]
+    iLUTs = await _gather(tasks)
+
+    self.iLUTs = {self.bandName(f):iLUT for f, iLUT in zip(filepaths, iLUTs)}
+    return self.iLUTs
+
+  def _load_profiled(self, filepath, dtype=None, method=None):
+    """
+    Loads an iLUT (in the executor) and writes its profile, if enabled
+    """
+    with self.profiler.phase('load iLUT'):
+      iLUT = self.load_iLUT(filepath, dtype=dtype, method=method)
+    self.profiler.write(filepath)
+    return iLUT
+
+  async def interpolate_LUTs_async(self):
+    """
+    Interpolates look up tables, see Interpolated_LUTs.interpolate_LUTs()
+    """
+
+    filepaths = await asyncio.to_thread(self.LUT_filepaths)
+    if not filepaths:
+      print('LUTs directory: ',self.LUTs_dir)
+      print('LUT files (.lut) not found in LUTs directory, try downloading?')
+      return
+
+    semaphore = asyncio.Semaphore(self.max_concurrency)
+    tasks = [asyncio.ensure_future(self._run(semaphore, self.interpolate_LUT, f))
+             for f in filepaths]
+    await _gather(tasks)
+
+  async def download_LUTs_async(self):
+    """
+    Downloads look up tables, see Interpolated_LUTs.download_LUTs().
+    If cancelled, the download stops at its next chunk.
+    """
+
+    cancelled = threading.Event()
+    task = asyncio.ensure_future(asyncio.to_thread(self.download_LUTs, cancelled))
+    try:
+      await asyncio.shield(task)
+    except asyncio.CancelledError:
+      cancelled.set()
+      raise
+
+
+async def download_all_LUTs(missions):
+  """
+  Downloads the look up tables of several missions concurrently
+  """
+
+  # one download per Py6S sensor (e.g. Landsat 4 and 5 share their LUTs)
+  sensors = {}
+  for mission in missions:
+    iLUTs = AsyncInterpolated_LUTs(mission)
+    sensors.setdefault(iLUTs.py6S_sensor, iLUTs)
+
+  tasks = [asyncio.ensure_future(iLUTs.download_LUTs_async())
+           for iLUTs in sensors.values()]
+  await _gather(tasks)
+
+
+async def _gather(tasks):
+  """
+  Gathers tasks, cancelling the others if one fails or is cancelled
+  """
+  try:
+    return await asyncio.gather(*tasks)
+  except BaseException:
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    raise
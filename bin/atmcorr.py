@@ -0,0 +1,666 @@
+"""
+atmcorr.py
+
+Vectorized atmospheric correction using interpolated look up tables (iLUTs),
+i.e. surface reflectance from at-sensor radiance (L) for whole scenes:
+
+  surface_reflectance = (L - a) / b
+
+or, with surface-atmosphere coupling (coupled iLUTs, S = spherical albedo):
+
+  y = (L - a) / b
+  surface_reflectance = y / (1 + S*y)
+
+Everything can run in single precision (dtype=np.float32), from the table
+through interpolation to reflectance, which halves memory traffic on large
+scenes. Sensor data can be passed as radiance or as digital numbers (DN).
+
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from grid_interpolator import GridInterpolator
+
+
+def elliptical_orbit_correction(doy):
+  """
+  Earth-Sun distance correction of coefficients (built at perihelion)
+  for a given day of year
+  """
+  return 0.03275104*np.cos(np.asarray(doy)/59.66638337) + 0.96804905
+
+
+def as_grid_interpolator(iLUT, dtype):
+  """
+  iLUT as a GridInterpolator of a given dtype (no copy if it already is),
+  surrogates (see surrogate.py) are used as they are
+  """
+  from surrogate import ChebyshevSurrogate
+
+  if isinstance(iLUT, ChebyshevSurrogate):
+    return iLUT if dtype is None or iLUT.dtype == dtype else iLUT.astype(dtype)
+  return GridInterpolator.from_interpolator(iLUT, dtype=dtype)
+
+
+def unique_inputs(grid, invars, tolerance=0):
+  """
+  Unique combinations of input variables (after binning each variable to a
+  tolerance), i.e. (shape, points, inverse) where points[inverse] are the
+  (binned) inputs of each pixel, flattened to the broadcast shape.
+
+  tolerance : bin width of all variables or a dictionary of {name: width},
+              e.g. {'AOT':0.01, 'alt':0.01}, 0 means exact values
+  """
+
+  if not isinstance(tolerance, dict):
+    tolerance = {name:tolerance for name in grid.names}
+  unknown = set(tolerance) - set(grid.names)
+  if unknown:
+    raise ValueError('unknown input variable(s): {}'.format(sorted(unknown)))
+
+  arrays = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in invars])
+  shape = arrays[0].shape
+
+  # integer code of each variable's (binned) value
+  levels = []
+  codes = []
+  for name, x in zip(grid.names, arrays):
+    x = x.ravel()
+    tol = tolerance.get(name, 0)
+    if tol:
+      # clipped to the range of the inputs, so that binning never moves
+      # a value past a grid edge (e.g. alt = 7.75 to 7.8 for a 0.1 bin)
+      finite = x[np.isfinite(x)]
+      x = np.round(x / tol) * tol
+      if finite.size:
+        x = np.clip(x, finite.min(), finite.max())
+    level, code = np.unique(x, return_inverse=True)
+    levels.append(level)
+    codes.append(code.ravel())
+
+  # one key per combination (mixed radix of the codes)
+  sizes = tuple(len(level) for level in levels)
+  if np.prod(sizes, dtype=np.float64) < 2**63:
+    key = np.ravel_multi_index(codes, sizes)
+    key, inverse = np.unique(key, return_inverse=True)
+    codes = np.unravel_index(key, sizes)
+  else:
+    codes, inverse = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+    codes = codes.T
+
+  points = np.stack([level[code] for level, code in zip(levels, codes)], axis=1)
+
+  return shape, points, inverse.ravel()
+
+
+def correction_coefficients(iLUT, solar_z, H2O, O3, AOT, alt, doy=None, dtype=None,
+                            policy=None, report=None, tolerance=None,
+                            aerosol_mixture=None):
+  """
+  Atmospheric correction coefficients (a, b) for arrays of input variables.
+
+  iLUT      : interpolated look up table (LinearNDInterpolator or GridInterpolator)
+  doy       : (optional) day of year, applies the elliptical orbit correction
+  dtype     : (optional) e.g. np.float32 for a single precision table,
+              interpolation and output
+  policy    : (optional) out-of-range policy, e.g. 'clamp' or {'alt':'clamp'},
+              see GridInterpolator
+  report    : (optional) dictionary, gets the out-of-range counts
+  tolerance : (optional) interpolate only unique combinations of inputs,
+              after binning them to a tolerance (see unique_inputs), the
+              report gets the dedup ratio (pixels per unique combination)
+  aerosol_mixture : aerosol mixture coordinate (e.g. a per pixel map) for
+              iLUTs of an aerosol mixture build, 0 = Maritime, 1 =
+              Continental, 2 = Urban (see parameter_space.aerosol_mixture)
+  """
+
+  coeffs = interpolate(iLUT, solar_z, H2O, O3, AOT, alt, doy=doy, dtype=dtype,
+                       policy=policy, report=report, tolerance=tolerance,
+                       aerosol_mixture=aerosol_mixture)
+
+  return coeffs[..., 0], coeffs[..., 1]
+
+
+def interpolate(iLUT, solar_z, H2O, O3, AOT, alt, doy=None, dtype=None,
+                policy=None, report=None, tolerance=None, aerosol_mixture=None):
+  """
+  All values of an iLUT, e.g. (a, b) or (a, b, spherical albedo) of coupled
+  iLUTs, in a trailing axis (see correction_coefficients for the options)
+  """
+
+  invars = _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture)
+  if tolerance is not None:
+    coeffs = _unique_coefficients(as_grid_interpolator(iLUT, dtype),
+                                  invars, tolerance, policy, report)
+  elif dtype is not None or policy is not None or report is not None:
+    iLUT = as_grid_interpolator(iLUT, dtype)
+    coeffs = iLUT(*invars, policy=policy, report=report)
+  else:
+    coeffs = iLUT(*invars)
+
+  # elliptical orbit correction (of a and b)
+  if doy is not None:
+    correction = elliptical_orbit_correction(doy).astype(coeffs.dtype)
+    coeffs[..., :2] *= correction[..., None]
+
+  return coeffs
+
+
+def _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture=None):
+  """
+  Input variables of an iLUT (with the aerosol mixture of mixture builds)
+  """
+  invars = [solar_z, H2O, O3, AOT, alt]
+  if aerosol_mixture is not None:
+    invars.append(aerosol_mixture)
+  return invars
+
+
+def _unique_coefficients(grid, invars, tolerance, policy, report):
+  """
+  Coefficients interpolated at unique inputs and scattered back to pixels
+  """
+
+  shape, points, inverse = unique_inputs(grid, invars, tolerance)
+  coeffs = grid(points, policy=policy)[inverse].reshape(shape + grid.value_shape)
+
+  if report is not None:
+
+    # out-of-range counts of pixels (rather than of unique inputs)
+    multiplicity = np.bincount(inverse, minlength=len(points))
+    counts = [multiplicity[~((x >= ax[0]) & (x <= ax[-1]))].sum()
+              for x, ax in zip(points.T, grid.axes)]
+    grid._report(counts, grid._policies(policy), report)
+
+    report['dedup_ratio'] = len(inverse) / max(len(points), 1)
+
+  return coeffs
+
+
+def correction_gradients(iLUT, solar_z, H2O, O3, AOT, alt, doy=None, dtype=None,
+                         policy=None, report=None, aerosol_mixture=None):
+  """
+  Correction coefficients and their partial derivatives with respect to
+  the input variables, i.e. (a, b, da, db) where da and db have a trailing
+  axis of (solar_z, H2O, O3, AOT, alt[, aerosol_mixture]), from the simplex
+  each pixel is interpolated in (see GridInterpolator.gradient). Options
+  are those of correction_coefficients.
+  """
+
+  grid = as_grid_interpolator(iLUT, dtype)
+  coeffs, jacobian = grid.gradient(*_invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture),
+                                   policy=policy, report=report)
+
+  if doy is not None:
+    correction = elliptical_orbit_correction(doy).astype(coeffs.dtype)
+    coeffs[..., :2] *= correction[..., None]
+    jacobian[..., :2, :] *= correction[..., None, None]
+
+  return coeffs[..., 0], coeffs[..., 1], jacobian[..., 0, :], jacobian[..., 1, :]
+
+
+def radiance_from_DN(DN, gain, offset=0, dtype=np.float32):
+  """
+  At-sensor radiance from digital numbers (e.g. uint16), i.e. L = DN*gain + offset
+  """
+  L = np.multiply(DN, gain, dtype=dtype)
+  L += np.asarray(offset, dtype=dtype)
+  return L
+
+
+def surface_reflectance(L, a, b, dtype=None, out=None):
+  """
+  Surface reflectance from at-sensor radiance and correction coefficients
+  """
+  if dtype is None:
+    dtype = np.result_type(a, b)
+  ref = np.subtract(L, a, out=out, dtype=dtype)
+  return np.divide(ref, b, out=ref if np.ndim(ref) else None)
+
+
+def coupled_surface_reflectance(L, a, b, S, dtype=None, out=None):
+  """
+  Surface reflectance with surface-atmosphere coupling (S = spherical albedo)
+  """
+  y = surface_reflectance(L, a, b, dtype=dtype, out=out)
+  denominator = 1 + S*y
+  return np.divide(y, denominator, out=y if np.ndim(y) else None)
+
+
+def valid_pixels(mask, mask_bits=None):
+  """
+  Valid pixels of a mask, which is either boolean (True = skip pixel, e.g.
+  nodata or cloud) or integer (e.g. a QA band) where a pixel is skipped if
+  any of mask_bits are set, e.g. mask_bits=(1 << 10) | (1 << 11)
+  """
+  mask = np.asarray(mask)
+  if mask.dtype == bool:
+    return ~mask
+  if mask_bits is None:
+    raise ValueError('mask_bits are needed for an integer (bit) mask')
+  return (mask & mask_bits) == 0
+
+
+def _compress(x, shape, index):
+  """
+  Values of an array (broadcast to shape) at flat indices, scalars as they are
+  """
+  if np.ndim(x) == 0:
+    return x
+  return np.broadcast_to(x, shape).reshape(-1)[index]
+
+
+def correct(iLUT, L, solar_z, H2O, O3, AOT, alt, doy=None, dtype=None,
+            gain=None, offset=0, policy=None, report=None, tolerance=None,
+            mask=None, mask_bits=None, fill_value=np.nan, coupled=False,
+            aerosol_mixture=None):
+  """
+  Surface reflectance for arrays of radiance (or DN if gain is given)
+  and input variables (see correction_coefficients for the options)
+
+  coupled    : surface-atmosphere coupling, needs a coupled iLUT (i.e.
+               Interpolated_LUTs(mission, coupled=True))
+  aerosol_mixture : (optional) aerosol mixture coordinate of each pixel, for
+               iLUTs of an aerosol mixture build, i.e. an aerosol type map
+               is corrected in one pass (see correction_coefficients)
+
+  mask       : (optional) pixels to skip, see valid_pixels, only the valid
+               pixels are interpolated and corrected
+  fill_value : surface reflectance of skipped pixels
+  report     : (optional) dictionary, also gets the valid fraction of pixels
+  """
+
+  if mask is not None:
+    valid = valid_pixels(mask, mask_bits)
+    invars = [L, solar_z, H2O, O3, AOT, alt, doy, aerosol_mixture]
+    shape = np.broadcast_shapes(valid.shape, *[np.shape(x) for x in invars if x is not None])
+    index = np.flatnonzero(np.broadcast_to(valid, shape))
+    invars = [None if x is None else _compress(x, shape, index) for x in invars]
+    doy, aerosol_mixture = invars[6:]
+
+    ref = correct(iLUT, *invars[:6], doy=doy, dtype=dtype, gain=gain, offset=offset,
+                  policy=policy, report=report, tolerance=tolerance, coupled=coupled,
+                  aerosol_mixture=aerosol_mixture)
+
+    out = np.full(shape, fill_value, dtype=ref.dtype)
+    out.reshape(-1)[index] = ref
+    if report is not None:
+      report['valid_fraction'] = len(index) / max(out.size, 1)
+    return out
+
+  if gain is not None:
+    L = radiance_from_DN(L, gain, offset, dtype=dtype or np.float32)
+
+  coeffs = interpolate(iLUT, solar_z, H2O, O3, AOT, alt, doy=doy, dtype=dtype,
+                       policy=policy, report=report, tolerance=tolerance,
+                       aerosol_mixture=aerosol_mixture)
+
+  if coupled:
+    if coeffs.shape[-1] < 3:
+      raise ValueError('coupled correction needs an iLUT of (a, b, spherical albedo)')
+    return coupled_surface_reflectance(L, coeffs[..., 0], coeffs[..., 1], coeffs[..., 2])
+
+  return surface_reflectance(L, coeffs[..., 0], coeffs[..., 1])
+
+
+def correct_parallel(iLUT, L, solar_z, H2O, O3, AOT, alt, doy=None, dtype=None,
+                     threads=None, tile_rows=256, policy=None, report=None,
+                     mask=None, mask_bits=None, fill_value=np.nan,
+                     aerosol_mixture=None):
+  """
+  Surface reflectance of a scene (L has shape (rows, ...)) using a pool of
+  threads, each correcting a tile of rows with the fused kernel of
+  GridInterpolator.reflectance (which releases the GIL if numba is installed)
+
+  mask, mask_bits, fill_value : (optional) pixels to skip, see correct
+  aerosol_mixture             : (optional) see correct
+  """
+
+  grid = as_grid_interpolator(iLUT, dtype)
+  L = np.asarray(L)
+  invars = [np.broadcast_to(np.asarray(x, dtype=grid.dtype), L.shape)
+            for x in _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture)]
+  correction = np.ones(1, dtype=grid.dtype)
+  if doy is not None:
+    correction = np.broadcast_to(elliptical_orbit_correction(doy).astype(grid.dtype), L.shape)
+
+  out = np.empty(L.shape, dtype=grid.dtype)
+  valid = None
+  if mask is not None:
+    valid = np.broadcast_to(valid_pixels(mask, mask_bits), L.shape)
+
+  def correct_tile(start):
+    tile = slice(start, start + tile_rows)
+    tile_report = {}
+    tile_correction = correction if correction.size == 1 else correction[tile]
+
+    if valid is None:
+      grid.reflectance(L[tile], *[x[tile] for x in invars],
+                       correction=tile_correction,
+                       out=out[tile], policy=policy, report=tile_report)
+      return tile_report
+
+    # valid pixels only (compressed)
+    shape = L[tile].shape
+    index = np.flatnonzero(valid[tile])
+    tile_out = out[tile].reshape(-1)
+    tile_out[:] = fill_value
+    tile_out[index] = grid.reflectance(
+      _compress(L[tile], shape, index), *[_compress(x[tile], shape, index) for x in invars],
+      correction=_compress(tile_correction, shape, index) if tile_correction.size > 1 else tile_correction,
+      policy=policy, report=tile_report)
+    return tile_report
+
+  with ThreadPoolExecutor(threads or os.cpu_count()) as pool:
+    tile_reports = list(pool.map(correct_tile, range(0, L.shape[0], tile_rows)))
+
+  if report is not None:
+    out_of_range = report.setdefault('out_of_range', dict.fromkeys(grid.names, 0))
+    for tile_report in tile_reports:
+      for name, count in tile_report['out_of_range'].items():
+        out_of_range[name] = out_of_range.get(name, 0) + count
+    if valid is not None:
+      report['valid_fraction'] = int(np.count_nonzero(valid)) / max(valid.size, 1)
+
+  return out
+
+
+def correct_uncertainty(iLUT, L, solar_z, H2O, O3, AOT, alt, sigma, doy=None,
+                        dtype=None, coupled=False, method='linear', samples=256,
+                        seed=0, block_size=None, policy=None, report=None,
+                        aerosol_mixture=None):
+  """
+  Surface reflectance and its uncertainty (1 sigma), i.e. (ρ, σ_ρ), from
+  the uncertainties of the input variables (and radiance), assumed
+  independent and normally distributed.
+
+  sigma      : dictionary of {name: sigma} (scalars or arrays broadcastable
+               to the pixels) of input variables and/or 'L', e.g.
+               {'AOT':0.05, 'H2O':0.2*H2O, 'O3':0.02}
+  method     : 'linear'      - first order propagation through ρ = (L - a)/b
+                               using the iLUT gradients (see correction_gradients)
+               'monte_carlo' - std of ρ over random samples of the inputs,
+                               all samples of a block of pixels in one call
+  samples    : number of Monte Carlo samples per pixel
+  block_size : pixels per block (default is one interpolator chunk of points)
+  policy     : out-of-range policy, with 'monte_carlo' samples beyond the grid
+               are NaN (and so is σ_ρ) unless e.g. policy='clamp'
+
+  Other options are those of correct (coupled needs a coupled iLUT).
+  """
+
+  grid = as_grid_interpolator(iLUT, dtype)
+  if method not in ('linear', 'monte_carlo'):
+    raise ValueError("method not recognized: {} (use 'linear' or 'monte_carlo')".format(method))
+  unknown = set(sigma) - set(grid.names) - {'L'}
+  if unknown:
+    raise ValueError('unknown input variable(s): {}'.format(sorted(unknown)))
+  if coupled and grid.value_shape[-1:] != (3,):
+    raise ValueError('coupled correction needs an iLUT of (a, b, spherical albedo)')
+
+  # flat columns of pixels (scalars as they are)
+  invars = [L] + _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture)
+  if len(invars) != grid.ndim + 1:
+    raise ValueError('expected {} input variables, got {} (aerosol_mixture is one '
+                     'of mixture iLUTs)'.format(grid.ndim, len(invars) - 1))
+  correction = None if doy is None else elliptical_orbit_correction(doy)
+  sigmas = [sigma.get(name, 0) for name in ['L'] + grid.names]
+  arrays = [np.asarray(x, dtype=grid.dtype) for x in invars + sigmas + [correction if doy is not None else 1]]
+  shape = np.broadcast_shapes(*[x.shape for x in arrays])
+  n = int(np.prod(shape))
+  columns = [x if x.ndim == 0 else np.broadcast_to(x, shape).reshape(-1) for x in arrays]
+
+  d = grid.ndim
+  if block_size is None:
+    block_size = grid.chunk_size if method == 'linear' else max(1, grid.chunk_size // samples)
+  rng = np.random.RandomState(seed)
+  ρ = np.empty(n, dtype=grid.dtype)
+  σ = np.empty(n, dtype=grid.dtype)
+
+  for start in range(0, n, block_size):
+    stop = min(start + block_size, n)
+    block = [x if x.ndim == 0 else x[start:stop] for x in columns]
+    L_block, x, s, c = block[0], block[1:d + 1], block[d + 1:2*d + 2], block[-1]
+
+    if method == 'linear':
+      values, jacobian = grid.gradient(*x, policy=policy, report=report)
+      values[..., :2] *= c[..., None]
+      jacobian[..., :2, :] *= c[..., None, None]
+      ρ[start:stop], dρ_dL, dρ_dx = _reflectance_derivatives(L_block, values, jacobian, coupled)
+      variance = (dρ_dL*s[0])**2
+      for k in range(d):
+        variance = variance + (dρ_dx[..., k]*s[k + 1])**2
+      σ[start:stop] = np.sqrt(variance)
+
+    else:
+      m = stop - start
+      values = grid(*x, policy=policy, report=report)
+      values[..., :2] *= c[..., None]
+      ρ[start:stop] = _reflectance(L_block, values, coupled)
+      if not any(np.any(sv) for sv in s):
+        σ[start:stop] = 0
+        continue
+
+      # all samples of the block at once, i.e. (samples, pixels)
+      drawn = [np.broadcast_to(v, (m,)) + rng.standard_normal((samples, m)).astype(grid.dtype)*sv
+               if np.any(sv) else v for v, sv in zip([L_block] + x, s)]
+      values = grid(*drawn[1:], policy=policy)
+      values[..., :2] *= c[..., None]
+      σ[start:stop] = np.std(_reflectance(drawn[0], values, coupled), axis=0, ddof=1)
+
+  return ρ.reshape(shape), σ.reshape(shape)
+
+
+def _reflectance(L, values, coupled):
+  """
+  Surface reflectance from radiance and iLUT values (a, b[, S])
+  """
+  if coupled:
+    return coupled_surface_reflectance(L, values[..., 0], values[..., 1], values[..., 2])
+  return surface_reflectance(L, values[..., 0], values[..., 1])
+
+
+def _reflectance_derivatives(L, values, jacobian, coupled):
+  """
+  Surface reflectance and its derivatives with respect to radiance and to
+  the input variables (trailing axis), from iLUT values and their jacobian
+  """
+  a, b = values[..., 0], values[..., 1]
+  y = (L - a) / b
+  dy_dL = 1 / b
+  dy_dx = -(jacobian[..., 0, :] + y[..., None]*jacobian[..., 1, :]) / b[..., None]
+  if not coupled:
+    return y, dy_dL, dy_dx
+
+  # ρ = y/(1 + S*y)
+  S = values[..., 2]
+  denominator = 1 + S*y
+  dρ_dy = 1 / denominator**2
+  dρ_dS = -(y / denominator)**2
+  dρ_dx = dρ_dy[..., None]*dy_dx + dρ_dS[..., None]*jacobian[..., 2, :]
+  return y / denominator, dρ_dy*dy_dL, dρ_dx
+
+
+def coarse_nodes(n, step):
+  """
+  Coarse grid nodes along an axis of n pixels (every step pixels plus the last)
+  """
+  nodes = np.arange(0, n, step)
+  if nodes[-1] != n - 1:
+    nodes = np.append(nodes, n - 1)
+  return nodes
+
+
+def upsampling_weights(n, nodes, dtype=np.float64):
+  """
+  Lower node (index) and linear weight of the upper node for each of n pixels
+  """
+  pixels = np.arange(n)
+  if len(nodes) == 1:
+    return np.zeros(n, dtype=np.intp), np.zeros(n, dtype=dtype)
+  lower = np.clip(np.searchsorted(nodes, pixels, side='right') - 1, 0, len(nodes) - 2)
+  weight = (pixels - nodes[lower]) / (nodes[lower + 1] - nodes[lower])
+  return lower, weight.astype(dtype)
+
+
+def correct_coarse(iLUT, L, solar_z, H2O, O3, AOT, alt, doy=None, dtype=None,
+                   step=100, block_rows=256, policy=None, report=None,
+                   error_samples=1000, seed=0, aerosol_mixture=None):
+  """
+  Surface reflectance of a scene (L has shape (rows, cols)) with correction
+  coefficients evaluated on a coarse grid (every step pixels) and bilinearly
+  upsampled to sensor resolution, one block of rows at a time.
+
+  Input variables (and aerosol_mixture of mixture iLUTs) are arrays
+  broadcastable to L (e.g. rasters resampled to the scene, or scalars),
+  they are sampled at the coarse grid nodes.
+
+  step          : coarse grid step in pixels (e.g. 100 = 1 km for 10 m pixels)
+  block_rows    : rows upsampled and corrected at a time (i.e. memory use)
+  report        : (optional) dictionary, gets the out-of-range counts (of the
+                  nodes), the coarse grid shape and the error of upsampling,
+                  i.e. report['coarse_error'] = {'max', 'mean'} absolute
+                  reflectance difference from per-pixel coefficients
+  error_samples : number of random pixels used for the error (0 = no error)
+  """
+
+  L = np.asarray(L)
+  if L.ndim != 2:
+    raise ValueError('expected a (rows, cols) scene, got shape {}'.format(L.shape))
+
+  rows = coarse_nodes(L.shape[0], step)
+  cols = coarse_nodes(L.shape[1], step)
+  nodes = np.ix_(rows, cols)
+
+  def sample(x):
+    return np.broadcast_to(np.asarray(x), L.shape)[nodes]
+
+  # coefficients at the coarse grid nodes
+  invars = _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture)
+  a, b = _sampled_coefficients(iLUT, invars, doy, sample, dtype=dtype,
+                               policy=policy, report=report)
+  dtype = a.dtype
+
+  # upsample along columns once (i.e. coarse rows at full width)
+  col_lower, col_weight = upsampling_weights(L.shape[1], cols, dtype)
+  a = a[:, col_lower]*(1 - col_weight) + a[:, np.minimum(col_lower + 1, len(cols) - 1)]*col_weight
+  b = b[:, col_lower]*(1 - col_weight) + b[:, np.minimum(col_lower + 1, len(cols) - 1)]*col_weight
+
+  # upsample along rows and correct, one block at a time
+  row_lower, row_weight = upsampling_weights(L.shape[0], rows, dtype)
+  row_upper = np.minimum(row_lower + 1, len(rows) - 1)
+  out = np.empty(L.shape, dtype=dtype)
+  for start in range(0, L.shape[0], block_rows):
+    block = slice(start, start + block_rows)
+    w = row_weight[block, None]
+    a_block = a[row_lower[block]]*(1 - w) + a[row_upper[block]]*w
+    b_block = b[row_lower[block]]*(1 - w) + b[row_upper[block]]*w
+    surface_reflectance(L[block], a_block, b_block, out=out[block])
+
+  if report is not None:
+    report['coarse_grid'] = (len(rows), len(cols))
+    if error_samples:
+      report['coarse_error'] = _coarse_error(iLUT, L, invars, doy, dtype, policy,
+                                             out, error_samples, seed)
+
+  return out
+
+
+def _coarse_error(iLUT, L, invars, doy, dtype, policy, out, n, seed):
+  """
+  Absolute reflectance error of coarse correction at random pixels
+  """
+  rng = np.random.RandomState(seed)
+  pixels = np.unravel_index(rng.randint(0, L.size, n), L.shape)
+
+  def sample(x):
+    return np.broadcast_to(np.asarray(x), L.shape)[pixels]
+
+  a, b = _sampled_coefficients(iLUT, invars, doy, sample, dtype=dtype, policy=policy)
+  error = np.abs(out[pixels].astype(np.float64) - surface_reflectance(L[pixels], a, b))
+
+  if not np.any(np.isfinite(error)):
+    return {'max':float('nan'), 'mean':float('nan')}
+  return {'max':float(np.nanmax(error)), 'mean':float(np.nanmean(error))}
+
+
+def _sampled_coefficients(iLUT, invars, doy, sample, **options):
+  """
+  Correction coefficients at pixels sampled from the input variables (see
+  _invars) and day of year
+  """
+  invars = [sample(x) for x in invars]
+  return correction_coefficients(iLUT, *invars[:5], doy=None if doy is None else sample(doy),
+                                 aerosol_mixture=invars[5] if len(invars) > 5 else None,
+                                 **options)
+
+
+def float32_error(iLUT, n=100000, seed=0):
+  """
+  Relative error in surface reflectance of the single precision path
+  compared to double precision, for random points inside the look up table
+  and surface reflectances between 0.01 and 1.
+  """
+
+  iLUT64 = as_grid_interpolator(iLUT, np.float64)
+  iLUT32 = iLUT64.astype(np.float32)
+
+  # random input variables and reflectances
+  rng = np.random.RandomState(seed)
+  invars = [rng.uniform(ax[0], ax[-1], n) for ax in iLUT64.axes]
+  mixture = invars[5] if len(invars) > 5 else None
+  ref = rng.uniform(0.01, 1, n)
+
+  # at-sensor radiance (double precision)
+  a, b = correction_coefficients(iLUT64, *invars[:5], aerosol_mixture=mixture)
+  L = a + b*ref
+
+  # round trip in single precision (radiance as the sensor would store it)
+  ref32 = correct(iLUT32, L.astype(np.float32), *invars[:5], dtype=np.float32,
+                  aerosol_mixture=mixture)
+  error = np.abs(ref32.astype(np.float64) - ref) / ref
+
+  return {'max':float(np.nanmax(error)), 'mean':float(np.nanmean(error))}
+
+
+def check_float32(iLUTs, tolerance=0.0005):
+  """
+  Checks that single precision errors are well below the emulator error
+  (i.e. 0.5 %), by default they must be less than 0.05 %.
+  """
+
+  passed = True
+  for bandName in sorted(iLUTs):
+    error = float32_error(iLUTs[bandName])
+    ok = error['max'] < tolerance
+    passed &= ok
+    print('{}: max = {:.2e}, mean = {:.2e} {}'
+          .format(bandName, error['max'], error['mean'], 'ok' if ok else 'FAILED'))
+
+  return passed
+
+
+def main():
+
+  args = sys.argv[1:]
+
+  if len(args) != 1:
+    print('usage: $ python3 atmcorr.py mission  (e.g. COPERNICUS/S2)')
+    sys.exit(1)
+
+  from interpolated_LUTs import Interpolated_LUTs
+
+  iLUTs = Interpolated_LUTs(args[0]).get()
+  if not iLUTs:
+    sys.exit(1)
+
+  print('float32 error (relative to float64 surface reflectance):')
+  if not check_float32(iLUTs):
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,338 @@
+"""
+correction_service.py
+
+A long-running local correction service that keeps interpolated look up
+tables (iLUTs) loaded in memory, so that short-lived clients can request
+correction coefficients or surface reflectance without loading iLUTs.
+
+Usage
+------
+
+$ python3 correction_service.py --socket /tmp/6S_emulator.sock
+
+or over localhost TCP
+
+$ python3 correction_service.py --port 8642
+
+{options} also include:
+
+--preload  : missions to load at start up (e.g. COPERNICUS/S2 LANDSAT/LC8)
+--dtype    : float32 (default) or float64
+
+Client example
+--------------
+
+  from correction_service import CorrectionClient
+
+  with CorrectionClient('/tmp/6S_emulator.sock') as client:
+    a, b = client.coefficients('COPERNICUS/S2', 'B1', solar_z, H2O, O3, AOT, alt)
+    ref = client.reflectance('COPERNICUS/S2', 'B1', L, solar_z, H2O, O3, AOT, alt)
+
+    # iLUTs of an aerosol mixture build, for a map of aerosol mixtures
+    ref = client.reflectance('COPERNICUS/S2', 'B1', L, solar_z, H2O, O3, AOT, alt,
+                             aerosol_mixture=mixture)
+
+Protocol
+--------
+
+Each message is a 4 byte (big-endian) header length, a JSON header and then
+the raw bytes of each array listed in the header (name, dtype, shape).
+Arrays are received straight into their own buffers (no extra copies).
+
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+
+import numpy as np
+
+import atmcorr
+from atmcorr import _invars
+from interpolated_LUTs import Interpolated_LUTs
+
+
+def send_message(sock, header, arrays=()):
+  """
+  Sends a JSON header followed by the raw bytes of each array
+  """
+  arrays = [np.ascontiguousarray(arr) for arr in arrays]
+  header = dict(header)
+  header['arrays'] = [{'dtype':arr.dtype.str, 'shape':arr.shape} for arr in arrays]
+  encoded = json.dumps(header).encode('utf-8')
+  sock.sendall(struct.pack('!I', len(encoded)) + encoded)
+  for arr in arrays:
+    if arr.nbytes:
+      sock.sendall(memoryview(arr).cast('B'))
+
+
+def recv_message(sock):
+  """
+  Receives a message, returns (header, arrays) or (None, None) on EOF
+  """
+  size = _recv_exactly(sock, 4)
+  if size is None:
+    return None, None
+  header = json.loads(bytes(_recv_exactly(sock, struct.unpack('!I', size)[0])))
+
+  arrays = []
+  for spec in header['arrays']:
+    dtype = np.dtype(spec['dtype'])
+    shape = tuple(spec['shape'])
+    buffer = _recv_exactly(sock, int(np.prod(shape))*dtype.itemsize)
+    arrays.append(np.frombuffer(buffer, dtype=dtype).reshape(shape))
+
+  return header, arrays
+
+
+def _recv_exactly(sock, n):
+  """
+  Receives exactly n bytes into a new buffer
+  """
+  buffer = bytearray(n)
+  view = memoryview(buffer)
+  while view:
+    nbytes = sock.recv_into(view)
+    if nbytes == 0:
+      if len(view) == n:
+        return None
+      raise ConnectionError('connection closed mid-message')
+    view = view[nbytes:]
+  return buffer
+
+
+class CorrectionService:
+  """
+  Holds the iLUTs of each mission and aerosol profile (loaded once) and
+  answers requests
+  """
+
+  def __init__(self, dtype=np.float32):
+    self.dtype = np.dtype(dtype)
+    self.iLUTs = {}
+
+    # one lock per set of iLUTs, so a slow first load does not hold up
+    # requests for those already loaded (self.lock guards self.locks)
+    self.locks = {}
+    self.lock = threading.Lock()
+
+  def get(self, mission, aerosol_profile='Continental'):
+    """
+    iLUTs of a mission (and aerosol profile, Mixture for those of an aerosol
+    mixture build), loaded on first request
+    """
+    key = (mission, aerosol_profile)
+    iLUTs = self.iLUTs.get(key)
+    if iLUTs is not None:
+      return iLUTs
+
+    with self.lock:
+      lock = self.locks.setdefault(key, threading.Lock())
+    with lock:
+      if key not in self.iLUTs:
+        print('loading iLUTs: {} ({})'.format(mission, aerosol_profile))
+        iLUTs = Interpolated_LUTs(mission, aerosol_profile=aerosol_profile).get(dtype=self.dtype)
+        if not iLUTs:
+          raise ValueError('no iLUTs available for mission: {} ({})'.format(mission, aerosol_profile))
+        self.iLUTs[key] = iLUTs
+      return self.iLUTs[key]
+
+  def handle(self, header, arrays):
+    """
+    Request (header, arrays) to response (header, arrays)
+    """
+
+    op = header.get('op')
+
+    if op == 'ping':
+      return {'status':'ok'}, []
+
+    aerosol_profile = header.get('aerosol_profile', 'Continental')
+    if op == 'bands':
+      return {'status':'ok', 'bands':sorted(self.get(header['mission'], aerosol_profile))}, []
+
+    iLUT = self.get(header['mission'], aerosol_profile)[header['band']]
+    doy = header.get('doy')
+
+    # input variables, then the aerosol mixture (of mixture iLUTs)
+    if op == 'coefficients':
+      invars, mixture = arrays[:5], arrays[5:]
+      a, b = atmcorr.correction_coefficients(iLUT, *invars, doy=doy, dtype=self.dtype,
+                                             aerosol_mixture=mixture[0] if mixture else None)
+      return {'status':'ok'}, [a, b]
+
+    if op == 'reflectance':
+      L, invars, mixture = arrays[0], arrays[1:6], arrays[6:]
+      ref = atmcorr.correct(iLUT, L, *invars, doy=doy, dtype=self.dtype,
+                            gain=header.get('gain'), offset=header.get('offset', 0),
+                            aerosol_mixture=mixture[0] if mixture else None)
+      return {'status':'ok'}, [ref]
+
+    raise ValueError('unknown request: {}'.format(op))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+  """
+  Answers requests on one connection until the client closes it
+  """
+
+  def handle(self):
+    while True:
+      header, arrays = recv_message(self.request)
+      if header is None:
+        return
+      try:
+        response, results = self.server.service.handle(header, arrays)
+      except Exception as e:
+        response, results = {'status':'error', 'message':repr(e)}, []
+      send_message(self.request, response, results)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+def make_server(address, service):
+  """
+  Threaded server on a unix socket (path) or localhost TCP (host, port)
+  """
+  if isinstance(address, str):
+    remove_socket(address)
+    server = _UnixServer(address, _Handler)
+  else:
+    server = _TCPServer(tuple(address), _Handler)
+  server.service = service
+  return server
+
+
+def remove_socket(path):
+  """
+  Removes a unix socket file (e.g. left by a service that did not exit
+  cleanly), refuses to remove anything that is not a socket
+  """
+  try:
+    mode = os.stat(path).st_mode
+  except FileNotFoundError:
+    return
+  if not stat.S_ISSOCK(mode):
+    raise ValueError('not a unix socket, will not remove: {}'.format(path))
+  os.remove(path)
+
+
+class CorrectionClient:
+  """
+  Client of the correction service, address is a unix socket path
+  or a (host, port) tuple
+  """
+
+  def __init__(self, address):
+    if isinstance(address, str):
+      self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+      self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.sock.connect(address if isinstance(address, str) else tuple(address))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    self.sock.close()
+
+  def request(self, header, arrays=()):
+    send_message(self.sock, header, arrays)
+    response, results = recv_message(self.sock)
+    if response is None:
+      raise ConnectionError('correction service closed the connection')
+    if response['status'] != 'ok':
+      raise RuntimeError(response['message'])
+    return response, results
+
+  def ping(self):
+    self.request({'op':'ping'})
+
+  def bands(self, mission, aerosol_profile='Continental'):
+    header = {'op':'bands', 'mission':mission, 'aerosol_profile':aerosol_profile}
+    return self.request(header)[0]['bands']
+
+  def coefficients(self, mission, band, solar_z, H2O, O3, AOT, alt, doy=None,
+                   aerosol_mixture=None):
+    """
+    Correction coefficients (a, b) for arrays of input variables, with
+    the iLUTs of an aerosol mixture build if aerosol_mixture is given
+    """
+    header = {'op':'coefficients', 'mission':mission, 'band':band, 'doy':doy,
+              'aerosol_profile':_aerosol_profile(aerosol_mixture)}
+    invars = [np.asarray(x) for x in _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture)]
+    a, b = self.request(header, invars)[1]
+    return a, b
+
+  def reflectance(self, mission, band, L, solar_z, H2O, O3, AOT, alt, doy=None,
+                  gain=None, offset=0, aerosol_mixture=None):
+    """
+    Surface reflectance for arrays of radiance (or DN if gain is given), with
+    the iLUTs of an aerosol mixture build if aerosol_mixture is given
+    """
+    header = {'op':'reflectance', 'mission':mission, 'band':band, 'doy':doy,
+              'gain':gain, 'offset':offset,
+              'aerosol_profile':_aerosol_profile(aerosol_mixture)}
+    arrays = [np.asarray(x) for x in [L] + _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture)]
+    return self.request(header, arrays)[1][0]
+
+
+def _aerosol_profile(aerosol_mixture):
+  """
+  Aerosol profile of the iLUTs a request needs
+  """
+  return 'Continental' if aerosol_mixture is None else 'Mixture'
+
+
+def main():
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--socket', '-s')
+  parser.add_argument('--port', '-p', type=int)
+  parser.add_argument('--preload', nargs='*', default=[])
+  parser.add_argument('--dtype', default='float32')
+  args = parser.parse_args()
+
+  if bool(args.socket) == bool(args.port):
+    print('usage: $ python3 correction_service.py --socket path | --port number')
+    sys.exit(1)
+
+  if args.dtype not in ['float32', 'float64']:
+    print('dtype not recognized: ', args.dtype)
+    sys.exit(1)
+
+  service = CorrectionService(dtype=args.dtype)
+  for mission in args.preload:
+    service.get(mission)
+
+  address = args.socket or ('127.0.0.1', args.port)
+  server = make_server(address, service)
+  print('6S emulator correction service listening on: {}'.format(address))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    if args.socket:
+      remove_socket(args.socket)
+
+if __name__ == '__main__':
+  main()
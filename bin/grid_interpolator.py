@@ -0,0 +1,649 @@
+"""
+grid_interpolator.py
+
+Piecewise linear interpolation of look up tables on their regular grid of
+input variables (i.e. solar zenith, water vapour, ozone, aerosol optical
+thickness and altitude).
+
+Each grid cell is split into simplices (Kuhn triangulation) so the result is
+the same kind of barycentric interpolant as scipy's LinearNDInterpolator.
+However, the simplex containing a point is found by sorting rather than by
+a Qhull search, so the table can be held (and evaluated) in any float dtype.
+
+"""
+
+import numpy as np
+
+from parameter_space import ParameterGrid, permutate_invars
+
+
+# names of the input variables (in order), LUTs of an aerosol mixture build
+# have a last axis 'aerosol_mixture' (see parameter_space.INVAR_NAMES)
+INVARS = ['solar_z', 'H2O', 'O3', 'AOT', 'alt']
+
+# out-of-range policies (codes are used by compiled kernels)
+POLICIES = {'nan':0, 'clamp':1, 'linear':2, 'raise':3}
+
+
+class GridInterpolator:
+  """
+  Piecewise linear interpolant of a look up table defined on a regular grid.
+
+  axes   : grid levels of each input variable (ascending)
+  values : array of shape (len(axes[0]), .., len(axes[-1])) + trailing shape,
+           e.g. a trailing shape of (2,) for correction coefficients (a, b)
+  dtype  : storage and computation dtype (default is dtype of values)
+
+  names  : (optional) names of the input variables
+  policy : what to do with points outside the grid, either one policy for
+           all axes or a dictionary of {name: policy}, where policy is
+           'nan'    : NaN (default, same as LinearNDInterpolator)
+           'clamp'  : use the nearest grid level (e.g. alt > 7.75 km)
+           'linear' : linear extrapolation from the edge grid cell
+           'raise'  : raise a ValueError
+
+  Called like a LinearNDInterpolator, i.e. a, b = iLUT(solar_z,H2O,O3,AOT,alt)
+  with scalars or (broadcastable) arrays.
+  """
+
+  # the compiled reflectance kernel (kernels.py) interpolates like this class
+  compiled_kernel = True
+
+  # interpolation method (see iLUT_io.engine)
+  method = 'linear'
+
+  def __init__(self, axes, values, dtype=None, chunk_size=65536, names=None,
+               policy='nan'):
+
+    values = np.asarray(values, dtype=dtype)
+    if values.dtype.kind != 'f':
+      values = values.astype(np.float64)
+    self.dtype = values.dtype
+    self.axes = [np.asarray(ax, dtype=self.dtype) for ax in axes]
+    self.ndim = len(self.axes)
+    self.shape = tuple(len(ax) for ax in self.axes)
+    if values.shape[:self.ndim] != self.shape:
+      raise ValueError('values shape {} does not match grid shape {}'
+                       .format(values.shape, self.shape))
+    self.values = values
+    self.value_shape = values.shape[self.ndim:]
+    self.chunk_size = chunk_size
+    self.gradient_chunk_size = chunk_size
+
+    # flat (npoints, nvalues) view of table and strides of each grid axis
+    self.flat_values = values.reshape(int(np.prod(self.shape)), -1)
+    self.strides = np.array([int(np.prod(self.shape[k+1:]))
+                             for k in range(self.ndim)], dtype=np.intp)
+
+    # axes with more than one level (i.e. that are interpolated)
+    self.active = [k for k in range(self.ndim) if self.shape[k] > 1]
+
+    # all grid levels in one array (for compiled kernels)
+    self.levels = np.concatenate(self.axes)
+    self.offsets = np.cumsum([0] + list(self.shape)).astype(np.intp)
+
+    # names of input variables and out-of-range policy of each axis
+    if names is None:
+      names = INVARS if self.ndim == len(INVARS) else ['x{}'.format(k) for k in range(self.ndim)]
+    self.names = list(names)
+    self.policy = policy
+    self.policies = self._policies(policy)
+
+  @classmethod
+  def from_points(cls, points, values, dtype=None, **kwargs):
+    """
+    Interpolator from a list of grid points and their values, e.g. the
+    inputs and outputs of a LUT. Points must cover a full regular grid.
+    A ParameterGrid (sorted levels) needs no search, values are in its order.
+    """
+
+    values = np.asarray(values)
+    if isinstance(points, ParameterGrid):
+      kwargs.setdefault('names', points.names)
+      if points.is_sorted() and len(values) == len(points):
+        axes = [np.asarray(levels, dtype=np.float64) for levels in points.levels]
+        grid = values.reshape(points.shape + values.shape[1:]).astype(dtype or values.dtype, copy=False)
+        return cls(axes, grid, **kwargs)
+      points = points.coordinates()
+
+    points = np.asarray(points, dtype=np.float64)
+    axes = [np.unique(points[:, k]) for k in range(points.shape[1])]
+    shape = tuple(len(ax) for ax in axes)
+
+    index = tuple(np.searchsorted(ax, points[:, k]) for k, ax in enumerate(axes))
+    flat = np.ravel_multi_index(index, shape)
+    if len(points) != int(np.prod(shape)) or len(np.unique(flat)) != len(points):
+      raise ValueError('points do not form a regular grid')
+
+    grid = np.empty(shape + values.shape[1:], dtype=dtype or values.dtype)
+    grid[index] = values
+
+    return cls(axes, grid, **kwargs)
+
+  @classmethod
+  def from_LUT(cls, LUT, dtype=None, columns=None, **kwargs):
+    """
+    Interpolator from a look up table (i.e. a loaded .lut file)
+
+    columns : (optional) values to interpolate, names of 6S outputs kept in
+              the LUT and/or 'a', 'b', e.g. ['a', 'b', 'spherical_albedo'],
+              default is (a, b)
+    """
+
+    inputs = permutate_invars(LUT['config']['invars'])
+    outputs = LUT['outputs']
+    if columns is not None:
+      outputs = np.stack([LUT_column(LUT, name) for name in columns], axis=-1)
+
+    return cls.from_points(inputs, outputs, dtype=dtype, **kwargs)
+
+  @classmethod
+  def from_interpolator(cls, interpolator, dtype=None, **kwargs):
+    """
+    Interpolator from a scipy LinearNDInterpolator (i.e. a pickled .ilut)
+    """
+
+    if isinstance(interpolator, GridInterpolator):
+
+      # keeps the engine (e.g. cubic) unless called on another engine class
+      engine = type(interpolator) if cls is GridInterpolator else cls
+      if engine is type(interpolator) and (dtype is None or interpolator.dtype == dtype):
+        return interpolator
+      kwargs.setdefault('names', interpolator.names)
+      return engine(interpolator.axes, interpolator.values, dtype=dtype, **kwargs)
+
+    return cls.from_points(interpolator.points, interpolator.values,
+                           dtype=dtype, **kwargs)
+
+  def astype(self, dtype):
+    """
+    Copy of this interpolator that stores and computes in another dtype
+    """
+    return type(self)(self.axes, self.values.astype(dtype),
+                      chunk_size=self.chunk_size, names=self.names,
+                      policy=self.policy)
+
+  def _policies(self, policy):
+    """
+    Out-of-range policy code of each axis
+    """
+    if policy is None:
+      return self.policies
+    if isinstance(policy, str):
+      policy = {name:policy for name in self.names}
+    unknown = set(policy) - set(self.names)
+    if unknown:
+      raise ValueError('unknown input variable(s): {}'.format(sorted(unknown)))
+    codes = []
+    for k, name in enumerate(self.names):
+      p = policy.get(name, self.policy if isinstance(self.policy, str) else 'nan')
+      if p not in POLICIES:
+        raise ValueError('out-of-range policy not recognized: {}'.format(p))
+      codes.append(POLICIES[p])
+    return np.array(codes, dtype=np.intp)
+
+  def _report(self, counts, policies, report):
+    """
+    Adds out-of-range counts to a report (dict), raises if policy is 'raise'
+    """
+    if report is not None:
+      out_of_range = report.setdefault('out_of_range', dict.fromkeys(self.names, 0))
+      for name, count in zip(self.names, counts):
+        out_of_range[name] = out_of_range.get(name, 0) + int(count)
+    for k, count in enumerate(counts):
+      if count and policies[k] == POLICIES['raise']:
+        ax = self.axes[k]
+        raise ValueError('{} points outside the {} range [{}, {}]'
+                         .format(int(count), self.names[k], ax[0], ax[-1]))
+
+  def _columns(self, args, shape=()):
+    """
+    Shape of the points and a flat column (or scalar) per input variable,
+    args is either one (..., ndim) array or ndim (broadcastable) arrays
+    """
+    if len(args) == 1:
+      x = np.asarray(args[0])
+      shape = np.broadcast_shapes(x.shape[:-1], shape)
+      columns = [_flat_column(x[..., k], shape) for k in range(self.ndim)]
+    elif len(args) == self.ndim:
+      arrays = [np.asarray(arg) for arg in args]
+      shape = np.broadcast_shapes(shape, *[arr.shape for arr in arrays])
+      columns = [_flat_column(arr, shape) for arr in arrays]
+    else:
+      raise ValueError('expected {} input variables, got {}'
+                       .format(self.ndim, len(args)))
+    return shape, columns
+
+  def __call__(self, *args, policy=None, report=None):
+    """
+    Interpolated values at points given by the input variables
+
+    policy : (optional) out-of-range policy for this call (see class)
+    report : (optional) dictionary, gets the number of points out of range
+             of each axis, i.e. report['out_of_range'] = {name: count}
+    """
+
+    policies = self._policies(policy)
+    shape, columns = self._columns(args)
+    n = int(np.prod(shape))
+    out = np.empty((n, self.flat_values.shape[1]), dtype=self.dtype)
+    counts = np.zeros(self.ndim, dtype=np.int64)
+
+    # evaluate in chunks to bound the size of temporary arrays
+    for start in range(0, n, self.chunk_size):
+      stop = min(start + self.chunk_size, n)
+      chunk = [col if col.size == 1 else col[start:stop] for col in columns]
+      self._evaluate(chunk, out[start:stop], policies, counts)
+      self._report(counts, policies, None)
+
+    self._report(counts, policies, report)
+    return out.reshape(shape + self.value_shape)
+
+  def gradient(self, *args, policy=None, report=None):
+    """
+    Interpolated values and their partial derivatives with respect to each
+    input variable, i.e. (values, jacobian) where jacobian has the shape of
+    values + (ndim,). Derivatives come from the same simplex as the values
+    (i.e. the interpolant is linear within it), so they are exact for the
+    interpolant and cost about one evaluation.
+
+    On a grid level the derivative is that of the cell above (of the last
+    cell on the last level). It is 0 along axes with one level and along
+    axes a point is clamped on (policy 'clamp').
+    """
+
+    policies = self._policies(policy)
+    shape, columns = self._columns(args)
+    n = int(np.prod(shape))
+    out = np.empty((n, self.flat_values.shape[1]), dtype=self.dtype)
+    jacobian = np.empty((n, self.flat_values.shape[1], self.ndim), dtype=self.dtype)
+    counts = np.zeros(self.ndim, dtype=np.int64)
+
+    for start in range(0, n, self.gradient_chunk_size):
+      stop = min(start + self.gradient_chunk_size, n)
+      chunk = [col if col.size == 1 else col[start:stop] for col in columns]
+      self._evaluate(chunk, out[start:stop], policies, counts, gradient=jacobian[start:stop])
+      self._report(counts, policies, None)
+
+    self._report(counts, policies, report)
+    return (out.reshape(shape + self.value_shape),
+            jacobian.reshape(shape + self.value_shape + (self.ndim,)))
+
+  def reflectance(self, L, *args, correction=None, out=None, policy=None, report=None):
+    """
+    Surface reflectance from at-sensor radiance (L) and input variables,
+    interpolating the coefficients (a, b) and applying (L - a) / b in one
+    pass per pixel (compiled if numba is installed, see kernels.py)
+
+    correction     : (optional) elliptical orbit correction of a and b
+    policy, report : (optional) out-of-range handling, see __call__
+    """
+
+    from kernels import reflectance
+
+    if self.value_shape != (2,):
+      raise ValueError('reflectance needs (a, b) tables, got value shape {}'
+                       .format(self.value_shape))
+
+    L = np.asarray(L)
+    if correction is None:
+      correction = np.ones((), dtype=self.dtype)
+    correction = np.asarray(correction, dtype=self.dtype)
+    shape, columns = self._columns(args, np.broadcast_shapes(L.shape, correction.shape))
+    L = _flat_column(L, shape)
+    correction = _flat_column(correction, shape)
+
+    policies = self._policies(policy)
+    n = int(np.prod(shape))
+    if out is None:
+      out = np.empty(shape, dtype=self.dtype)
+    flat_out = out.reshape(-1)
+    counts = np.zeros(self.ndim, dtype=np.int64)
+
+    for start in range(0, n, self.chunk_size):
+      stop = min(start + self.chunk_size, n)
+      chunk = [col if col.size == 1 else col[start:stop] for col in [L, correction] + columns]
+      reflectance(self, chunk[0], chunk[2:], chunk[1], flat_out[start:stop],
+                  policies, counts)
+      self._report(counts, policies, None)
+
+    self._report(counts, policies, report)
+    return out
+
+  def _evaluate(self, columns, out, policies=None, counts=None, gradient=None):
+    """
+    Kuhn simplex interpolation for one chunk of points (adds the number
+    of points out of range of each axis to counts), and the derivatives
+    along each axis if gradient, i.e. an (n, nvalues, ndim) array, is given
+    """
+
+    n = len(out)
+    dtype = self.dtype
+    d = len(self.active)
+    if policies is None:
+      policies = self.policies
+
+    # grid cell (flat index of lower corner) and position within the cell
+    corner = np.zeros(n, dtype=np.intp)
+    t = np.empty((n, d), dtype=dtype)
+    outside = np.zeros(n, dtype=bool)
+    if gradient is not None:
+      gradient[:] = 0
+      widths = np.empty((n, d), dtype=dtype)
+      clamped = []
+    j = 0
+    for k, ax in enumerate(self.axes):
+      xk = np.broadcast_to(np.asarray(columns[k], dtype=dtype), (n,))
+
+      # out of range (or NaN) points
+      bad = ~((xk >= ax[0]) & (xk <= ax[-1]))
+      if counts is not None:
+        counts[k] += np.count_nonzero(bad)
+      if bad.any():
+        policy = policies[k]
+        if policy == POLICIES['clamp'] or (policy == POLICIES['linear'] and self.shape[k] == 1):
+          xk = np.clip(xk, ax[0], ax[-1])
+          outside |= np.isnan(xk)
+          if gradient is not None:
+            clamped.append((k, bad))
+        elif policy == POLICIES['linear']:
+          outside |= np.isnan(xk)
+        else:
+          outside |= bad
+
+      if self.shape[k] == 1:
+        continue
+      i = np.searchsorted(ax, xk, side='right') - 1
+      np.clip(i, 0, len(ax) - 2, out=i)
+      lower = ax[i]
+      t[:, j] = (xk - lower) / (ax[i + 1] - lower)
+      if gradient is not None:
+        widths[:, j] = ax[i + 1] - lower
+      corner += i * self.strides[k]
+      j += 1
+
+    if d == 0:
+      out[:] = self.flat_values[corner]
+    else:
+      # simplex is given by the order of the position coordinates
+      order = np.argsort(-t, axis=1)
+      ts = np.take_along_axis(t, order, axis=1)
+
+      # barycentric weights
+      weights = np.empty((n, d + 1), dtype=dtype)
+      weights[:, 0] = 1 - ts[:, 0]
+      weights[:, 1:-1] = ts[:, :-1] - ts[:, 1:]
+      weights[:, -1] = ts[:, -1]
+
+      # simplex vertices (walk from lower corner one axis at a time)
+      vertices = np.empty((n, d + 1), dtype=np.intp)
+      vertices[:, 0] = corner
+      np.cumsum(self.strides[self.active][order], axis=1, out=vertices[:, 1:])
+      vertices[:, 1:] += corner[:, None]
+
+      vertex_values = self.flat_values[vertices]
+      np.einsum('nv,nvm->nm', weights, vertex_values, out=out)
+
+      # derivatives, i.e. differences along the walk (one axis per step)
+      # divided by the cell width of that axis
+      if gradient is not None:
+        steps = np.diff(vertex_values, axis=1)
+        derivatives = np.empty_like(steps)
+        np.put_along_axis(derivatives, order[:, :, None], steps, axis=1)
+        derivatives /= widths[:, :, None]
+        gradient[:, :, self.active] = derivatives.transpose(0, 2, 1)
+
+    if gradient is not None:
+      for k, bad in clamped:
+        gradient[bad, :, k] = 0
+      gradient[outside] = np.nan
+
+    out[outside] = np.nan
+
+
+class CubicGridInterpolator(GridInterpolator):
+  """
+  Monotone cubic interpolant of a look up table defined on a regular grid,
+  i.e. tensor product piecewise cubic Hermite interpolation (PCHIP, as
+  scipy.interpolate.PchipInterpolator) along each axis with more than two
+  levels (linear along axes of two levels).
+
+  It is smooth (continuous first derivatives), does not overshoot the table
+  values along any axis and is exact for quadratic trends, so the same error
+  as linear interpolation needs far fewer grid levels (see the 'coarse'
+  build type in parameter_space.py). Evaluation gathers a 4 point stencil
+  per cubic axis (i.e. up to 4**ndim table values per point), so it is
+  slower than linear interpolation.
+
+  Arguments are those of GridInterpolator, policy 'linear' extrapolates
+  linearly from the edge grid cell. The gradient is that of the cubic
+  interpolant (i.e. continuous across grid levels).
+  """
+
+  compiled_kernel = False
+  method = 'cubic'
+
+  def __init__(self, axes, values, dtype=None, chunk_size=65536, names=None,
+               policy='nan'):
+
+    super().__init__(axes, values, dtype=dtype, chunk_size=chunk_size,
+                     names=names, policy=policy)
+
+    # stencil of each active axis (4 levels if cubic, 2 if linear) and
+    # chunk size that bounds the gathered stencil values
+    self.cubic = [self.shape[k] > 2 for k in self.active]
+    stencil_size = int(np.prod([4 if cubic else 2 for cubic in self.cubic]))
+    self.chunk_size = max(1, min(chunk_size, 2**22 // (stencil_size*self.flat_values.shape[1])))
+
+    # (gradients reduce the values and a derivative along each active axis)
+    self.gradient_chunk_size = max(1, self.chunk_size // (len(self.active) + 1))
+
+  def _evaluate(self, columns, out, policies=None, counts=None, gradient=None):
+    """
+    Tensor product monotone cubic interpolation for one chunk of points
+    (adds the number of points out of range of each axis to counts), and
+    the derivatives along each axis if gradient, i.e. an (n, nvalues, ndim)
+    array, is given
+    """
+
+    n = len(out)
+    dtype = self.dtype
+    if policies is None:
+      policies = self.policies
+
+    stencils = []  # (x, stencil index, axis, extrapolate) of each active axis
+    outside = np.zeros(n, dtype=bool)
+    if gradient is not None:
+      gradient[:] = 0
+      clamped = []
+    for k, ax in enumerate(self.axes):
+      xk = np.broadcast_to(np.asarray(columns[k], dtype=dtype), (n,))
+
+      # out of range (or NaN) points
+      bad = ~((xk >= ax[0]) & (xk <= ax[-1]))
+      if counts is not None:
+        counts[k] += np.count_nonzero(bad)
+      extrapolate = np.zeros(n, dtype=bool)
+      if bad.any():
+        policy = policies[k]
+        if policy == POLICIES['clamp'] or (policy == POLICIES['linear'] and self.shape[k] == 1):
+          xk = np.clip(xk, ax[0], ax[-1])
+          outside |= np.isnan(xk)
+          if gradient is not None:
+            clamped.append((k, bad))
+        elif policy == POLICIES['linear']:
+          outside |= np.isnan(xk)
+          extrapolate = bad
+        else:
+          outside |= bad
+
+      if self.shape[k] == 1:
+        continue
+
+      # cell (i) and stencil of levels around it
+      i = np.searchsorted(ax, xk, side='right') - 1
+      np.clip(i, 0, len(ax) - 2, out=i)
+      offsets = np.arange(-1, 3) if self.shape[k] > 2 else np.arange(2)
+      index = np.clip(i[:, None] + offsets, 0, len(ax) - 1)
+      stencils.append((xk, index, k, extrapolate))
+
+    # flat table index of the stencil, i.e. (n, stencil_0, .., stencil_d),
+    # cubic axes first so that linear axes (reduced first) halve it cheaply
+    stencils.sort(key=lambda stencil: stencil[1].shape[1] == 2)
+    flat_index = np.zeros(n, dtype=np.intp)
+    for j, (xk, index, k, extrapolate) in enumerate(stencils):
+      shape = (n,) + (1,)*j + (index.shape[1],)
+      flat_index = flat_index[..., None] + (index*self.strides[k]).reshape(shape)
+
+    if not stencils:
+      out[:] = self.flat_values[flat_index]
+    else:
+      values = self.flat_values[flat_index]
+
+      # with gradients, channel 0 are the values and channel 1 + j their
+      # derivatives along active axis j, i.e. (n, stencil.., channel, R),
+      # each channel is differentiated when its axis is reduced
+      trailing = 1
+      if gradient is not None:
+        values = np.repeat(values[..., None, :], len(self.active) + 1, axis=-2)
+        trailing = 2
+
+      # reduce the stencil one axis at a time (last axis first)
+      for xk, index, k, extrapolate in reversed(stencils):
+        levels = self.axes[k][index]
+        values = np.moveaxis(values, values.ndim - 1 - trailing, 1)
+        reduced_shape = values.shape[:1] + values.shape[2:]
+        values = values.reshape(n, values.shape[1], -1)
+        if levels.shape[1] == 4:
+          reduced = _pchip(xk, levels, values, extrapolate, gradient is not None)
+        else:
+          reduced = _linear(xk, levels, values, gradient is not None)
+        if gradient is None:
+          values = reduced.reshape(reduced_shape)
+        else:
+          values = reduced[0].reshape(reduced_shape)
+          c = 1 + self.active.index(k)
+          values[..., c, :] = reduced[1].reshape(reduced_shape)[..., c, :]
+
+      if gradient is None:
+        out[:] = values.reshape(n, -1)
+      else:
+        values = values.reshape(n, len(self.active) + 1, -1)
+        out[:] = values[:, 0]
+        gradient[:, :, self.active] = values[:, 1:].transpose(0, 2, 1)
+
+    if gradient is not None:
+      for k, bad in clamped:
+        gradient[bad, :, k] = 0
+      gradient[outside] = np.nan
+
+    out[outside] = np.nan
+
+
+def _pchip(x, levels, y, extrapolate, derivative=False):
+  """
+  Monotone cubic (PCHIP) interpolation at x (n,) from a 4 level stencil
+  around its cell, i.e. levels (n, 4) and values y (n, 4, R). Stencil levels
+  beyond the grid are repeated edge levels, where the one-sided (three
+  point) derivative is used, as in scipy's PchipInterpolator.
+  Points to extrapolate are linear in the (edge) cell.
+
+  derivative : also return the derivative of the interpolant at x
+  """
+
+  h = np.diff(levels, axis=1)[:, :, None]         # (n, 3, 1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    slopes = np.diff(y, axis=1) / h                # (n, 3, R)
+  h0, h1, h2 = h[:, 0], h[:, 1], h[:, 2]
+  m0, m1, m2 = slopes[:, 0], slopes[:, 1], slopes[:, 2]
+
+  # derivatives at both levels of the cell (one-sided at the grid edges)
+  d1 = _pchip_derivative(h0, h1, m0, m1)
+  d2 = _pchip_derivative(h1, h2, m1, m2)
+  edge = h0[:, 0] == 0
+  if edge.any():
+    d1[edge] = _edge_derivative(h1[edge], h2[edge], m1[edge], m2[edge])
+  edge = h2[:, 0] == 0
+  if edge.any():
+    d2[edge] = _edge_derivative(h1[edge], h0[edge], m1[edge], m0[edge])
+
+  # cubic Hermite basis
+  t = ((x - levels[:, 1]) / h1[:, 0])[:, None]
+  y1, y2 = y[:, 1], y[:, 2]
+  result = ((1 + 2*t)*(1 - t)**2*y1 + t*(1 - t)**2*h1*d1
+            + t**2*(3 - 2*t)*y2 + t**2*(t - 1)*h1*d2)
+
+  if extrapolate.any():
+    result[extrapolate] = (y1 + t*(y2 - y1))[extrapolate]
+  if not derivative:
+    return result
+
+  # derivative of the Hermite basis (with respect to x, i.e. over h1)
+  slope = (y2 - y1) / h1
+  derivatives = 6*t*(1 - t)*slope + (1 - t)*(1 - 3*t)*d1 + t*(3*t - 2)*d2
+  if extrapolate.any():
+    derivatives[extrapolate] = np.broadcast_to(slope, derivatives.shape)[extrapolate]
+
+  return result, derivatives
+
+
+def _linear(x, levels, y, derivative=False):
+  """
+  Linear interpolation at x (n,) between 2 levels (n, 2) of values y
+  (n, 2, R), and its derivative if derivative
+  """
+  width = (levels[:, 1] - levels[:, 0])[:, None]
+  t = (x[:, None] - levels[:, :1]) / width
+  step = y[:, 1] - y[:, 0]
+  result = y[:, 0] + t*step
+  if not derivative:
+    return result
+  return result, np.broadcast_to(step / width, result.shape)
+
+
+def _pchip_derivative(h0, h1, m0, m1):
+  """
+  PCHIP derivative at a level between intervals of width h0, h1 and slopes
+  m0, m1 (weighted harmonic mean, 0 at local extrema)
+  """
+  w0 = 2*h1 + h0
+  w1 = h1 + 2*h0
+  with np.errstate(divide='ignore', invalid='ignore'):
+    d = (w0 + w1) / (w0/m0 + w1/m1)
+  return np.where(m0*m1 > 0, d, 0)
+
+
+def _edge_derivative(h0, h1, m0, m1):
+  """
+  One-sided three point derivative at an edge level (interval h0 of slope
+  m0 next to the edge, then h1 of slope m1), kept monotone
+  """
+  with np.errstate(divide='ignore', invalid='ignore'):
+    d = ((2*h0 + h1)*m0 - h0*m1) / (h0 + h1)
+  d = np.where(np.sign(d) != np.sign(m0), 0, d)
+  return np.where((np.sign(m0) != np.sign(m1)) & (np.abs(d) > 3*np.abs(m0)), 3*m0, d)
+
+
+def LUT_column(LUT, name):
+  """
+  One output of a look up table at each grid point, i.e. a coefficient
+  ('a' or 'b') or a 6S output kept by LUT_build (e.g. 'spherical_albedo')
+  """
+  if name in ('a', 'b'):
+    return np.asarray(LUT['outputs'])[..., 'ab'.index(name)]
+  columns = LUT.get('columns', {})
+  if name not in columns:
+    raise ValueError("LUT has no '{}' output (LUTs built before it was kept "
+                     "need to be rebuilt)".format(name))
+  return np.asarray(columns[name])
+
+
+def _flat_column(arr, shape):
+  """
+  1D view (or scalar) of an input variable broadcast to shape
+  """
+  if arr.size == 1:
+    return arr.reshape(1)
+  if arr.shape == shape:
+    return arr.reshape(-1)
+  return np.broadcast_to(arr, shape).reshape(-1)
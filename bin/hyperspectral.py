@@ -0,0 +1,191 @@
+"""
+hyperspectral.py
+
+Look up tables of many bands (e.g. imaging spectrometers with hundreds of
+channels) in one container, i.e. a single GridInterpolator whose values have
+a trailing band axis:
+
+  values.shape = grid shape + (bands, 2)
+
+so the simplex of each pixel is found once for all bands, and (a, b) of
+(pixels x bands) come out of one call. Pixels are processed in blocks sized
+to keep temporary arrays below max_bytes. The container is saved as a single
+(memory-mappable) .ilut file, see iLUT_io.
+
+Example
+-------
+
+  from hyperspectral import HyperspectralLUTs
+
+  LUTs = HyperspectralLUTs.from_iLUTs(Interpolated_LUTs('COPERNICUS/S2').get())
+  a, b = LUTs.coefficients(solar_z, H2O, O3, AOT, alt)      # (..., bands)
+  ρ = LUTs.correct(L, solar_z, H2O, O3, AOT, alt, doy=doy)  # L is (..., bands)
+
+"""
+
+import copy
+
+import numpy as np
+
+from grid_interpolator import GridInterpolator
+from parameter_space import permutate_invars
+import iLUT_io
+
+
+class HyperspectralLUTs:
+  """
+  Interpolated look up tables of several bands on one grid
+
+  grid      : GridInterpolator with values of shape grid shape + (bands, 2)
+  bands     : band names (in the order of the band axis)
+  max_bytes : size limit of temporary arrays per block of pixels
+  """
+
+  def __init__(self, grid, bands, max_bytes=2**26):
+
+    if grid.value_shape != (len(bands), 2):
+      raise ValueError('expected values of shape (..., {}, 2), got (..., {})'
+                       .format(len(bands), ', '.join(str(n) for n in grid.value_shape)))
+
+    self.bands = list(bands)
+    self.band_index = {band:i for i, band in enumerate(self.bands)}
+    self.dtype = grid.dtype
+    self.max_bytes = max_bytes
+
+    # pixels per block, i.e. gathered simplex vertex values (ndim + 1 per
+    # pixel) and coefficients fit in max_bytes
+    values_per_pixel = (grid.ndim + 2) * len(self.bands) * 2
+    self.block_size = max(1, max_bytes // (values_per_pixel * grid.dtype.itemsize))
+
+    # (a shallow copy, the caller's grid keeps its own chunk size)
+    self.grid = copy.copy(grid)
+    self.grid.chunk_size = self.block_size
+
+  @classmethod
+  def from_iLUTs(cls, iLUTs, dtype=None, **kwargs):
+    """
+    Container from a dictionary of single band iLUTs {band: iLUT} on one grid
+    """
+
+    bands = list(iLUTs)
+    grids = [GridInterpolator.from_interpolator(iLUTs[band], dtype=dtype) for band in bands]
+    for band, grid in zip(bands, grids):
+      if grid.shape != grids[0].shape or not all(np.array_equal(a, b) for a, b in zip(grid.axes, grids[0].axes)):
+        raise ValueError('iLUT of band {} is on a different grid'.format(band))
+
+    values = np.stack([grid.values for grid in grids], axis=-2)
+
+    return cls(GridInterpolator(grids[0].axes, values, names=grids[0].names), bands, **kwargs)
+
+  @classmethod
+  def from_LUTs(cls, LUTs, dtype=None, **kwargs):
+    """
+    Container from a dictionary of look up tables {band: LUT} on one grid
+    """
+    return cls.from_iLUTs({band:GridInterpolator.from_LUT(LUT, dtype=dtype)
+                           for band, LUT in LUTs.items()}, **kwargs)
+
+  @classmethod
+  def from_spectral_LUT(cls, spectral_LUT, channels, dtype=None, **kwargs):
+    """
+    Container from a spectral LUT and spectral response functions
+    {band: (wavelengths, response)}, see spectral.py
+    """
+    import spectral
+
+    bands = list(channels)
+    coeffs = spectral.convolve(spectral_LUT, [channels[band] for band in bands])
+    inputs = permutate_invars(spectral_LUT['config']['invars'])
+
+    return cls(GridInterpolator.from_points(inputs, coeffs, dtype=dtype), bands, **kwargs)
+
+  @classmethod
+  def load(cls, filepath, mmap=True, dtype=None, **kwargs):
+    """
+    Loads a container from an .ilut file (values are memory-mapped)
+    """
+    bands = iLUT_io.read_bands(filepath)
+    if bands is None:
+      raise ValueError('not a multi-band .ilut file: '+filepath)
+    return cls(iLUT_io.load_iLUT(filepath, mmap=mmap, dtype=dtype), bands, **kwargs)
+
+  def save(self, filepath):
+    """
+    Saves the container as one .ilut file
+    """
+    return iLUT_io.save_iLUT(filepath, self.grid, bands=self.bands)
+
+  def select(self, bands):
+    """
+    Container of a subset of bands
+    """
+    index = [self.band_index[band] for band in bands]
+    grid = GridInterpolator(self.grid.axes, self.grid.values[..., index, :],
+                            names=self.grid.names, policy=self.grid.policy)
+    return HyperspectralLUTs(grid, bands, max_bytes=self.max_bytes)
+
+  def coefficients(self, solar_z, H2O, O3, AOT, alt, doy=None, policy=None, report=None,
+                   aerosol_mixture=None):
+    """
+    Correction coefficients (a, b) of all bands, each of shape (..., bands)
+    for input variables of shape (...), see atmcorr.correction_coefficients
+    """
+    from atmcorr import _invars, elliptical_orbit_correction
+
+    invars = _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture)
+    coeffs = self.grid(*invars, policy=policy, report=report)
+    if doy is not None:
+      coeffs *= elliptical_orbit_correction(doy).astype(self.dtype)[..., None, None]
+
+    return coeffs[..., 0], coeffs[..., 1]
+
+  def correct(self, L, solar_z, H2O, O3, AOT, alt, doy=None, policy=None,
+              report=None, out=None, aerosol_mixture=None):
+    """
+    Surface reflectance of all bands, L has shape (..., bands) and the input
+    variables (and aerosol_mixture of mixture builds) are broadcastable to
+    (...). Coefficients are interpolated one block of pixels at a time, i.e.
+    never held for the whole scene.
+    """
+    from atmcorr import _invars, elliptical_orbit_correction
+
+    L = np.asarray(L)
+    if L.shape[-1:] != (len(self.bands),):
+      raise ValueError('expected radiance of shape (..., {}), got {}'
+                       .format(len(self.bands), L.shape))
+
+    shape = L.shape[:-1]
+    n = int(np.prod(shape))
+    invars = _invars(solar_z, H2O, O3, AOT, alt, aerosol_mixture)
+    d = len(invars)
+    if doy is not None:
+      invars.append(elliptical_orbit_correction(doy).astype(self.dtype))
+    columns = [_flat(x, shape) for x in invars]
+
+    flat_L = L.reshape(n, len(self.bands))
+    if out is None:
+      out = np.empty(L.shape, dtype=self.dtype)
+    flat_out = out.reshape(n, len(self.bands))
+
+    for start in range(0, n, self.block_size):
+      stop = min(start + self.block_size, n)
+      block = [x if x.ndim == 0 else x[start:stop] for x in columns]
+      coeffs = self.grid(*block[:d], policy=policy, report=report)
+      if doy is not None:
+        coeffs *= block[d][..., None, None]
+      a = coeffs[..., 0]
+      b = coeffs[..., 1]
+      np.subtract(flat_L[start:stop], a, out=flat_out[start:stop])
+      np.divide(flat_out[start:stop], b, out=flat_out[start:stop])
+
+    return out
+
+
+def _flat(x, shape):
+  """
+  Input variable broadcast to shape and flattened (scalars as they are)
+  """
+  x = np.asarray(x)
+  if x.ndim == 0:
+    return x
+  return np.broadcast_to(x, shape).reshape(-1)
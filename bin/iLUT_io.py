@@ -0,0 +1,188 @@
+"""
+iLUT_io.py
+
+Reading and writing of interpolated look up table (.ilut) files.
+
+An .ilut file holds plain arrays (an uncompressed numpy .npz archive, no
+pickles), so it does not depend on the scipy or python version it was
+written with:
+
+  names    : input variable names, e.g. ['solar_z', 'H2O', 'O3', 'AOT', 'alt']
+  axis_<k> : grid levels of each input variable (i.e. the grid points)
+  values   : (a, b) at each grid point, shape (len(axis_0), .., len(axis_4), 2)
+  bands    : (optional) band names, if values hold several bands, i.e. have
+             shape (len(axis_0), .., len(axis_4), len(bands), 2)
+
+The simplices are implicit: each grid cell is split by the Kuhn triangulation
+of GridInterpolator, so loading needs no triangulation and the values can be
+memory-mapped straight from the file (i.e. only the pages used are read).
+
+Older .ilut files (pickled LinearNDInterpolators) can still be loaded, and
+converted with migrate_iLUTs.py.
+
+"""
+
+import pickle
+import struct
+
+from LUT_store import atomic_write
+
+# heavier modules (numpy, scipy) are imported when needed
+
+FORMAT_VERSION = 1
+
+
+# values of coupled iLUTs, i.e. for correction with surface-atmosphere coupling
+COUPLED_COLUMNS = ['a', 'b', 'spherical_albedo']
+
+
+def engine(method):
+  """
+  Interpolator class of an interpolation method, 'linear' (default) or
+  'cubic' (monotone cubic, see CubicGridInterpolator)
+  """
+  from grid_interpolator import GridInterpolator, CubicGridInterpolator
+
+  engines = {'linear':GridInterpolator, 'cubic':CubicGridInterpolator}
+  if method not in engines:
+    raise ValueError('interpolation method not recognized: {}'.format(method))
+  return engines[method]
+
+
+def interpolate(LUT, dtype=None, columns=None, method='linear'):
+  """
+  Interpolator of a look up table, i.e. a piecewise linear (or monotone
+  cubic) interpolant on its grid (no triangulation needed), of (a, b) or of
+  other columns, see GridInterpolator.from_LUT
+  """
+  return engine(method).from_LUT(LUT, dtype=dtype, columns=columns)
+
+
+def save_iLUT(filepath, interpolator, write=None, bands=None):
+  """
+  Saves an interpolator (GridInterpolator or LinearNDInterpolator on a
+  regular grid) as an .ilut file of plain arrays
+
+  write : (optional) write(dump) saves the file content (e.g. with
+          LUT_Store.put), default is atomic_write
+  bands : (optional) band names of a multi-band interpolator
+  """
+  import numpy as np
+  from grid_interpolator import GridInterpolator
+
+  grid = GridInterpolator.from_interpolator(interpolator)
+
+  arrays = {
+    'format_version':np.array(FORMAT_VERSION),
+    'names':np.array(grid.names),
+    'values':grid.values
+  }
+  for k, ax in enumerate(grid.axes):
+    arrays['axis_{}'.format(k)] = ax
+  if bands is not None:
+    arrays['bands'] = np.array(bands)
+
+  dump = lambda f: np.savez(f, **arrays)
+
+  if write is None:
+    atomic_write(filepath, dump)
+  else:
+    write(dump)
+
+  return filepath
+
+
+def is_array_file(filepath):
+  """
+  True if an .ilut file has the array format (False if it is a pickle)
+  """
+  import zipfile
+
+  return zipfile.is_zipfile(filepath)
+
+
+def read_bands(filepath):
+  """
+  Band names of a multi-band .ilut file (None if it has one band)
+  """
+  import numpy as np
+
+  with np.load(filepath, allow_pickle=False) as npz:
+    if 'bands' not in npz.files:
+      return None
+    return [str(band) for band in npz['bands']]
+
+
+def load_iLUT(filepath, mmap=True, dtype=None, method=None):
+  """
+  Loads an interpolator from an .ilut file
+
+  mmap   : memory-map the values of array files (default) rather than read them
+  dtype  : (optional) e.g. np.float32, converts array files to this dtype
+  method : (optional) interpolation method of array files, 'linear' (default)
+           or 'cubic', i.e. the same file can be used by either engine
+  """
+
+  if is_array_file(filepath):
+    return _load_arrays(filepath, mmap=mmap, dtype=dtype, method=method)
+
+  # pickled interpolator (older files)
+  with open(filepath, 'rb') as f:
+    iLUT = pickle.load(f)
+
+  if method is not None:
+    return engine(method).from_interpolator(iLUT, dtype=dtype)
+  return iLUT
+
+
+def _load_arrays(filepath, mmap=True, dtype=None, method=None):
+  """
+  GridInterpolator (or CubicGridInterpolator) from an .ilut file of arrays
+  """
+  import numpy as np
+
+  with np.load(filepath, allow_pickle=False) as npz:
+    version = int(npz['format_version'])
+    if version > FORMAT_VERSION:
+      raise ValueError('.ilut format version {} is newer than this code ({})'
+                       .format(version, FORMAT_VERSION))
+    names = [str(name) for name in npz['names']]
+    axes = [npz['axis_{}'.format(k)] for k in range(len(names))]
+    values = _memmap_member(filepath, 'values.npy') if mmap else None
+    if values is None:
+      values = npz['values']
+
+  return engine(method or 'linear')(axes, values, dtype=dtype, names=names)
+
+
+def _memmap_member(filepath, member):
+  """
+  Read-only memory map of an (uncompressed) array in an .npz file,
+  or None if it is compressed
+  """
+  import zipfile
+  import numpy as np
+
+  with zipfile.ZipFile(filepath) as zf:
+    info = zf.getinfo(member)
+  if info.compress_type != zipfile.ZIP_STORED:
+    return None
+
+  with open(filepath, 'rb') as f:
+
+    # skip zip local file header (30 bytes + file name + extra field)
+    f.seek(info.header_offset)
+    header = f.read(30)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    f.seek(info.header_offset + 30 + name_length + extra_length)
+
+    # npy header
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+      shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+      shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    offset = f.tell()
+
+  return np.memmap(filepath, dtype=dtype, mode='r', offset=offset, shape=shape,
+                   order='F' if fortran_order else 'C')
@@ -9,23 +9,51 @@ of LUTs (look up tables) used by the 6S emulator
 import os
 import glob
 import pickle
-import urllib.request
-import zipfile
-import time
-from itertools import product
-from scipy.interpolate import LinearNDInterpolator
+
+import iLUT_io
+from LUT_store import config_key
+from profiling import Profiler
+
+# heavier modules (scipy, numpy, urllib, zipfile) are imported when needed,
+# so that loading iLUTs for correction starts quickly
 
 
 class Interpolated_LUTs:
   """
   The Interpolated_LUTs class handles loading, downloading and interpolating
   of LUTs (look up tables) used by the 6S emulator.
+
+  store  : (optional) LUT_Store, i.e. content-addressed storage of (i)LUTs,
+           used in addition to the files directory of this repo
+  coupled: (optional) iLUTs of (a, b, spherical albedo), i.e. for correction
+           with surface-atmosphere coupling (.coupled.ilut files)
+  aerosol_profile: (optional) aerosol profile of the (i)LUTs (default
+           Continental), Mixture for those of an aerosol mixture build
+           (see LUT_build.py --aerosol Mixture)
+  profile: (optional) profiles loading, interpolating and downloading, i.e.
+           writes cProfile statistics and tracemalloc peak memory and top
+           allocations next to each (i)LUT (see profiling.py)
+  build_type: (optional) build type of the (i)LUTs in the store (default
+           full, e.g. coarse for cubic interpolation)
   """
   
-  def __init__(self, mission):
+  def __init__(self, mission, store=None, coupled=False, aerosol_profile='Continental',
+               profile=False, build_type='full'):
     
     # satellite mission
     self.mission = mission
+    self.aerosol_profile = aerosol_profile
+    self.build_type = build_type
+    self.profiler = Profiler(enabled=profile)
+
+    # kind (and file extension) of iLUTs
+    self.coupled = coupled
+    self.iLUT_kind = 'coupled_ilut' if coupled else 'ilut'
+    self.iLUT_ext = '.coupled.ilut' if coupled else '.ilut'
+
+    # (optional) LUT store and file names of its (i)LUTs {filepath: filename}
+    self.store = store
+    self.filenames = {}
 
     # Earth Engine mission to Py6S sensor name
     self.py6S_sensor_names = {
@@ -41,23 +69,14 @@ class Interpolated_LUTs:
     self.bin_path = os.path.dirname(os.path.abspath(__file__))
     self.base_path = os.path.dirname(self.bin_path)
     self.files_dir = os.path.join(self.base_path,'files')
-    if not os.path.isdir(self.files_dir):
-      print('files directory not found, will create at:\n{}'.format(self.files_dir))
-      os.makedirs(self.files_dir)
 
-    # absolute path to LUTs directory
+    # absolute path to LUTs directory (created when downloading)
     self.LUTs_dir = os.path.join(self.files_dir,'LUTs',self.py6S_sensor,\
-    'Continental','view_zenith_0')
-    if not os.path.isdir(self.LUTs_dir):
-      print('LUT directory created:\n{}'.format(self.LUTs_dir))
-      os.makedirs(self.LUTs_dir)
+    self.aerosol_profile,'view_zenith_0')
 
-    # absolute path to iLUTs directory
+    # absolute path to iLUTs directory (created when interpolating)
     self.iLUTs_dir = os.path.join(self.files_dir,'iLUTs',self.py6S_sensor,\
-    'Continental','view_zenith_0')
-    if not os.path.isdir(self.iLUTs_dir):
-      print('iLUT directory created:\n{}'.format(self.iLUTs_dir))
-      os.makedirs(self.iLUTs_dir)
+    self.aerosol_profile,'view_zenith_0')
     
     # Earth Engine Sentinel 2 bandName from Py6S bandName switch
     self.ee_sentinel2_bandNames = {
@@ -76,26 +95,27 @@ class Interpolated_LUTs:
       '13':'B12',
     }
 
-  def get(self):
+  def get(self, dtype=None, method=None):
     """
     Loads interpolated look up tables from local files (if they exist)
+
+    dtype : (optional) e.g. np.float32, returns GridInterpolators that store
+            and interpolate the tables in this dtype
+    method: (optional) 'cubic' for monotone cubic interpolation of the
+            tables (e.g. of a 'coarse' build), default is linear
     """
       
     self.iLUTs = {}
     
     # load iLUTs
-    filepaths = glob.glob(self.iLUTs_dir+os.path.sep+'*.ilut')
+    filepaths = self.iLUT_filepaths()
     if filepaths:
       
       try:
         for f in filepaths:
-          bandName = os.path.basename(f).split('.')[0][-2:]
-          
-          # Sentinel 2 band names vary between Earth Engine and Py6S
-          if self.mission == 'COPERNICUS/S2':
-            bandName = self.ee_sentinel2_bandNames[bandName]
-
-          self.iLUTs[bandName] = pickle.load(open(f,'rb'))
+          with self.profiler.phase('load iLUT'):
+            self.iLUTs[self.bandName(f)] = self.load_iLUT(f, dtype=dtype, method=method)
+          self.profiler.write(f)
       except:
         print('problem loading interpolated look up table (.ilut) files from:\n'+self.iLUTs_dir)      
     else:
@@ -103,12 +123,123 @@ class Interpolated_LUTs:
     
     return self.iLUTs
 
+  def hyperspectral(self, dtype=None):
+    """
+    Interpolated look up tables of all bands in one container (bands as a
+    trailing array axis), see hyperspectral.py
+    """
+    from hyperspectral import HyperspectralLUTs
+
+    iLUTs = self.get(dtype=dtype)
+    if not iLUTs:
+      return None
+    return HyperspectralLUTs.from_iLUTs(iLUTs, dtype=dtype)
+
+  def surrogates(self, dtype=None):
+    """
+    Loads surrogates (.surrogate files made with LUT_surrogate.py), which
+    can be used instead of iLUTs, see surrogate.py
+    """
+    from surrogate import ChebyshevSurrogate
+
+    filepaths = sorted(glob.glob(self.iLUTs_dir+os.path.sep+'*.surrogate'))
+    if not filepaths:
+      print('Looked for surrogates but did not find in:\n{}'.format(self.iLUTs_dir))
+    surrogates = {}
+    for f in filepaths:
+      with self.profiler.phase('load surrogate'):
+        surrogates[self.bandName(f)] = ChebyshevSurrogate.load(f, dtype=dtype)
+      self.profiler.write(f)
+    return surrogates
+
+  def LUT_filepaths(self):
+    """
+    Look up table (.lut) files of this mission
+    """
+    filepaths = glob.glob(self.LUTs_dir+os.path.sep+'*.lut')
+    return self._with_stored(filepaths, 'lut')
+
+  def iLUT_filepaths(self):
+    """
+    Interpolated look up table (.ilut) files of this mission
+    """
+    filepaths = [f for f in glob.glob(self.iLUTs_dir+os.path.sep+'*'+self.iLUT_ext)
+                 if self.coupled or not f.endswith('.coupled.ilut')]
+    return self._with_stored(filepaths, self.iLUT_kind)
+
+  def _with_stored(self, filepaths, kind):
+    """
+    Files of the LUT store (see _stored) then those of the files directory,
+    the store takes precedence, i.e. files of bands it has are skipped
+    """
+    stored = self._stored(kind)
+    bands = set(self.bandName(f) for f in stored)
+    return stored + [f for f in sorted(filepaths) if self.bandName(f) not in bands]
+
+  def _stored(self, kind):
+    """
+    Files of this mission in the LUT store (if any) of its build, i.e. of
+    its aerosol profile and build type (entries without one are from before
+    it was recorded), the latest of each filename (i.e. the latest stage of
+    a progressive build). Files are looked up with LUT_Store.lookup, which
+    skips invalid files and records the access (for eviction).
+    """
+    if self.store is None:
+      return []
+    latest = {}
+    index = self.store.index()
+    build = {'sensor':self.py6S_sensor, 'aerosol_profile':self.aerosol_profile,
+             'build_type':self.build_type}
+    defaults = {'aerosol_profile':'Continental', 'build_type':self.build_type}
+    for key, entries in index.items():
+      entry = entries.get(kind)
+      if entry is None:
+        continue
+      meta = entry['meta']
+      if any(meta.get(k, defaults.get(k)) != v for k, v in build.items()):
+        continue
+      filename = meta['filename']
+      if filename not in latest or entry['created'] > latest[filename][0]:
+        latest[filename] = (entry['created'], key)
+    filepaths = []
+    for filename, (created, key) in sorted(latest.items()):
+      filepath = self.store.lookup(key, kind, index=index)
+      if filepath is not None:
+        self.filenames[filepath] = filename
+        filepaths.append(filepath)
+    return filepaths
+
+  def bandName(self, filepath):
+    """
+    Band name of a (i)LUT file
+    """
+    filename = self.filenames.get(filepath, os.path.basename(filepath))
+    bandName = filename.split('.')[0][-2:]
+          
+    # Sentinel 2 band names vary between Earth Engine and Py6S
+    if self.mission == 'COPERNICUS/S2':
+      bandName = self.ee_sentinel2_bandNames[bandName]
+
+    return bandName
+
+  def load_iLUT(self, filepath, dtype=None, method=None):
+    """
+    Loads one interpolated look up table (values are memory-mapped)
+    """
+    iLUT = iLUT_io.load_iLUT(filepath, dtype=dtype, method=method)
+
+    if dtype is not None:
+      from grid_interpolator import GridInterpolator
+      iLUT = GridInterpolator.from_interpolator(iLUT, dtype=dtype)
+
+    return iLUT
+
   def interpolate_LUTs(self):
     """
     interpolate look up tables
     """
     
-    filepaths = sorted(glob.glob(self.LUTs_dir+os.path.sep+'*.lut'))
+    filepaths = self.LUT_filepaths()
 
     if filepaths:
       
@@ -117,37 +248,7 @@ class Interpolated_LUTs:
       try:
 
         for fpath in filepaths:
-          
-          fname = os.path.basename(fpath)
-          fid, ext = os.path.splitext(fname)
-          ilut_filepath = os.path.join(self.iLUTs_dir,fid+'.ilut')
-          
-          if os.path.isfile(ilut_filepath):
-            print('iLUT file already exists (skipping interpolation): {}'.format(fname))
-          else:
-            print('Interpolating: '+fname)
-
-            # load look up table
-            LUT = pickle.load(open(fpath,"rb"))
-
-            # input variables (all permutations)
-            invars = LUT['config']['invars']
-            inputs = list(product(invars['solar_zs'],
-                                  invars['H2Os'],
-                                  invars['O3s'],
-                                  invars['AOTs'],
-                                  invars['alts']))  
-            
-            # output variables (6S correction coefficients)
-            outputs = LUT['outputs']
-
-            # piecewise linear interpolant in n-dimensions
-            t = time.time()
-            interpolator = LinearNDInterpolator(inputs,outputs)
-            print('Interpolation took {:.2f} (secs) = '.format(time.time()-t))
-            
-            # save new interpolated LUT file
-            pickle.dump(interpolator, open(ilut_filepath, 'wb' ))
+          self.interpolate_LUT(fpath)
 
       except:
 
@@ -157,43 +258,108 @@ class Interpolated_LUTs:
       
       print('LUTs directory: ',self.LUTs_dir)
       print('LUT files (.lut) not found in LUTs directory, try downloading?')
+
+  def interpolate_LUT(self, fpath):
+    """
+    interpolate one look up table (unless its iLUT file already exists and
+    is newer, i.e. not of an earlier stage of a progressive build)
+    """
+
+    fname = self.filenames.get(fpath, os.path.basename(fpath))
+    fid, ext = os.path.splitext(fname)
+    ilut_filepath = os.path.join(self.iLUTs_dir,fid+self.iLUT_ext)
+    
+    if (self.store is None and os.path.isfile(ilut_filepath)
+        and os.path.getmtime(ilut_filepath) >= os.path.getmtime(fpath)):
+      print('iLUT file already exists (skipping interpolation): {}'.format(fname))
+      return
+
+    # load look up table
+    with self.profiler.phase('load LUT'):
+      LUT = pickle.load(open(fpath,"rb"))
+
+    if self.store is not None and self.store.get(LUT['config'], self.iLUT_kind):
+      print('iLUT file already exists (skipping interpolation): {}'.format(fname))
+    elif self.coupled and 'spherical_albedo' not in LUT.get('columns', {}):
+      print('LUT has no spherical albedo (skipping coupled interpolation): {}'.format(fname))
+    else:
+      print('Interpolating: '+fname)
+
+      # piecewise linear interpolant in n-dimensions
+      columns = iLUT_io.COUPLED_COLUMNS if self.coupled else None
+      with self.profiler.phase('interpolate'):
+        interpolator = iLUT_io.interpolate(LUT, columns=columns)
       
+      # save new interpolated LUT file (arrays, see iLUT_io)
+      if self.store is not None:
+        write = lambda dump: self.store.put(LUT['config'], self.iLUT_kind, dump,
+                                            sensor=self.py6S_sensor, filename=fid+self.iLUT_ext,
+                                            aerosol_profile=self.aerosol_profile,
+                                            build_type=LUT['config'].get('build_type'))
+        ilut_filepath = self.store.filepath(config_key(LUT['config']), self.iLUT_kind)
+        with self.profiler.phase('save iLUT'):
+          iLUT_io.save_iLUT(ilut_filepath, interpolator, write=write)
+      else:
+        # (exist_ok, as other tasks may interpolate other bands concurrently)
+        os.makedirs(self.iLUTs_dir, exist_ok=True)
+        with self.profiler.phase('save iLUT'):
+          iLUT_io.save_iLUT(ilut_filepath, interpolator)
+      self.profiler.write(ilut_filepath)
 
-  def download_LUTs(self):
+    # (loading only, i.e. skipped)
+    self.profiler.write(fpath)
+
+  # URLs for Sentinel 2 and Landsats (dl=1 is important)
+  LUT_URLs = {
+    'S2A_MSI':"https://www.dropbox.com/s/aq873gil0ph47fm/S2A_MSI.zip?dl=1",
+    'LANDSAT_OLI':'https://www.dropbox.com/s/49ikr48d2qqwkhm/LANDSAT_OLI.zip?dl=1',
+    'LANDSAT_ETM':'https://www.dropbox.com/s/z6vv55cz5tow6tj/LANDSAT_ETM.zip?dl=1',
+    'LANDSAT_TM':'https://www.dropbox.com/s/uyiab5r9kl50m2f/LANDSAT_TM.zip?dl=1'
+  }
+
+  def download_LUTs(self, cancelled=None):
+    """
+    Downloads and extracts the look up tables of this mission
+
+    cancelled: (optional) threading.Event, stops the download when set
+    """
+    import urllib.request
+    import zipfile
     
     # directory for zip file
     zip_dir = os.path.join(self.files_dir,'LUTs')
-    if not os.path.isdir(zip_dir):
-      os.makedirs(zip_dir)
-
-    # URLs for Sentinel 2 and Landsats (dl=1 is important)
-    getURL = {
-      'S2A_MSI':"https://www.dropbox.com/s/aq873gil0ph47fm/S2A_MSI.zip?dl=1",
-      'LANDSAT_OLI':'https://www.dropbox.com/s/49ikr48d2qqwkhm/LANDSAT_OLI.zip?dl=1',
-      'LANDSAT_ETM':'https://www.dropbox.com/s/z6vv55cz5tow6tj/LANDSAT_ETM.zip?dl=1',
-      'LANDSAT_TM':'https://www.dropbox.com/s/uyiab5r9kl50m2f/LANDSAT_TM.zip?dl=1',
-      'LANDSAT_TM':'https://www.dropbox.com/s/uyiab5r9kl50m2f/LANDSAT_TM.zip?dl=1'
-    }
+    os.makedirs(zip_dir, exist_ok=True)
 
-    # download LUTs data
+    # download LUTs data (in chunks, to a temporary file)
     print('Downloading look up table (LUT) zip file..')
-    url = getURL[self.py6S_sensor]
-    u = urllib.request.urlopen(url)
-    data = u.read()
-    u.close()
-    
-    # save to zip file
+    url = self.LUT_URLs[self.py6S_sensor]
     zip_filepath = os.path.join(zip_dir,self.py6S_sensor+'.zip')
-    with open(zip_filepath, "wb") as f :
-        f.write(data)
+    part_filepath = zip_filepath+'.part'
+    try:
+      with self.profiler.phase('download'):
+        with urllib.request.urlopen(url) as u, open(part_filepath, "wb") as f:
+          while True:
+            if cancelled is not None and cancelled.is_set():
+              print('Download cancelled: '+self.py6S_sensor)
+              return
+            data = u.read(1 << 20)
+            if not data:
+              break
+            f.write(data)
+      os.replace(part_filepath, zip_filepath)
+    finally:
+      if os.path.isfile(part_filepath):
+        os.remove(part_filepath)
 
     # extract LUTs directory
     print('Extracting zip file..')
-    with zipfile.ZipFile(zip_filepath,"r") as zip_ref:
-        zip_ref.extractall(zip_dir)
+    with self.profiler.phase('extract'):
+      with zipfile.ZipFile(zip_filepath,"r") as zip_ref:
+          zip_ref.extractall(zip_dir)
 
     # delete zip file
     os.remove(zip_filepath)
+    self.profiler.write(os.path.join(zip_dir,self.py6S_sensor))
 
     print('Done: LUT files available locally')
 
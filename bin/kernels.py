@@ -0,0 +1,147 @@
+"""
+kernels.py
+
+Fused per-pixel kernels, i.e. interpolation of correction coefficients and
+surface reflectance in a single pass over the pixels.
+
+If numba is installed the kernel is compiled (and releases the GIL), so that
+tiles of one scene can be corrected concurrently by a pool of threads.
+Otherwise a pure numpy version is used.
+
+"""
+
+import numpy as np
+
+
+# compiled kernel (None = not built yet, False = numba not available)
+_numba_kernel = None
+
+
+def numba_kernel():
+  """
+  Compiled reflectance kernel, or None if numba is not installed
+  """
+
+  global _numba_kernel
+
+  if _numba_kernel is None:
+    try:
+      import numba
+    except ImportError:
+      _numba_kernel = False
+    else:
+      _numba_kernel = numba.njit(nogil=True, cache=True)(_reflectance_kernel)
+
+  return _numba_kernel or None
+
+
+def _reflectance_kernel(levels, offsets, strides, table, L, x, correction, out,
+                        policies, counts):
+  """
+  Surface reflectance for each pixel (p) from radiance L[p] and input
+  variables x[:, p] by Kuhn simplex interpolation of table[:, (a, b)].
+
+  levels     : grid levels of all axes (concatenated)
+  offsets    : start of each axis in levels (plus end of last axis)
+  strides    : flat table stride of each axis
+  correction : elliptical orbit correction (length n or 1)
+  policies   : out-of-range policy code of each axis (see grid_interpolator)
+  counts     : number of out-of-range pixels of each axis (incremented)
+  """
+
+  ndim = strides.shape[0]
+  n = out.shape[0]
+  t = np.empty(ndim, dtype=table.dtype)
+  steps = np.empty(ndim, dtype=strides.dtype)
+
+  for p in range(n):
+
+    # grid cell and position within the cell
+    corner = 0
+    m = 0
+    inside = True
+    for k in range(ndim):
+      lo = offsets[k]
+      hi = offsets[k + 1] - 1
+      xk = x[k, p]
+      if not (xk >= levels[lo] and xk <= levels[hi]):
+        counts[k] += 1
+        policy = policies[k]
+        if xk != xk or policy == 0 or policy == 3:
+          inside = False
+        elif policy == 1 or hi == lo:
+          xk = min(max(xk, levels[lo]), levels[hi])
+      if not inside or hi == lo:
+        continue
+
+      # binary search for the lower level of the cell
+      i = lo
+      j = hi - 1
+      while i < j:
+        mid = (i + j + 1) // 2
+        if levels[mid] <= xk:
+          i = mid
+        else:
+          j = mid - 1
+
+      tk = (xk - levels[i]) / (levels[i + 1] - levels[i])
+      corner += (i - lo) * strides[k]
+
+      # insertion sort (descending) of position coordinates
+      q = m
+      while q > 0 and t[q - 1] < tk:
+        t[q] = t[q - 1]
+        steps[q] = steps[q - 1]
+        q -= 1
+      t[q] = tk
+      steps[q] = strides[k]
+      m += 1
+
+    if not inside:
+      out[p] = np.nan
+      continue
+
+    # barycentric interpolation along the simplex
+    vertex = corner
+    w = 1 - t[0] if m > 0 else 1.0
+    a = w * table[vertex, 0]
+    b = w * table[vertex, 1]
+    for q in range(m):
+      vertex += steps[q]
+      w = t[q] - t[q + 1] if q + 1 < m else t[q]
+      a += w * table[vertex, 0]
+      b += w * table[vertex, 1]
+
+    c = correction[p] if correction.shape[0] > 1 else correction[0]
+    out[p] = (L[p] - a * c) / (b * c)
+
+
+def reflectance(grid, L, columns, correction, out, policies, counts):
+  """
+  Surface reflectance for one chunk of pixels (L, columns and correction
+  are 1D arrays of the chunk length or 1), written to out. The number of
+  out-of-range pixels of each axis is added to counts.
+  """
+
+  n = len(out)
+  kernel = numba_kernel() if grid.compiled_kernel else None
+
+  if kernel is not None:
+    dtype = grid.dtype
+    x = np.empty((grid.ndim, n), dtype=dtype)
+    for k, col in enumerate(columns):
+      x[k] = col
+    kernel(grid.levels, grid.offsets, grid.strides, grid.flat_values,
+           np.broadcast_to(np.asarray(L, dtype=dtype), (n,)), x,
+           np.asarray(correction, dtype=dtype), out, policies, counts)
+    return
+
+  # pure numpy (still one chunk at a time)
+  coeffs = np.empty((n, 2), dtype=grid.dtype)
+  grid._evaluate(columns, coeffs, policies, counts)
+  a = coeffs[:, 0]
+  b = coeffs[:, 1]
+  a *= correction
+  b *= correction
+  np.subtract(L, a, out=out)
+  np.divide(out, b, out=out)
@@ -0,0 +1,287 @@
+"""
+parameter_space.py
+
+Input variables (i.e. parameter space) of look up tables. These are shared
+by the LUT builder, the interpolator and the correction modules, and only
+need numpy (i.e. no Py6S).
+
+"""
+
+from itertools import product
+
+
+def mid_points(elements):
+  import numpy as np
+  x = np.array(elements)
+  return (x[1:] + x[:-1]) / 2
+
+# aerosol types of a mixture build, at mixture coordinates 0, 1 and 2, as
+# fractions of the basic 6S components (those of its predefined profiles)
+AEROSOL_TYPES = ['Maritime', 'Continental', 'Urban']
+AEROSOL_COMPONENTS = {
+  'Maritime':{'dust':0.0, 'water':0.05, 'oceanic':0.95, 'soot':0.0},
+  'Continental':{'dust':0.70, 'water':0.29, 'oceanic':0.0, 'soot':0.01},
+  'Urban':{'dust':0.17, 'water':0.61, 'oceanic':0.0, 'soot':0.22}
+}
+
+# levels of the aerosol mixture coordinate (i.e. pure types and halfway blends)
+AEROSOL_MIXTURES = [0, 0.5, 1, 1.5, 2]
+
+def aerosol_components(mixture):
+  """
+  Fractions of the basic aerosol components at a mixture coordinate, i.e.
+  a linear blend of the two neighbouring types, e.g. 0.5 is halfway from
+  Maritime to Continental (see Py6S AeroProfile.User)
+  """
+  i = min(max(int(mixture), 0), len(AEROSOL_TYPES) - 2)
+  w = mixture - i
+  lower = AEROSOL_COMPONENTS[AEROSOL_TYPES[i]]
+  upper = AEROSOL_COMPONENTS[AEROSOL_TYPES[i + 1]]
+  return {name:(1 - w)*lower[name] + w*upper[name] for name in lower}
+
+def aerosol_mixture(types):
+  """
+  Mixture coordinate of aerosol types (names), e.g. of a per pixel
+  aerosol type map
+  """
+  import numpy as np
+  codes = {name:float(k) for k, name in enumerate(AEROSOL_TYPES)}
+  return np.vectorize(codes.__getitem__, otypes=[float])(types)
+
+def invar_keys(invars):
+  """
+  Keys of the input variables of a parameter space, in grid order (i.e.
+  with the aerosol mixture last, if there is one)
+  """
+  keys = ['solar_zs', 'H2Os', 'O3s', 'AOTs', 'alts']
+  if 'aerosol_mixtures' in invars:
+    keys.append('aerosol_mixtures')
+  return keys
+
+def input_variables(build_type, aerosol_mixture=False):
+  """
+  Defines the input variables (i.e. parameter space) for
+  a given build_type
+  
+  The input variables are:
+  - solar zenith angle (degrees)
+  - water vapour column (g/m2)
+  - ozone column (cm-atm)
+  - aerosol optical thickness
+  - altitude (km above sealevel)
+  - (optional) aerosol mixture coordinate, see aerosol_components
+  """
+ 
+  test = {
+    'solar_zs':[0],
+    'H2Os':[0],
+    'O3s':[0],
+    'AOTs':[0],
+    'alts':[0]
+  }
+  
+  test2 = {
+    'solar_zs':[0,10,20],
+    'H2Os':[0,2,3],
+    'O3s':[0,0.4,0.8],
+    'AOTs':[0,1.0],
+    'alts':[0,2,4]
+  }
+  
+  full = {
+    'solar_zs': [0, 10, 20, 30, 40, 50, 60, 65, 70, 75],  
+    'H2Os': [0, 0.25, 0.5, 1, 1.5, 2, 3, 5, 8.5],  
+    'O3s': [0.0, 0.8],  
+    'AOTs': [0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.25, 3],
+    'alts': [0,1,4,7.75]
+  }
+  # Maximum altitude is set to 7.75 km to avoid 6S's 8 km scale height. 
+  # Note, only 30 mountain peaks in the world are higher than 7.75 km:
+  # https://en.wikipedia.org/wiki/List_of_highest_mountains
+  # and can probably safely model targets >7.75 km as being at 7.75 km
+  
+  coarse = {
+    'solar_zs': [0, 30, 50, 65, 75],
+    'H2Os': [0, 0.5, 1.5, 3, 5, 8.5],
+    'O3s': [0.0, 0.8],
+    'AOTs': [0, 0.25, 0.75, 1.5, 3],
+    'alts': [0, 2.5, 7.75]
+  }
+  # This 'coarse' build has 900 points (i.e. 6S runs) instead of 6480, for
+  # use with monotone cubic interpolation (method='cubic', see
+  # grid_interpolator.CubicGridInterpolator) which follows the curvature
+  # between levels that linear interpolation needs dense levels for.
+
+  validation = {
+    'solar_zs':mid_points(full['solar_zs']),  
+    'H2Os':mid_points(full['H2Os']),  
+    'O3s':mid_points(full['O3s']),  
+    'AOTs':mid_points(full['AOTs']),
+    'alts':mid_points(full['alts'])
+  }
+  # This 'validation' parameter space uses the midpoints between the 
+  # normal, i.e. 'full', build because we expect it to be the toughest test.
+  # We also test using a Monte Carlo approach (an easier test).
+
+  build_selector = {
+    'test':test,
+    'test2':test2,
+    'validation':validation,
+    'coarse':coarse,
+    'full':full    
+  }
+
+  invars = dict(build_selector[build_type])
+  if aerosol_mixture:
+    invars['aerosol_mixtures'] = AEROSOL_MIXTURES
+    if build_type == 'validation':
+      invars['aerosol_mixtures'] = mid_points(AEROSOL_MIXTURES)
+    if build_type == 'test':
+      invars['aerosol_mixtures'] = [1]
+
+  return invars
+
+def permutate_invars(invars):
+  """
+  permutation of input variables for LUT, i.e. a ParameterGrid (a sequence
+  of points that are computed from their index rather than stored)
+  """
+  return ParameterGrid(invars)
+
+# names of the input variables (i.e. of grid axes) of each key
+INVAR_NAMES = {
+  'solar_zs':'solar_z',
+  'H2Os':'H2O',
+  'O3s':'O3',
+  'AOTs':'AOT',
+  'alts':'alt',
+  'aerosol_mixtures':'aerosol_mixture'
+}
+
+class ParameterGrid:
+  """
+  Regular grid of input variables, i.e. the points (tuples) of the product
+  of their levels in LUT order (the last variable varies fastest). Points
+  are computed from their flat index, so the grid is a sequence of any size
+  that takes no memory:
+
+    grid = ParameterGrid(invars)
+    len(grid), grid[i], grid[i:j], iter(grid)
+    grid.index(point)           # flat index of a point
+    grid.shards(n)              # ranges of flat indices, e.g. for workers
+    grid.coordinates(start, stop)  # points as a numpy array
+  """
+
+  def __init__(self, invars):
+    self.keys = invar_keys(invars)
+    self.names = [INVAR_NAMES[k] for k in self.keys]
+    self.levels = [list(invars[k]) for k in self.keys]
+    self.shape = tuple(len(levels) for levels in self.levels)
+    self.ndim = len(self.shape)
+    self.size = 1
+    for n in self.shape:
+      self.size *= n
+
+    # strides of each axis in flat indices, and the index of each level
+    self.strides = [1]*self.ndim
+    for k in range(self.ndim - 2, -1, -1):
+      self.strides[k] = self.strides[k + 1]*self.shape[k + 1]
+    self._positions = [{level:i for i, level in enumerate(levels)} for levels in self.levels]
+
+  def __len__(self):
+    return self.size
+
+  def __iter__(self):
+    return product(*self.levels)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(self.size))]
+    return tuple(levels[i] for levels, i in zip(self.levels, self.unravel(index)))
+
+  def __repr__(self):
+    return 'ParameterGrid({})'.format(dict(zip(self.keys, self.shape)))
+
+  def ravel(self, multi_index):
+    """
+    Flat index of a grid point from the level index of each variable
+    """
+    if len(multi_index) != self.ndim:
+      raise ValueError('expected {} level indices, got {}'.format(self.ndim, len(multi_index)))
+    flat = 0
+    for i, n, stride in zip(multi_index, self.shape, self.strides):
+      if not -n <= i < n:
+        raise IndexError('level index out of range: {}'.format(tuple(multi_index)))
+      flat += (i % n)*stride
+    return flat
+
+  def unravel(self, index):
+    """
+    Level index of each variable of a grid point from its flat index
+    """
+    if not -self.size <= index < self.size:
+      raise IndexError('grid index out of range: {}'.format(index))
+    index %= self.size
+    return tuple((index // stride) % n for n, stride in zip(self.shape, self.strides))
+
+  def index(self, point):
+    """
+    Flat index of a grid point (i.e. of the values of its input variables)
+    """
+    if len(point) != self.ndim:
+      raise ValueError('expected a point of {} variables, got {}'.format(self.ndim, len(point)))
+    try:
+      return self.ravel([positions[x] for positions, x in zip(self._positions, point)])
+    except KeyError:
+      raise ValueError('not a grid point: {}'.format(tuple(point)))
+
+  def shards(self, n):
+    """
+    n contiguous ranges of flat indices (nearly equal in size) that cover
+    the grid, e.g. to share a build between workers
+    """
+    bounds = [self.size*k // n for k in range(n + 1)]
+    return [range(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+  def coordinates(self, start=0, stop=None, dtype=None):
+    """
+    Points from flat index start to stop as an array (points, variables)
+    """
+    import numpy as np
+    flat = np.arange(*slice(start, stop).indices(self.size))
+    multi_index = np.unravel_index(flat, self.shape)
+    return np.stack([np.asarray(levels, dtype=dtype or np.float64)[i]
+                     for levels, i in zip(self.levels, multi_index)], axis=-1).reshape(len(flat), self.ndim)
+
+  def is_sorted(self):
+    """
+    Whether the levels of each variable are strictly increasing, i.e.
+    values in grid order are a (C order) array of the interpolation grid
+    """
+    return all(all(a < b for a, b in zip(levels[:-1], levels[1:])) for levels in self.levels)
+
+def progressive_invars(invars):
+  """
+  Input variables of the stages of a progressive (coarse to fine) build,
+  each a subgrid of the next: the grid corners (first and last level of
+  each variable), a coarse subgrid (every other level and the last) and
+  the full grid
+  """
+  keys = invar_keys(invars)
+
+  def subgrid(levels):
+    return {k:[v for i, v in enumerate(invars[k]) if i in levels(len(invars[k]))]
+            for k in keys}
+
+  stages = [
+    subgrid(lambda n: {0, n - 1}),
+    subgrid(lambda n: set(range(0, n, 2)) | {n - 1}),
+    {k:list(invars[k]) for k in keys}
+  ]
+
+  # (small grids have fewer distinct stages)
+  unique = []
+  for stage in stages:
+    if not unique or stage != unique[-1]:
+      unique.append(stage)
+  return unique
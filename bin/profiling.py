@@ -0,0 +1,149 @@
+"""
+profiling.py
+
+Opt-in profiling of LUT builds, interpolation and loading (e.g. with
+LUT_build.py --profile), i.e. cProfile statistics and tracemalloc peak
+memory and top allocations of each phase of a run, written next to the
+artifact (LUT, iLUT, ..) when it is done:
+
+  <artifact>.profile.txt : per phase, time, peak memory (above that at the
+                           start of the phase), top allocations (still held
+                           at its end) and top functions (cumulative time)
+  <artifact>.prof        : cProfile statistics of all phases (pstats format,
+                           e.g. for snakeviz)
+
+6S runs in a subprocess, so its time shows as waiting on that process (and
+its memory is not traced). cProfile and tracemalloc are process wide, so
+phases of concurrent threads (e.g. of AsyncInterpolated_LUTs) take turns,
+and each thread writes the phases it profiled.
+
+Example
+-------
+
+  profiler = Profiler(enabled=True)
+  with profiler.phase('interpolate'):
+    interpolator = iLUT_io.interpolate(LUT)
+  profiler.write(ilut_filepath)
+
+"""
+
+import io
+import threading
+import time
+from contextlib import contextmanager
+
+# cProfile, pstats and tracemalloc are imported when profiling (i.e. not by
+# every run that only has a disabled Profiler)
+
+# one profiled phase at a time (per process), and whether this thread is
+# in one (nested phases are part of the outer one)
+_lock = threading.Lock()
+_thread = threading.local()
+
+
+class Profiler:
+  """
+  Profiles named phases of a run, does nothing unless enabled
+
+  enabled : profile (or not)
+  top     : number of allocations and functions in the report of each phase
+  """
+
+  def __init__(self, enabled=False, top=15):
+    self.enabled = enabled
+    self.top = top
+    self._local = threading.local()
+
+  def __getstate__(self):
+    # (e.g. for a process pool executor)
+    return {'enabled':self.enabled, 'top':self.top}
+
+  def __setstate__(self, state):
+    self.__init__(**state)
+
+  @property
+  def phases(self):
+    """
+    Phases profiled by this thread (since its last write)
+    """
+    if not hasattr(self._local, 'phases'):
+      self._local.phases = []
+    return self._local.phases
+
+  @contextmanager
+  def phase(self, name):
+    """
+    Profiles a phase of the run (nested phases are part of the outer one)
+    """
+    if not self.enabled or getattr(_thread, 'active', False):
+      yield
+      return
+    import cProfile
+    import tracemalloc
+
+    with _lock:
+      _thread.active = True
+      started = not tracemalloc.is_tracing()
+      if started:
+        tracemalloc.start()
+      tracemalloc.reset_peak()
+      memory0 = tracemalloc.get_traced_memory()[0]
+      snapshot0 = tracemalloc.take_snapshot()
+
+      profile = cProfile.Profile()
+      time0 = time.perf_counter()
+      profile.enable()
+      try:
+        yield
+      finally:
+        profile.disable()
+        seconds = time.perf_counter() - time0
+        peak = tracemalloc.get_traced_memory()[1] - memory0
+        allocations = tracemalloc.take_snapshot().compare_to(snapshot0, 'lineno')
+        if started:
+          tracemalloc.stop()
+        _thread.active = False
+        self.phases.append({'name':name, 'seconds':seconds, 'peak':peak,
+                            'allocations':allocations[:self.top], 'profile':profile})
+
+  def report(self):
+    """
+    Text report of the phases profiled so far
+    """
+    import pstats
+
+    lines = []
+    for phase in self.phases:
+      lines.append('== {}: {:.3f} s, peak memory {:.1f} MB'
+                   .format(phase['name'], phase['seconds'], phase['peak'] / 2**20))
+      lines.append('\ntop allocations:')
+      lines.extend('  {}'.format(stat) for stat in phase['allocations'])
+      stream = io.StringIO()
+      pstats.Stats(phase['profile'], stream=stream).sort_stats('cumulative').print_stats(self.top)
+      lines.append('\ntop functions:')
+      lines.append(stream.getvalue().strip())
+      lines.append('')
+    return '\n'.join(lines)
+
+  def write(self, filepath):
+    """
+    Writes the profile of the phases so far next to an artifact (i.e.
+    filepath.profile.txt and filepath.prof) and starts over, returns the
+    report path (None if not enabled or nothing was profiled)
+    """
+    if not self.enabled or not self.phases:
+      return None
+    import pstats
+
+    report_path = filepath + '.profile.txt'
+    with open(report_path, 'w') as f:
+      f.write(self.report())
+
+    stats = pstats.Stats(self.phases[0]['profile'])
+    for phase in self.phases[1:]:
+      stats.add(phase['profile'])
+    stats.dump_stats(filepath + '.prof')
+
+    print('Profile: ' + report_path)
+    self._local.phases = []
+    return report_path
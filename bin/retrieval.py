@@ -0,0 +1,319 @@
+"""
+retrieval.py
+
+Aerosol optical thickness (AOT) retrieval by inverting interpolated look up
+tables over their AOT axis, e.g. for dark targets (dense vegetation, water)
+of known surface reflectance.
+
+Rather than calling the iLUT in a root-finding loop, the surface reflectance
+of each pixel is computed at every AOT level of the grid in one batched call
+(i.e. a reflectance curve per pixel), and the AOT at which the curve meets
+the target reflectance is found between the levels that bracket it. The
+residual
+
+  r(AOT) = L - a(AOT) - target*b(AOT)
+
+has the sign of ρ(AOT) - target (b > 0) and is linear wherever a and b are,
+so it is inverted linearly:
+
+  AOT = AOT_k + r_k / (r_k - r_k+1) * (AOT_k+1 - AOT_k)
+
+This is exact on the breakpoints of the simplex interpolant within the
+bracketing cell (see retrieve_AOT, refine). Cubic iLUTs and surrogates
+(see surrogate.py) are smooth rather than piecewise linear, their cell is
+refined on a finer subdivision instead, i.e. the inversion is close but not
+exact.
+
+Surface reflectance decreases with AOT for dark targets (path radiance goes
+up), if a curve is not monotone the first crossing (lowest AOT) is used.
+
+Example
+-------
+
+  from retrieval import retrieve_AOT
+
+  report = {}
+  AOT = retrieve_AOT(iLUT, L, 0.01, solar_z, H2O, O3, alt, report=report)
+  print(report['no_solution'])
+
+"""
+
+import numpy as np
+
+from atmcorr import (as_grid_interpolator, coupled_surface_reflectance,
+                     elliptical_orbit_correction, surface_reflectance)
+from grid_interpolator import GridInterpolator
+
+
+# subdivisions of the bracketing AOT cell refined for models that are not
+# piecewise linear (i.e. have no simplex breakpoints)
+REFINE_STEPS = 16
+
+
+def reflectance_curves(iLUT, L, solar_z, H2O, O3, alt, doy=None, dtype=None,
+                       coupled=False, policy=None, report=None, aerosol_mixture=None):
+  """
+  Surface reflectance of pixels at each AOT level of the iLUT grid, i.e.
+  (levels, curves) where curves has shape (..., len(levels))
+
+  doy, dtype, policy, report : see atmcorr.correction_coefficients
+  aerosol_mixture            : (of mixture iLUTs) see atmcorr.correction_coefficients
+  coupled                    : surface-atmosphere coupling (coupled iLUT)
+  """
+  grid = as_grid_interpolator(iLUT, dtype)
+  shape, blocks = _blocks(grid, L, solar_z, H2O, O3, alt, aerosol_mixture, doy,
+                          coupled, policy, report)
+
+  levels = grid.axes[grid.names.index('AOT')]
+  curves = np.empty((int(np.prod(shape)), len(levels)), dtype=grid.dtype)
+  for start, stop, block in blocks:
+    values = block.values(block.points)
+    if coupled:
+      curves[start:stop] = coupled_surface_reflectance(block.L, values[..., 0], values[..., 1], values[..., 2])
+    else:
+      curves[start:stop] = surface_reflectance(block.L, values[..., 0], values[..., 1])
+
+  return levels, curves.reshape(shape + (len(levels),))
+
+
+def invert_AOT(levels, curves, target, fill_value=np.nan):
+  """
+  AOT at which reflectance curves (..., len(levels)) meet a target
+  reflectance (broadcastable to ...) by linear inversion between levels,
+  fill_value where they do not
+  """
+  curves = np.asarray(curves)
+  target = np.asarray(target, dtype=curves.dtype)
+  return _invert(levels, curves - target[..., None], fill_value)
+
+
+def retrieve_AOT(iLUT, L, target, solar_z, H2O, O3, alt, doy=None, dtype=None,
+                 coupled=False, refine=True, policy=None, report=None,
+                 fill_value=np.nan, aerosol_mixture=None):
+  """
+  AOT of pixels from at-sensor radiance (L) and a target surface reflectance
+  (e.g. 0.01 for dense dark vegetation in the blue), for arrays of pixels in
+  one vectorized pass, one block of pixels at a time
+
+  refine     : also evaluate the iLUT where the simplex changes within the
+               bracketing AOT cell, i.e. invert the interpolant exactly
+               (False inverts linearly between AOT levels, which is faster),
+               for cubic iLUTs and surrogates at REFINE_STEPS points within
+               the cell, i.e. approximately
+  fill_value : AOT of pixels whose reflectance does not reach the target
+               within the AOT range of the grid
+  report     : (optional) dictionary, gets the out-of-range counts of the
+               other input variables and the number of pixels without a
+               solution, i.e. report['no_solution']
+  aerosol_mixture : aerosol mixture of each pixel, for iLUTs of an aerosol
+               mixture build (see atmcorr.correction_coefficients)
+  """
+  grid = as_grid_interpolator(iLUT, dtype)
+  target = np.asarray(target, dtype=grid.dtype)
+  shape, blocks = _blocks(grid, L, solar_z, H2O, O3, alt, aerosol_mixture, doy,
+                          coupled, policy, report, target.shape)
+  target = _flat(target, shape)
+  k = grid.names.index('AOT')
+
+  AOT = np.empty(int(np.prod(shape)), dtype=grid.dtype)
+  for start, stop, block in blocks:
+    block_target = target if target.ndim == 0 else target[start:stop, None]
+    levels = grid.axes[k]
+    residual = _residual(block.values(block.points, counted=True), block.L,
+                         block_target, coupled)
+
+    if refine:
+      i, found, _, _ = _bracket(residual)
+      levels = _cell_breakpoints(grid, block.points[:, 0], k, i)
+      points = np.repeat(block.points[:, :1], levels.shape[1], axis=1)
+      points[..., k] = levels
+      residual = _residual(block.values(points), block.L, block_target, coupled)
+      residual[~found] = np.nan
+
+    AOT[start:stop] = _invert(levels, residual, fill_value)
+
+  if report is not None:
+    missing = np.isnan(AOT) if np.isnan(fill_value) else AOT == fill_value
+    report['no_solution'] = report.get('no_solution', 0) + int(np.count_nonzero(missing))
+
+  return AOT.reshape(shape)
+
+
+def _residual(values, L, target, coupled):
+  """
+  L - a - target*b, i.e. a linear function of the interpolated values with
+  the sign of (surface reflectance - target), or its coupled equivalent
+  (L - a)*(1 - S*target) - target*b (quadratic, i.e. nearly exact)
+  """
+  a = values[..., 0]
+  b = values[..., 1]
+  if coupled:
+    return (L - a)*(1 - values[..., 2]*target) - target*b
+  return L - a - target*b
+
+
+def _invert(levels, residual, fill_value):
+  """
+  Level at which residuals (..., len(levels)) are zero, by linear inversion
+  between the first pair of levels where they change sign. Levels are either
+  shared (1D) or per pixel, i.e. of shape (..., levels).
+  """
+  levels = np.broadcast_to(np.asarray(levels, dtype=residual.dtype), residual.shape)
+  i, found, r0, r1 = _bracket(residual)
+
+  # (r0 == r1 == 0 is the lower level)
+  x0 = np.take_along_axis(levels, i[..., None], axis=-1)[..., 0]
+  x1 = np.take_along_axis(levels, i[..., None] + 1, axis=-1)[..., 0]
+  difference = r0 - r1
+  w = np.divide(r0, difference, out=np.zeros_like(r0), where=difference != 0)
+  x = x0 + w*(x1 - x0)
+  x[~found] = fill_value
+
+  return x
+
+
+def _bracket(f):
+  """
+  Index of the first pair of levels where f (..., levels) changes sign (or
+  is zero), whether there is one, and f at both levels
+  """
+  crossing = (f[..., :-1] * f[..., 1:] <= 0) & np.isfinite(f[..., :-1]) & np.isfinite(f[..., 1:])
+  found = crossing.any(axis=-1)
+  i = np.argmax(crossing, axis=-1)
+  f0 = np.take_along_axis(f, i[..., None], axis=-1)[..., 0]
+  f1 = np.take_along_axis(f, i[..., None] + 1, axis=-1)[..., 0]
+  return i, found, f0, f1
+
+
+def _cell_breakpoints(grid, pixels, k, i):
+  """
+  AOT values (pixels, active axes + 1) in AOT cell i of each pixel where the
+  Kuhn simplex changes, i.e. where the AOT position within the cell equals
+  the position of another input variable within its cell (and the ends),
+  or REFINE_STEPS + 1 evenly spaced values for other models
+  """
+  levels = grid.axes[k]
+  lower = levels[i][:, None]
+  if not _is_simplex(grid):
+    breaks = np.linspace(0, 1, REFINE_STEPS + 1, dtype=grid.dtype)
+    return lower + breaks*(levels[i + 1] - levels[i])[:, None]
+
+  breaks = [np.zeros(len(pixels), dtype=grid.dtype), np.ones(len(pixels), dtype=grid.dtype)]
+  for j in grid.active:
+    if j == k:
+      continue
+    ax = grid.axes[j]
+    x = pixels[:, j]
+    cell = np.clip(np.searchsorted(ax, x, side='right') - 1, 0, len(ax) - 2)
+    breaks.append(np.clip((x - ax[cell]) / (ax[cell + 1] - ax[cell]), 0, 1))
+  breaks = np.sort(np.stack(breaks, axis=1), axis=1)
+
+  return lower + breaks*(levels[i + 1] - levels[i])[:, None]
+
+
+def _is_simplex(grid):
+  """
+  Whether a model is the (piecewise linear) simplex interpolant
+  """
+  return isinstance(grid, GridInterpolator) and grid.method == 'linear'
+
+
+class _Block:
+  """
+  Block of pixels, i.e. their radiance (L), their points at each AOT level
+  and values(points), the (orbit corrected) iLUT values at points
+  """
+
+  def __init__(self, grid, L, points, correction, policy, counts):
+    self.grid = grid
+    self.L = L
+    self.points = points
+    self.correction = correction
+    self.policy = policy
+    self.counts = counts
+
+  def values(self, points, counted=False):
+    report = {} if counted else None
+    values = self.grid(points, policy=self.policy, report=report)
+    if self.correction is not None:
+      values[..., :2] *= self.correction[..., None]
+
+    # out-of-range counts are per point, i.e. len(levels) per pixel
+    if counted:
+      for name, count in report['out_of_range'].items():
+        self.counts[name] += count // points.shape[1]
+
+    return values
+
+
+def _blocks(grid, L, solar_z, H2O, O3, alt, aerosol_mixture, doy, coupled, policy,
+            report, shape=()):
+  """
+  Broadcast shape of the pixels and a generator of (start, stop, block) for
+  blocks of (flattened) pixels, each block is one interpolator chunk
+  """
+  others = [solar_z, H2O, O3, alt] + ([] if aerosol_mixture is None else [aerosol_mixture])
+  if 'AOT' not in grid.names or grid.ndim != len(others) + 1:
+    raise ValueError('AOT retrieval needs an iLUT of (solar_z, H2O, O3, AOT, alt'
+                     '[, aerosol_mixture]) and aerosol_mixture of mixture iLUTs: {}'
+                     .format(grid.names))
+  k = grid.names.index('AOT')
+  levels = grid.axes[k]
+  if len(levels) < 2:
+    raise ValueError('AOT retrieval needs an iLUT with more than one AOT level')
+  if coupled and grid.value_shape[-1:] != (3,):
+    raise ValueError('coupled retrieval needs an iLUT of (a, b, spherical albedo)')
+
+  arrays = [L] + others + ([] if doy is None else [doy])
+  shape = np.broadcast_shapes(shape, *[np.shape(x) for x in arrays])
+  n = int(np.prod(shape))
+
+  L = _flat(np.asarray(L, dtype=grid.dtype), shape)
+  invars = [_flat(np.asarray(x, dtype=grid.dtype), shape) for x in others]
+  invars.insert(k, None)
+  correction = None
+  if doy is not None:
+    correction = _flat(elliptical_orbit_correction(doy).astype(grid.dtype), shape)
+
+  block_size = max(1, grid.chunk_size // len(levels))
+
+  def blocks():
+    counts = dict.fromkeys(grid.names, 0)
+    for start in range(0, n, block_size):
+      stop = min(start + block_size, n)
+
+      # every pixel of the block at every AOT level
+      points = np.empty((stop - start, len(levels), grid.ndim), dtype=grid.dtype)
+      for j, x in enumerate(invars):
+        if j == k:
+          points[..., j] = levels
+        else:
+          points[..., j] = x if x.ndim == 0 else x[start:stop, None]
+
+      yield start, stop, _Block(grid, _column(L, start, stop), points,
+                                _column(correction, start, stop), policy, counts)
+
+    if report is not None:
+      out_of_range = report.setdefault('out_of_range', dict.fromkeys(grid.names, 0))
+      for name, count in counts.items():
+        out_of_range[name] = out_of_range.get(name, 0) + count
+
+  return shape, blocks()
+
+
+def _column(x, start, stop):
+  """
+  Flat array (or scalar) of a block of pixels, as a column
+  """
+  if x is None or x.ndim == 0:
+    return x
+  return x[start:stop, None]
+
+
+def _flat(x, shape):
+  """
+  Array broadcast to shape and flattened (scalars as they are)
+  """
+  if x.ndim == 0:
+    return x
+  return np.broadcast_to(x, shape).reshape(-1)
@@ -0,0 +1,134 @@
+"""
+shared_LUTs.py
+
+Shares interpolated look up tables (iLUTs) between processes, e.g. the
+workers of a multiprocessing pool. The tables are published once in shared
+memory and each worker attaches to them read-only, so that many workers use
+one copy of the tables and do not read .ilut files at start up.
+
+Example
+-------
+
+  from multiprocessing import Pool
+  from interpolated_LUTs import Interpolated_LUTs
+  import shared_LUTs
+
+  def init_worker(spec):
+    global iLUTs
+    iLUTs = shared_LUTs.attach(spec)
+
+  iLUTs = Interpolated_LUTs('COPERNICUS/S2').get()
+  with shared_LUTs.SharedLUTs(iLUTs) as shared:
+    with Pool(64, initializer=init_worker, initargs=(shared.spec,)) as pool:
+      pool.map(correct_tile, tiles)
+
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from grid_interpolator import GridInterpolator
+from iLUT_io import engine
+
+
+# shared memory blocks attached by this process (keeps them mapped)
+_attached = {}
+
+# byte alignment of each table in the shared memory block
+_ALIGN = 64
+
+
+class SharedLUTs:
+  """
+  Publishes the tables of a dictionary of iLUTs in one shared memory block.
+
+  spec : small (picklable) description of the block, pass it to attach()
+  """
+
+  def __init__(self, iLUTs, dtype=None):
+
+    grids = {bandName:GridInterpolator.from_interpolator(iLUT, dtype=dtype)
+             for bandName, iLUT in iLUTs.items()}
+
+    # layout of the tables in the block
+    bands = {}
+    size = 0
+    for bandName, grid in grids.items():
+      bands[bandName] = {
+        'offset':size,
+        'dtype':grid.values.dtype.str,
+        'shape':grid.values.shape,
+        'axes':[ax.tolist() for ax in grid.axes],
+        'names':grid.names,
+        'method':grid.method
+      }
+      size += -(-grid.values.nbytes // _ALIGN) * _ALIGN
+
+    # copy the tables into shared memory
+    self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for bandName, grid in grids.items():
+      band = bands[bandName]
+      table = np.ndarray(band['shape'], dtype=band['dtype'],
+                         buffer=self.shm.buf, offset=band['offset'])
+      table[...] = grid.values
+
+    self.spec = {'name':self.shm.name, 'bands':bands}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    """
+    Releases (and removes) the shared memory block, workers should be done
+    """
+    if self.shm is not None:
+      self.shm.close()
+      self.shm.unlink()
+      self.shm = None
+
+
+def attach(spec):
+  """
+  Read-only iLUTs (GridInterpolators, or CubicGridInterpolators of cubic
+  iLUTs) on a published shared memory block
+  """
+
+  name = spec['name']
+  if name not in _attached:
+    _attached[name] = _open(name)
+  shm = _attached[name]
+
+  iLUTs = {}
+  for bandName, band in spec['bands'].items():
+    table = np.ndarray(band['shape'], dtype=band['dtype'],
+                       buffer=shm.buf, offset=band['offset'])
+    table.flags.writeable = False
+    iLUTs[bandName] = engine(band['method'])(band['axes'], table, names=band['names'])
+
+  return iLUTs
+
+
+def detach(spec):
+  """
+  Unmaps a shared memory block (iLUTs attached to it must no longer be used)
+  """
+  shm = _attached.pop(spec['name'], None)
+  if shm is not None:
+    shm.close()
+
+
+def _open(name):
+  """
+  Opens an existing shared memory block without taking ownership of it,
+  i.e. the publishing process is responsible for unlinking it
+  """
+  try:
+    return shared_memory.SharedMemory(name=name, track=False)
+  except TypeError:
+    # python < 3.13 has no 'track' option: worker processes share the
+    # resource tracker of their parent, which unlinks the block exactly once
+    return shared_memory.SharedMemory(name=name)
@@ -0,0 +1,111 @@
+"""
+spectral.py
+
+Channel look up tables from a spectrally resolved (monochromatic) LUT.
+
+A spectral LUT holds the correction coefficients (a, b) at each grid point
+and wavelength (2.5 nm sampling, as used by 6S for filter functions). For a
+Lambertian surface with constant reflectance across a channel, the channel
+radiance is the spectral response (SRF) weighted mean of the spectral
+radiance, so the channel coefficients are SRF weighted means as well:
+
+  a = sum(srf * a(wavelength)) / sum(srf)
+  b = sum(srf * b(wavelength)) / sum(srf)
+
+i.e. a LUT for any channel (multispectral or hyperspectral) is a matrix
+product, without new radiative transfer runs. Other 6S outputs kept in the
+spectral LUT (e.g. spherical albedo) are SRF weighted means too, which is
+an approximation for quantities that do not add up like radiances.
+
+"""
+
+import numpy as np
+
+
+# monochromatic sampling of 6S filter functions (microns)
+STEP = 0.0025
+
+
+def wavelengths(start, end, step=STEP):
+  """
+  Wavelengths (microns) from start to end (inclusive) in steps
+  """
+  n = int(round((end - start) / step)) + 1
+  return start + step*np.arange(n)
+
+
+def resample_srf(srf_wavelengths, srf, target_wavelengths):
+  """
+  Spectral response function resampled to target wavelengths (zero outside
+  the wavelengths it is defined on)
+  """
+  return np.interp(target_wavelengths, srf_wavelengths, srf, left=0, right=0)
+
+
+def py6S_srf(channel):
+  """
+  (wavelengths, response) of a predefined Py6S sensor channel, e.g. 'S2A_MSI_01'
+  """
+  from Py6S import PredefinedWavelengths
+
+  _, start, end, srf = PredefinedWavelengths.__dict__[channel]
+  return start + STEP*np.arange(len(srf)), np.asarray(srf, dtype=np.float64)
+
+
+def srf_weights(spectral_LUT, srfs):
+  """
+  Weight matrix (wavelengths, channels) of spectral response functions,
+  srfs is a list of (wavelengths, response), columns sum to 1
+  """
+
+  target = np.asarray(spectral_LUT['config']['wavelengths'])
+  weights = np.stack([resample_srf(w, r, target) for w, r in srfs], axis=1)
+
+  total = weights.sum(axis=0)
+  if np.any(total <= 0):
+    raise ValueError('spectral response is outside the wavelengths of the LUT '
+                     '({:.4f} - {:.4f} microns)'.format(target[0], target[-1]))
+
+  return weights / total
+
+
+def convolve(spectral_LUT, srfs):
+  """
+  Coefficients of channels, i.e. array of shape (points, channels, 2), from
+  a spectral LUT and a list of spectral response functions (wavelengths,
+  response)
+  """
+
+  outputs = np.asarray(spectral_LUT['outputs'])  # (points, wavelengths, 2)
+  weights = srf_weights(spectral_LUT, srfs)      # (wavelengths, channels)
+
+  return np.einsum('pwk,wc->pck', outputs, weights)
+
+
+def channel_LUTs(spectral_LUT, channels):
+  """
+  Look up tables of channels (same format as LUT_build) from a spectral LUT,
+  channels is a dictionary of {name: (wavelengths, response)}
+  """
+
+  names = list(channels)
+  srfs = [channels[name] for name in names]
+  coeffs = convolve(spectral_LUT, srfs)
+
+  # other 6S outputs (points, wavelengths) -> (points, channels)
+  weights = srf_weights(spectral_LUT, srfs)
+  columns = {column:np.asarray(values) @ weights
+             for column, values in spectral_LUT.get('columns', {}).items()}
+
+  LUTs = {}
+  for c, name in enumerate(names):
+    config = dict(spectral_LUT['config'])
+    config.pop('wavelengths', None)
+    config['spectrum'] = {'channel':name,
+                          'wavelengths':[float(x) for x in channels[name][0]],
+                          'response':[float(x) for x in channels[name][1]]}
+    config['filename'] = name+'.lut'
+    LUTs[name] = {'config':config, 'outputs':[tuple(ab) for ab in coeffs[:, c]],
+                  'columns':{column:values[:, c] for column, values in columns.items()}}
+
+  return LUTs
@@ -0,0 +1,296 @@
+"""
+surrogate.py
+
+Smooth surrogates of look up tables, i.e. a tensor product Chebyshev series
+per band fitted (least squares) to the grid of a .lut file:
+
+  a(x) = sum c_ijklm T_i(x_0) T_j(x_1) T_k(x_2) T_l(x_3) T_m(x_4)
+
+where x_k are the input variables scaled to [-1, 1] over the grid. With
+degree 4 (at most) along each axis a band is a few KB of coefficients
+(rather than a table), is smooth (i.e. has continuous derivatives) and
+evaluates without any search, in a number of multiply-adds per pixel close
+to its number of coefficients (chunks of points are small enough for the
+intermediate arrays to stay in cache).
+
+A surrogate is called like an iLUT, i.e. a, b = surrogate(solar_z, H2O, O3,
+AOT, alt), so it can be passed to atmcorr instead of one. Its error against
+a validation LUT (e.g. build_type 'validation', i.e. the mid points of the
+'full' grid) is measured when fitting (see LUT_surrogate.py), so it can be
+chosen when memory and throughput matter more than the last 0.1 %.
+
+Surrogate files (.surrogate) are uncompressed numpy .npz archives:
+
+  format       : 'chebyshev'
+  names        : input variable names
+  axis_<k>     : grid levels of each input variable (the fitted grid)
+  coefficients : shape (degree_0 + 1, .., degree_4 + 1) + value shape
+  validation   : (optional) [max, mean] relative reflectance error
+
+"""
+
+import numpy as np
+from numpy.polynomial import chebyshev
+
+from grid_interpolator import GridInterpolator, INVARS, POLICIES
+from LUT_store import atomic_write
+
+
+class ChebyshevSurrogate:
+  """
+  Tensor product Chebyshev series over the grid of a look up table
+
+  axes         : grid levels of each input variable (defines the domain)
+  coefficients : array of shape (degree_0 + 1, .., degree_4 + 1) + value shape
+  dtype        : computation dtype (default float64)
+  names        : (optional) names of the input variables
+  policy       : out-of-range policy (see GridInterpolator), 'linear' means
+                 polynomial extrapolation here
+  validation   : (optional) validation error, {'max', 'mean'}
+  """
+
+  # out-of-range policy handling is that of GridInterpolator
+  _policies = GridInterpolator._policies
+  _report = GridInterpolator._report
+  _columns = GridInterpolator._columns
+
+  def __init__(self, axes, coefficients, dtype=None, chunk_size=4096, names=None,
+               policy='nan', validation=None):
+
+    self.dtype = np.dtype(dtype or np.float64)
+    self.axes = [np.asarray(ax, dtype=self.dtype) for ax in axes]
+    self.ndim = len(self.axes)
+    self.shape = tuple(len(ax) for ax in self.axes)
+    self.coefficients = np.asarray(coefficients, dtype=self.dtype)
+    self.degrees = tuple(n - 1 for n in self.coefficients.shape[:self.ndim])
+    self.value_shape = self.coefficients.shape[self.ndim:]
+    self.chunk_size = chunk_size
+    self.validation = validation
+
+    # scaling of each input variable to [-1, 1]
+    self.centres = np.array([(ax[0] + ax[-1]) / 2 for ax in self.axes], dtype=self.dtype)
+    self.scales = np.array([2 / (ax[-1] - ax[0]) if ax[-1] > ax[0] else 0
+                            for ax in self.axes], dtype=self.dtype)
+
+    # derivative of a series (coefficients of each basis function) per axis
+    self.derivatives = [_derivative_matrix(degree).astype(self.dtype) for degree in self.degrees]
+
+    if names is None:
+      names = INVARS if self.ndim == len(INVARS) else ['x{}'.format(k) for k in range(self.ndim)]
+    self.names = list(names)
+    self.policy = policy
+    self.policies = self._policies(policy)
+
+  @classmethod
+  def fit(cls, grid, degree=4, dtype=None, **kwargs):
+    """
+    Least squares fit to the values of a GridInterpolator, degree is one
+    degree for all axes or a list (one per axis), at most the number of
+    levels - 1 (i.e. interpolation) along each axis
+    """
+
+    if np.ndim(degree) == 0:
+      degree = [degree]*grid.ndim
+    degrees = [min(int(d), n - 1) for d, n in zip(degree, grid.shape)]
+
+    # the design matrix of a full grid is a Kronecker product, so is its
+    # pseudo-inverse, i.e. the fit is one small solve along each axis
+    coefficients = np.asarray(grid.values, dtype=np.float64)
+    for k, (ax, d) in enumerate(zip(grid.axes, degrees)):
+      ax = np.asarray(ax, dtype=np.float64)
+      x = _scaled(ax, ax)
+      vander = chebyshev.chebvander(x, d)
+      coefficients = np.moveaxis(np.tensordot(np.linalg.pinv(vander), coefficients, axes=(1, k)), 0, k)
+
+    return cls(grid.axes, coefficients, dtype=dtype, names=grid.names, **kwargs)
+
+  @classmethod
+  def from_LUT(cls, LUT, degree=4, dtype=None, columns=None, **kwargs):
+    """
+    Surrogate of a look up table (i.e. a loaded .lut file), columns as in
+    GridInterpolator.from_LUT
+    """
+    grid = GridInterpolator.from_LUT(LUT, columns=columns)
+    return cls.fit(grid, degree=degree, dtype=dtype, **kwargs)
+
+  @classmethod
+  def load(cls, filepath, dtype=None, **kwargs):
+    """
+    Loads a surrogate from a .surrogate file
+    """
+    with np.load(filepath, allow_pickle=False) as npz:
+      if str(npz['format']) != 'chebyshev':
+        raise ValueError('surrogate format not recognized: {}'.format(npz['format']))
+      names = [str(name) for name in npz['names']]
+      axes = [npz['axis_{}'.format(k)] for k in range(len(names))]
+      validation = None
+      if 'validation' in npz.files:
+        validation = dict(zip(['max', 'mean'], [float(x) for x in npz['validation']]))
+      return cls(axes, npz['coefficients'], dtype=dtype, names=names,
+                 validation=validation, **kwargs)
+
+  def save(self, filepath):
+    """
+    Saves the surrogate (atomically) as a .surrogate file
+    """
+    arrays = {
+      'format':np.array('chebyshev'),
+      'names':np.array(self.names),
+      'coefficients':self.coefficients
+    }
+    for k, ax in enumerate(self.axes):
+      arrays['axis_{}'.format(k)] = ax
+    if self.validation is not None:
+      arrays['validation'] = np.array([self.validation['max'], self.validation['mean']])
+
+    atomic_write(filepath, lambda f: np.savez(f, **arrays))
+    return filepath
+
+  def astype(self, dtype):
+    """
+    Copy of this surrogate that computes in another dtype
+    """
+    return ChebyshevSurrogate(self.axes, self.coefficients, dtype=dtype,
+                              chunk_size=self.chunk_size, names=self.names,
+                              policy=self.policy, validation=self.validation)
+
+  @property
+  def nbytes(self):
+    return self.coefficients.nbytes
+
+  def __call__(self, *args, policy=None, report=None):
+    """
+    Values at points given by the input variables (see GridInterpolator)
+    """
+    return self._evaluate_all(args, policy, report)
+
+  def gradient(self, *args, policy=None, report=None):
+    """
+    Values and their partial derivatives with respect to each input variable
+    (see GridInterpolator.gradient), from the derivative of the series
+    """
+    return self._evaluate_all(args, policy, report, gradient=True)
+
+  def reflectance(self, L, *args, correction=None, out=None, policy=None, report=None):
+    """
+    Surface reflectance from at-sensor radiance (see GridInterpolator.reflectance)
+    """
+    coeffs = self(*args, policy=policy, report=report)
+    if correction is not None:
+      coeffs = coeffs * np.asarray(correction, dtype=self.dtype)[..., None]
+    return np.divide(np.subtract(L, coeffs[..., 0], dtype=self.dtype), coeffs[..., 1], out=out)
+
+  def _evaluate_all(self, args, policy, report, gradient=False):
+    """
+    Series (and derivatives) at all points, one chunk at a time
+    """
+    policies = self._policies(policy)
+    shape, columns = self._columns(args)
+    n = int(np.prod(shape))
+    m = int(np.prod(self.value_shape))
+    out = np.empty((n, m), dtype=self.dtype)
+    jacobian = np.empty((n, m, self.ndim), dtype=self.dtype) if gradient else None
+    counts = np.zeros(self.ndim, dtype=np.int64)
+
+    for start in range(0, n, self.chunk_size):
+      stop = min(start + self.chunk_size, n)
+      chunk = [col if col.size == 1 else col[start:stop] for col in columns]
+      self._evaluate(chunk, out[start:stop], policies, counts,
+                     None if jacobian is None else jacobian[start:stop])
+      self._report(counts, policies, None)
+
+    self._report(counts, policies, report)
+    values = out.reshape(shape + self.value_shape)
+    if gradient:
+      return values, jacobian.reshape(shape + self.value_shape + (self.ndim,))
+    return values
+
+  def _evaluate(self, columns, out, policies, counts, jacobian=None):
+    """
+    Series (and derivatives) for one chunk of points
+    """
+    n = len(out)
+    outside = np.zeros(n, dtype=bool)
+
+    # basis functions (and their derivatives) of each axis
+    bases = []
+    derivatives = []
+    for k, ax in enumerate(self.axes):
+      xk = np.broadcast_to(np.asarray(columns[k], dtype=self.dtype), (n,))
+      bad = ~((xk >= ax[0]) & (xk <= ax[-1]))
+      counts[k] += np.count_nonzero(bad)
+      clamped = None
+      if bad.any():
+        if policies[k] == POLICIES['clamp']:
+          xk = np.clip(xk, ax[0], ax[-1])
+          clamped = bad
+        elif policies[k] == POLICIES['linear']:
+          clamped = bad if self.shape[k] == 1 else None
+        outside |= np.isnan(xk) if policies[k] in (POLICIES['clamp'], POLICIES['linear']) else bad
+
+      basis = chebyshev.chebvander((xk - self.centres[k])*self.scales[k], self.degrees[k]).astype(self.dtype)
+      bases.append(basis)
+      if jacobian is not None:
+        derivative = (basis @ self.derivatives[k])*self.scales[k]
+        if clamped is not None:
+          derivative[clamped] = 0
+        derivatives.append(derivative)
+
+    out[:] = _contract(self.coefficients, bases)
+    if jacobian is not None:
+      for k in range(self.ndim):
+        jacobian[:, :, k] = _contract(self.coefficients, bases[:k] + [derivatives[k]] + bases[k+1:])
+      jacobian[outside] = np.nan
+
+    out[outside] = np.nan
+
+
+def _contract(coefficients, bases):
+  """
+  Series at n points, i.e. coefficients contracted with the basis functions
+  (n, degree + 1) of each axis, one axis at a time
+  """
+  n = len(bases[0])
+  result = bases[0] @ coefficients.reshape(len(bases[0][0]), -1)
+  for basis in bases[1:]:
+    result = np.einsum('nd,ndr->nr', basis, result.reshape(n, basis.shape[1], -1))
+  return result
+
+
+def _derivative_matrix(degree):
+  """
+  Matrix D (degree + 1, degree + 1) so that the coefficients of the
+  derivative of a Chebyshev series c are D @ c
+  """
+  D = np.zeros((degree + 1, degree + 1))
+  for j in range(1, degree + 1):
+    D[:j, j] = chebyshev.chebder(np.eye(degree + 1)[j, :j + 1])
+  return D
+
+
+def _scaled(x, ax):
+  """
+  Values scaled from the range of an axis to [-1, 1]
+  """
+  if ax[-1] == ax[0]:
+    return np.zeros_like(x)
+  return (2*x - (ax[0] + ax[-1])) / (ax[-1] - ax[0])
+
+
+def validation_error(model, LUT, reflectances=(0.01, 0.05, 0.1, 0.3, 0.5, 1.0)):
+  """
+  Relative error in surface reflectance of a model (surrogate or iLUT) at
+  the grid points of a validation LUT (e.g. build_type 'validation'), i.e.
+  {'max', 'mean'}, for radiance of a set of surface reflectances
+  """
+  from parameter_space import permutate_invars
+
+  inputs = permutate_invars(LUT['config']['invars']).coordinates()
+  outputs = np.asarray(LUT['outputs'], dtype=np.float64)
+
+  coeffs = np.asarray(model(*inputs.T), dtype=np.float64)
+  ref = np.asarray(reflectances, dtype=np.float64)
+  L = outputs[:, 0, None] + outputs[:, 1, None]*ref
+  error = np.abs((L - coeffs[:, 0, None]) / coeffs[:, 1, None] - ref) / ref
+
+  return {'max':float(np.nanmax(error)), 'mean':float(np.nanmean(error))}
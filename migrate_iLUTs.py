@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+migrate iLUTs
+
+Converts interpolated look up table files (.ilut) from the older format
+(pickled scipy interpolators) to the array format of bin/iLUT_io.py, in place.
+
+Usage:
+
+  $ python3 migrate_iLUTs.py path/to/iLUTs [more/paths ..]
+
+Directories are searched recursively, so a LUT store (i.e. its root
+directory) can be migrated too, its index is updated.
+
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'bin'))
+import iLUT_io
+from LUT_store import LUT_Store
+
+
+def migrate_iLUT(filepath):
+  """
+  Converts one .ilut file to the array format (if it is not already),
+  returns True if it was converted
+  """
+
+  if iLUT_io.is_array_file(filepath):
+    return False
+
+  interpolator = iLUT_io.load_iLUT(filepath)
+  iLUT_io.save_iLUT(filepath, interpolator)
+
+  return True
+
+
+def migrate_file(filepath):
+  """
+  Converts one .ilut file (see migrate_iLUT) and updates the index of the
+  LUT store it is in (if any), returns True if it was converted
+  """
+
+  if not migrate_iLUT(filepath):
+    return False
+
+  print('Converted: '+filepath)
+  store = find_store(filepath)
+  if store is not None:
+    store.refresh(filepath)
+
+  return True
+
+
+def find_store(filepath):
+  """
+  LUT store that contains a file (or None)
+  """
+  directory = os.path.dirname(os.path.abspath(filepath))
+  while True:
+    if os.path.isfile(os.path.join(directory, 'index.json')):
+      return LUT_Store(directory)
+    parent = os.path.dirname(directory)
+    if parent == directory:
+      return None
+    directory = parent
+
+
+def migrate(path):
+  """
+  Converts all .ilut files in a directory (recursively), returns the number
+  of files converted
+  """
+
+  converted = 0
+
+  for directory, subdirs, filenames in os.walk(path):
+    subdirs.sort()
+
+    for fname in sorted(f for f in filenames if f.endswith('.ilut')):
+      filepath = os.path.join(directory, fname)
+      try:
+        converted += migrate_file(filepath)
+      except Exception as e:
+        print('could not convert {} ({})'.format(filepath, e))
+
+  return converted
+
+
+def main():
+
+  args = sys.argv[1:]
+
+  if len(args) == 0:
+    print('usage: $ python3 migrate_iLUTs.py path/to/iLUTs [more/paths ..]')
+    sys.exit(1)
+
+  converted = 0
+  for path in args:
+    if os.path.isfile(path):
+      converted += migrate_file(path)
+    elif os.path.isdir(path):
+      converted += migrate(path)
+    else:
+      print('invalid path: ' + path)
+      sys.exit(1)
+
+  print('{} iLUT file(s) converted'.format(converted))
+
+if __name__ == '__main__':
+  main()
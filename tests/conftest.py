@@ -0,0 +1,73 @@
+"""
+Shared fixtures: synthetic look up tables, i.e. smooth (a, b) functions of
+the input variables sampled on a grid (no Py6S needed)
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+
+from parameter_space import input_variables, invar_keys, permutate_invars
+
+
+SMALL = {
+  'solar_zs':[0, 20, 40, 75],
+  'H2Os':[0, 2, 8.5],
+  'O3s':[0, 0.4, 0.8],
+  'AOTs':[0, 1, 3],
+  'alts':[0, 4, 7.75]
+}
+
+SMALL_MIXTURE = dict(SMALL, aerosol_mixtures=[0, 0.5, 1, 2])
+
+
+def coefficients(points):
+  """
+  Synthetic correction coefficients (a, b) at points (n, 5), or (n, 6) with
+  an aerosol mixture, shaped like those of 6S (path radiance grows with
+  AOT, transmission falls)
+  """
+  points = np.asarray(points, dtype=np.float64)
+  solar_z, H2O, O3, AOT, alt = points.T[:5]
+  mixture = points[:, 5] if points.shape[1] > 5 else 1
+  mu = np.cos(np.radians(solar_z))
+  a = 20 + 30*AOT*np.exp(-alt/8)*(0.5 + 0.5*mixture) + 5*(1 - mu) + 0.3*H2O
+  b = 500*mu*np.exp(-0.2*AOT)*np.exp(-0.02*H2O)*(1 - 0.05*O3)/np.pi
+  return np.stack([a, b], axis=-1)
+
+
+def make_LUT(invars, function=coefficients):
+  """
+  Look up table (as loaded from a .lut file) of a function on a grid
+  """
+  points = permutate_invars(invars).coordinates()
+  return {'config':{'invars':invars, 'filename':'TEST_01.lut'},
+          'outputs':[tuple(row) for row in function(points)]}
+
+
+def random_points(invars, n, seed=0):
+  """
+  Uniformly random points (n, len(invars)) inside a grid
+  """
+  rng = np.random.RandomState(seed)
+  keys = invar_keys(invars)
+  return np.stack([rng.uniform(min(invars[k]), max(invars[k]), n) for k in keys], axis=-1)
+
+
+@pytest.fixture
+def small_LUT():
+  return make_LUT(SMALL)
+
+
+@pytest.fixture
+def mixture_LUT():
+  return make_LUT(SMALL_MIXTURE)
+
+
+@pytest.fixture
+def full_LUT():
+  return make_LUT(input_variables('full'))
@@ -0,0 +1,90 @@
+import os
+import pickle
+import sys
+import types
+
+import pytest
+
+from conftest import SMALL
+from parameter_space import permutate_invars, progressive_invars
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Interrupted(Exception):
+  pass
+
+
+@pytest.fixture
+def LUT_build(monkeypatch):
+  """
+  LUT_build with a stand-in for run_6S (and for Py6S if it is not installed,
+  i.e. just what build_LUT needs before it runs 6S)
+  """
+  try:
+    import Py6S
+  except ImportError:
+    Py6S = types.ModuleType('Py6S')
+    Py6S.SixS = lambda: types.SimpleNamespace(
+      altitudes=types.SimpleNamespace(set_sensor_satellite_level=lambda: None))
+    Py6S.AeroProfile = types.SimpleNamespace(Continental=1)
+    Py6S.Geometry = types.SimpleNamespace(User=types.SimpleNamespace)
+    monkeypatch.setitem(sys.modules, 'Py6S', Py6S)
+  monkeypatch.syspath_prepend(ROOT)
+  monkeypatch.delitem(sys.modules, 'LUT_build', raising=False)
+  import LUT_build
+  return LUT_build
+
+
+def build(LUT_build, monkeypatch, config, interrupt_after=None):
+  """
+  Progressive build with a stand-in 6S (interrupted after a number of runs),
+  returns the permutations run and the stages published
+  """
+  runs, published = [], []
+
+  def run_6S(s, config, perm):
+    if interrupt_after is not None and len(runs) == interrupt_after:
+      raise Interrupted()
+    runs.append(perm)
+    return (sum(perm), 1.0), dict.fromkeys(LUT_build.OUTPUT_COLUMNS, perm[0])
+
+  save_LUT = LUT_build.save_LUT
+  def publish(stage_config, results, store=None):
+    published.append(stage_config.get('stage'))
+    save_LUT(stage_config, results, store)
+
+  monkeypatch.setattr(LUT_build, 'run_6S', run_6S)
+  monkeypatch.setattr(LUT_build, 'save_LUT', publish)
+  try:
+    LUT_build.build_LUT(dict(config), progressive=True)
+  except Interrupted:
+    pass
+  return runs, published
+
+
+@pytest.mark.parametrize('interrupted_in_stage', [2, 3])
+def test_progressive_build_resumes(LUT_build, monkeypatch, tmp_path, interrupted_in_stage):
+  config = {'spectrum':(0.5,), 'aerosol_profile':'Continental', 'view_zenith':0,
+            'invars':SMALL, 'sensor':'test', 'filename':'test.lut',
+            'filepath':str(tmp_path / 'test.lut')}
+  stages = [set(permutate_invars(invars)) for invars in progressive_invars(SMALL)]
+  assert len(stages) == 3
+
+  # interrupted halfway through a stage
+  done = len(stages[interrupted_in_stage - 2])
+  todo = len(stages[interrupted_in_stage - 1] - stages[interrupted_in_stage - 2])
+  runs, published = build(LUT_build, monkeypatch, config, interrupt_after=done + todo // 2)
+  assert published == [[k, 3] for k in range(1, interrupted_in_stage)]
+
+  # the resumed build runs only what the latest published stage has not,
+  # and republishes none of the stages before it
+  resumed_runs, published = build(LUT_build, monkeypatch, config)
+  assert len(resumed_runs) == len(set(resumed_runs))
+  assert set(resumed_runs) == stages[-1] - stages[interrupted_in_stage - 2]
+  assert published == [[k, 3] for k in range(interrupted_in_stage, 3)] + [None]
+
+  with open(config['filepath'], 'rb') as f:
+    LUT = pickle.load(f)
+  assert 'stage' not in LUT['config']
+  assert LUT['outputs'] == [(sum(perm), 1.0) for perm in permutate_invars(SMALL)]
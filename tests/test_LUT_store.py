@@ -0,0 +1,110 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import SMALL
+from LUT_store import LUT_Store, atomic_write, config_key
+from interpolated_LUTs import Interpolated_LUTs
+
+
+def config(AOT=1.0, **kwargs):
+  invars = dict(SMALL, AOTs=[0, AOT, 3])
+  return dict({'spectrum':'S2A_MSI_01', 'aerosol_profile':'Continental',
+               'view_zenith':0, 'invars':invars}, **kwargs)
+
+
+def writer(content):
+  return lambda f: f.write(content)
+
+
+def test_put_and_lookup(tmp_path):
+  store = LUT_Store(str(tmp_path))
+  filepath = store.put(config(), 'lut', writer(b'LUT'), sensor='S2A_MSI', filename='S2A_MSI_01.lut')
+
+  assert store.get(config(), 'lut') == filepath
+  assert store.get(config(), 'lut', verify=True) == filepath
+  assert store.get(config(AOT=2.0), 'lut') is None
+  assert store.get(config(), 'ilut') is None
+  assert store.find('lut', sensor='S2A_MSI') == [(config_key(config()), filepath)]
+
+  # a stale (rewritten) file is not returned
+  with open(filepath, 'wb') as f:
+    f.write(b'LUT, partially rewritten')
+  assert store.get(config(), 'lut') is None
+  store.refresh(filepath)
+  assert store.get(config(), 'lut', verify=True) == filepath
+
+
+def test_atomic_write_leaves_no_partial_file(tmp_path):
+  filepath = str(tmp_path / 'sub' / 'file.lut')
+  atomic_write(filepath, writer(b'first'))
+
+  def fail(f):
+    f.write(b'partial')
+    raise RuntimeError('interrupted')
+
+  with pytest.raises(RuntimeError):
+    atomic_write(filepath, fail)
+
+  with open(filepath, 'rb') as f:
+    assert f.read() == b'first'
+  assert os.listdir(os.path.dirname(filepath)) == ['file.lut']
+
+
+def test_index_with_concurrent_writers(tmp_path):
+  configs = [config(AOT=1 + i/100) for i in range(40)]
+
+  def put(c):
+    # (a store per writer, as in separate processes)
+    return LUT_Store(str(tmp_path)).put(c, 'lut', writer(repr(c).encode()))
+
+  with ThreadPoolExecutor(8) as pool:
+    filepaths = list(pool.map(put, configs))
+
+  store = LUT_Store(str(tmp_path))
+  assert len(store.index()) == len(configs)
+  assert [store.get(c, 'lut', verify=True) for c in configs] == filepaths
+
+
+def test_eviction_least_recently_used_first(tmp_path):
+  store = LUT_Store(str(tmp_path), max_bytes=35)
+  store.put(config(AOT=1.1), 'lut', writer(b'L'*100))
+  keys = []
+  for i, AOT in enumerate([1.1, 1.2, 1.3]):
+    filepath = store.put(config(AOT=AOT), 'ilut', writer(b'i'*10))
+    os.utime(filepath, (1000 + i, 1000 + i))
+    keys.append(config_key(config(AOT=AOT)))
+
+  # looking up the oldest one makes it the most recently used
+  assert store.get(config(AOT=1.1), 'ilut') is not None
+  store.put(config(AOT=1.4), 'ilut', writer(b'i'*10))
+
+  index = store.index()
+  assert store.get(config(AOT=1.1), 'ilut') is not None
+  assert store.get(config(AOT=1.2), 'ilut') is None
+  assert store.get(config(AOT=1.3), 'ilut') is not None
+  assert store.get(config(AOT=1.4), 'ilut') is not None
+
+  # LUTs are never evicted, keys without any files are dropped
+  assert store.get(config(AOT=1.1), 'lut') is not None
+  assert keys[1] not in index
+
+
+def test_store_takes_precedence_over_files_dir(tmp_path):
+  store = LUT_Store(str(tmp_path / 'store'))
+  store.put(config(), 'ilut', writer(b'stored'), sensor='S2A_MSI',
+            filename='S2A_MSI_01.ilut', aerosol_profile='Continental', build_type='full')
+
+  iLUTs = Interpolated_LUTs('COPERNICUS/S2', store=store)
+  iLUTs.iLUTs_dir = str(tmp_path / 'files')
+  os.makedirs(iLUTs.iLUTs_dir)
+  for filename in ['S2A_MSI_01.ilut', 'S2A_MSI_02.ilut']:
+    with open(os.path.join(iLUTs.iLUTs_dir, filename), 'wb') as f:
+      pickle.dump(filename, f)
+
+  filepaths = iLUTs.iLUT_filepaths()
+  assert filepaths == [store.get(config(), 'ilut'),
+                       os.path.join(iLUTs.iLUTs_dir, 'S2A_MSI_02.ilut')]
+  assert [iLUTs.bandName(f) for f in filepaths] == ['B1', 'B2']
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import os
+import threading
+import time
+import urllib.request
+import zipfile
+
+import numpy as np
+import pytest
+
+from conftest import SMALL, coefficients, make_LUT, random_points
+from grid_interpolator import GridInterpolator
+from async_LUTs import AsyncInterpolated_LUTs
+import iLUT_io
+
+
+class FakeResponse:
+  """
+  Response of urlopen that serves content in chunks (slowly, if delay)
+  """
+
+  def __init__(self, content, delay=0):
+    self.content = io.BytesIO(content)
+    self.delay = delay
+    self.reads = threading.Event()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    pass
+
+  def read(self, n):
+    self.reads.set()
+    time.sleep(self.delay)
+    return self.content.read(min(n, 1024))
+
+
+def test_get_async(tmp_path):
+  iLUTs = AsyncInterpolated_LUTs('LANDSAT/LC8', max_concurrency=2)
+  iLUTs.iLUTs_dir = str(tmp_path)
+  grids = {}
+  for k, band in enumerate(['01', '02', '03']):
+    LUT = make_LUT(SMALL, lambda points, k=k: coefficients(points)*(1 + k))
+    grids[band] = GridInterpolator.from_LUT(LUT)
+    iLUT_io.save_iLUT(str(tmp_path / 'LANDSAT_OLI_{}.ilut'.format(band)), grids[band])
+
+  loaded = asyncio.run(iLUTs.get_async(dtype=np.float32))
+  assert sorted(loaded) == ['01', '02', '03']
+  points = random_points(SMALL, 50)
+  for band, grid in grids.items():
+    assert loaded[band].dtype == np.float32
+    np.testing.assert_allclose(loaded[band](points), grid(points), rtol=1e-5)
+
+  # same as the blocking version
+  assert sorted(iLUTs.get()) == sorted(loaded)
+
+  iLUTs.iLUTs_dir = str(tmp_path / 'missing')
+  assert asyncio.run(iLUTs.get_async()) == {}
+
+
+def test_download_async(tmp_path, monkeypatch):
+  content = io.BytesIO()
+  with zipfile.ZipFile(content, 'w') as zf:
+    zf.writestr('LANDSAT_OLI/Continental/view_zenith_0/LANDSAT_OLI_01.lut', b'LUT'*1000)
+  monkeypatch.setattr(urllib.request, 'urlopen', lambda url: FakeResponse(content.getvalue()))
+
+  iLUTs = AsyncInterpolated_LUTs('LANDSAT/LC8')
+  iLUTs.files_dir = str(tmp_path)
+  asyncio.run(iLUTs.download_LUTs_async())
+
+  assert os.listdir(str(tmp_path / 'LUTs')) == ['LANDSAT_OLI']
+  assert os.path.isfile(str(tmp_path / 'LUTs' / 'LANDSAT_OLI' / 'Continental' /
+                            'view_zenith_0' / 'LANDSAT_OLI_01.lut'))
+
+
+def test_cancelled_download_removes_its_part_file(tmp_path, monkeypatch):
+  response = FakeResponse(b'x'*10**6, delay=0.01)
+  monkeypatch.setattr(urllib.request, 'urlopen', lambda url: response)
+
+  iLUTs = AsyncInterpolated_LUTs('LANDSAT/LC8')
+  iLUTs.files_dir = str(tmp_path)
+  part_filepath = str(tmp_path / 'LUTs' / 'LANDSAT_OLI.zip.part')
+
+  async def cancel_download():
+    task = asyncio.ensure_future(iLUTs.download_LUTs_async())
+    while not response.reads.is_set():
+      await asyncio.sleep(0.01)
+    assert os.path.isfile(part_filepath)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+      await task
+
+  asyncio.run(cancel_download())
+
+  # (asyncio.run waits for the download thread, which stops at its next chunk)
+  assert response.content.tell() < 10**6
+  assert os.listdir(str(tmp_path / 'LUTs')) == []
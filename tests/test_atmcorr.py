@@ -0,0 +1,211 @@
+import numpy as np
+import pytest
+
+from conftest import SMALL, SMALL_MIXTURE, make_LUT, random_points
+from grid_interpolator import GridInterpolator
+from atmcorr import (check_float32, correct, correct_coarse, correct_parallel,
+                     correct_uncertainty, correction_coefficients, correction_gradients,
+                     float32_error, unique_inputs, valid_pixels)
+
+
+def test_unique_inputs_round_trip(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  invars = [np.array([[30, 30], [40, 30]]), 1, 0.4, np.array([0.5, 0.5]), 2]
+  shape, points, inverse = unique_inputs(grid, invars)
+
+  assert shape == (2, 2)
+  assert len(points) == 2
+  np.testing.assert_array_equal(points[inverse][:, 0], [30, 30, 40, 30])
+
+
+def test_dedup_matches_per_pixel_interpolation(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  points = random_points(SMALL, 500)
+  points = np.concatenate([points, points[::-1]])
+
+  report = {}
+  a, b = correction_coefficients(grid, *points.T, tolerance=0, report=report)
+  a_exact, b_exact = correction_coefficients(grid, *points.T)
+
+  np.testing.assert_array_equal(a, a_exact)
+  np.testing.assert_array_equal(b, b_exact)
+  assert report['dedup_ratio'] == 2
+
+
+def test_binning_stays_inside_grid_edges():
+  grid = GridInterpolator.from_LUT(make_LUT(SMALL))
+  alt = np.array([7.75, 7.7, 0])
+  O3 = np.array([0.79, 0.8, 0.4])
+
+  report = {}
+  a, b = correction_coefficients(grid, 30, 1, O3, 0.5, alt, report=report,
+                                 tolerance={'alt':0.1, 'O3':0.3})
+
+  assert not any(report['out_of_range'].values())
+  assert np.isfinite(a).all() and np.isfinite(b).all()
+  _, points, _ = unique_inputs(grid, [30, 1, O3, 0.5, alt], {'alt':0.1, 'O3':0.3})
+  assert points[:, 4].max() == 7.75
+  assert points[:, 2].max() == 0.8
+
+
+def scene(shape=(40, 30), seed=0):
+  points = random_points(SMALL, int(np.prod(shape)), seed=seed)
+  L = np.random.RandomState(seed).uniform(50, 150, shape)
+  return L, [x.reshape(shape) for x in points.T]
+
+
+def test_boolean_mask_and_fill_value(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  L, invars = scene()
+  mask = np.random.RandomState(1).rand(*L.shape) < 0.3
+
+  report = {}
+  ρ = correct(grid, L, *invars, mask=mask, fill_value=-1, report=report)
+  exact = correct(grid, L, *invars)
+
+  assert ρ.shape == L.shape
+  np.testing.assert_array_equal(ρ[mask], -1)
+  np.testing.assert_allclose(ρ[~mask], exact[~mask])
+  assert report['valid_fraction'] == pytest.approx(1 - mask.mean())
+
+
+def test_bit_mask(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  L, invars = scene()
+  QA = np.random.RandomState(2).randint(0, 1 << 12, L.shape).astype(np.uint16)
+  cloud_bits = (1 << 10) | (1 << 11)
+  cloudy = (QA & cloud_bits) != 0
+
+  np.testing.assert_array_equal(valid_pixels(QA, cloud_bits), ~cloudy)
+  ρ = correct(grid, L, *invars, mask=QA, mask_bits=cloud_bits)
+  assert np.isnan(ρ[cloudy]).all()
+  assert np.isfinite(ρ[~cloudy]).all()
+  with pytest.raises(ValueError, match='mask_bits'):
+    correct(grid, L, *invars, mask=QA)
+
+
+def test_mask_broadcasts_with_scalar_inputs(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  L = np.full((4, 5), 80.0)
+  mask = np.zeros(5, dtype=bool)
+  mask[1] = True
+
+  report = {}
+  ρ = correct(grid, L, 30, 1, 0.4, 0.5, 2, mask=mask, report=report)
+  assert np.isnan(ρ[:, 1]).all()
+  np.testing.assert_allclose(ρ[:, 0], correct(grid, 80.0, 30, 1, 0.4, 0.5, 2))
+  assert report['valid_fraction'] == pytest.approx(0.8)
+
+
+def test_parallel_masked_output_matches_correct(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  L, invars = scene(shape=(50, 20))
+  mask = np.random.RandomState(3).rand(*L.shape) < 0.4
+
+  report, parallel_report = {}, {}
+  ρ = correct(grid, L, *invars, doy=180, mask=mask, fill_value=0, report=report)
+  ρ_parallel = correct_parallel(grid, L, *invars, doy=180, mask=mask, fill_value=0,
+                                threads=3, tile_rows=7, report=parallel_report)
+
+  np.testing.assert_allclose(ρ_parallel, ρ, rtol=1e-12)
+  np.testing.assert_array_equal(ρ_parallel[mask], 0)
+  assert parallel_report['valid_fraction'] == pytest.approx(report['valid_fraction'])
+
+
+def test_uncertainty_methods_agree(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  points = random_points(SMALL, 50, seed=3)
+  points[:, 3] = np.clip(points[:, 3], 0.5, 2.5)
+  L = np.full(len(points), 80.0)
+  sigma = {'AOT':0.02, 'L':0.5}
+
+  ρ, σ = correct_uncertainty(grid, L, *points.T, sigma=sigma)
+  ρ_mc, σ_mc = correct_uncertainty(grid, L, *points.T, sigma=sigma,
+                                   method='monte_carlo', samples=4000)
+
+  np.testing.assert_allclose(ρ_mc, ρ)
+  np.testing.assert_allclose(σ_mc, σ, rtol=0.1)
+
+
+def test_monte_carlo_uncertainty_without_sigma_is_zero(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  points = random_points(SMALL, 20)
+  ρ, σ = correct_uncertainty(grid, np.linspace(50, 100, 20), *points.T, sigma={},
+                             method='monte_carlo')
+
+  assert np.isfinite(ρ).all()
+  np.testing.assert_array_equal(σ, 0)
+
+
+def test_coupled_correction(small_LUT):
+  LUT = dict(small_LUT)
+  path_radiance = np.array([ab[0] for ab in LUT['outputs']])
+  LUT['columns'] = {'spherical_albedo':0.1 + 0.001*path_radiance}
+  grid = GridInterpolator.from_LUT(LUT, columns=['a', 'b', 'spherical_albedo'])
+  L, invars = scene()
+
+  a, b, S = np.moveaxis(grid(*invars), -1, 0)
+  y = (L - a)/b
+  np.testing.assert_allclose(correct(grid, L, *invars, coupled=True), y/(1 + S*y), rtol=1e-10)
+
+  with pytest.raises(ValueError, match='spherical albedo'):
+    correct(GridInterpolator.from_LUT(small_LUT), L, *invars, coupled=True)
+
+
+def test_correct_coarse_within_reported_error(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  L = np.random.RandomState(0).uniform(50, 150, (40, 30))
+  AOT = np.linspace(0, 2, 40)[:, None]
+  alt = np.linspace(0, 7, 30)
+
+  report = {}
+  ρ = correct_coarse(grid, L, 30, 1, 0.4, AOT, alt, step=7, block_rows=9,
+                     report=report, error_samples=L.size)
+  exact = correct(grid, L, 30, 1, 0.4, AOT, alt)
+
+  assert ρ.shape == L.shape
+  assert report['coarse_grid'] == (7, 6)
+  np.testing.assert_allclose(ρ, exact, atol=report['coarse_error']['max'] + 1e-6)
+
+
+def test_aerosol_mixture_options(mixture_LUT):
+  grid = GridInterpolator.from_LUT(mixture_LUT)
+  points = random_points(SMALL_MIXTURE, 40)
+  invars, mixture = points.T[:5], points[:, 5]
+  L = np.full(len(points), 80.0)
+
+  a, b, da, db = correction_gradients(grid, *invars, aerosol_mixture=mixture)
+  assert da.shape == (len(points), 6)
+  np.testing.assert_allclose(np.stack([a, b], axis=-1), grid(points))
+
+  ρ, σ = correct_uncertainty(grid, L, *invars, sigma={'aerosol_mixture':0.1},
+                             aerosol_mixture=mixture)
+  assert np.isfinite(σ).all() and σ.max() > 0
+  ρ_mc, σ_mc = correct_uncertainty(grid, L, *invars, sigma={'aerosol_mixture':0.1},
+                                   aerosol_mixture=mixture, method='monte_carlo',
+                                   policy='clamp')
+  np.testing.assert_allclose(ρ_mc, ρ)
+
+  with pytest.raises(ValueError, match='input variables'):
+    correct_uncertainty(grid, L, *invars, sigma={})
+
+
+def test_correct_coarse_with_aerosol_mixture(mixture_LUT):
+  grid = GridInterpolator.from_LUT(mixture_LUT)
+  mixture = np.linspace(0, 2, 50)[None, :] * np.ones((40, 1))
+  L = np.full((40, 50), 80.0)
+
+  report = {}
+  ρ = correct_coarse(grid, L, 30, 1, 0.4, 0.5, 2, step=7, report=report,
+                     aerosol_mixture=mixture)
+  exact = correct(grid, L, 30, 1, 0.4, 0.5, 2, aerosol_mixture=mixture)
+
+  assert ρ.shape == L.shape
+  np.testing.assert_allclose(ρ, exact, atol=report['coarse_error']['max'] + 1e-6)
+
+
+def test_check_float32_with_aerosol_mixture(small_LUT, mixture_LUT):
+  iLUTs = {'B1':GridInterpolator.from_LUT(small_LUT),
+           'B2':GridInterpolator.from_LUT(mixture_LUT)}
+  assert check_float32(iLUTs)
+  assert float32_error(iLUTs['B2'], n=20000)['max'] < 0.0005
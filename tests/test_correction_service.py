@@ -0,0 +1,113 @@
+import os
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import SMALL, SMALL_MIXTURE, make_LUT, random_points
+from grid_interpolator import GridInterpolator
+import atmcorr
+import correction_service
+from correction_service import CorrectionClient, CorrectionService, make_server, remove_socket
+
+
+GRIDS = {'Continental':GridInterpolator.from_LUT(make_LUT(SMALL)),
+         'Mixture':GridInterpolator.from_LUT(make_LUT(SMALL_MIXTURE))}
+
+
+class FakeLUTs:
+  """
+  Interpolated_LUTs of one band per aerosol profile (no files needed)
+  """
+  loading = {}
+
+  def __init__(self, mission, aerosol_profile='Continental', **kwargs):
+    self.mission = mission
+    self.aerosol_profile = aerosol_profile
+
+  def get(self, dtype=None):
+    if self.mission in self.loading:
+      self.loading[self.mission].wait(10)
+    return {'B1':GRIDS[self.aerosol_profile].astype(dtype)}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+  monkeypatch.setattr(correction_service, 'Interpolated_LUTs', FakeLUTs)
+  address = str(tmp_path / 's.sock')
+  server = make_server(address, CorrectionService(dtype=np.float64))
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  with CorrectionClient(address) as client:
+    yield client
+  server.shutdown()
+  server.server_close()
+
+
+def test_coefficients_and_reflectance(client):
+  points = random_points(SMALL, 100)
+  a, b = client.coefficients('COPERNICUS/S2', 'B1', *points.T, doy=100)
+  a_local, b_local = atmcorr.correction_coefficients(GRIDS['Continental'], *points.T, doy=100)
+  np.testing.assert_allclose(a, a_local)
+  np.testing.assert_allclose(b, b_local)
+
+  DN = np.arange(100, dtype=np.uint16) + 1000
+  ref = client.reflectance('COPERNICUS/S2', 'B1', DN, *points.T, gain=0.05, offset=10)
+  expected = atmcorr.correct(GRIDS['Continental'], DN*0.05 + 10, *points.T, dtype=np.float64)
+  np.testing.assert_allclose(ref, expected, rtol=1e-6)
+
+
+def test_aerosol_mixture_request(client):
+  points = random_points(SMALL_MIXTURE, 50)
+  L = np.linspace(50, 100, 50)
+  ref = client.reflectance('COPERNICUS/S2', 'B1', L, *points.T[:5], aerosol_mixture=points[:, 5])
+  expected = atmcorr.correct(GRIDS['Mixture'], L, *points.T[:5], aerosol_mixture=points[:, 5])
+  np.testing.assert_allclose(ref, expected)
+  assert client.bands('COPERNICUS/S2', 'Mixture') == ['B1']
+
+
+def test_error_response(client):
+  with pytest.raises(RuntimeError, match='B99'):
+    client.coefficients('COPERNICUS/S2', 'B99', 30, 1, 0.4, 0.5, 2)
+  with pytest.raises(RuntimeError, match='unknown request'):
+    client.request({'op':'transmogrify', 'mission':'COPERNICUS/S2', 'band':'B1'})
+
+  # (the connection is still usable after an error)
+  client.ping()
+
+
+def test_slow_load_does_not_block_loaded_iLUTs(monkeypatch):
+  monkeypatch.setattr(correction_service, 'Interpolated_LUTs', FakeLUTs)
+  service = CorrectionService()
+  service.get('COPERNICUS/S2')
+
+  FakeLUTs.loading['LANDSAT/LC8'] = threading.Event()
+  slow = threading.Thread(target=service.get, args=('LANDSAT/LC8',))
+  try:
+    slow.start()
+    assert list(service.get('COPERNICUS/S2')) == ['B1']
+    assert list(service.get('COPERNICUS/S2', 'Mixture')) == ['B1']
+  finally:
+    FakeLUTs.loading.pop('LANDSAT/LC8').set()
+    slow.join()
+  assert ('LANDSAT/LC8', 'Continental') in service.iLUTs
+
+
+def test_only_unix_sockets_are_removed(tmp_path):
+  path = str(tmp_path / 's.sock')
+  with open(path, 'w') as f:
+    f.write('not a socket')
+  with pytest.raises(ValueError, match='not a unix socket'):
+    make_server(path, CorrectionService())
+  assert os.path.exists(path)
+
+  # a stale socket (of a service that did not exit cleanly) is replaced
+  os.remove(path)
+  stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  stale.bind(path)
+  stale.close()
+  server = make_server(path, CorrectionService())
+  server.server_close()
+  remove_socket(path)
+  assert not os.path.exists(path)
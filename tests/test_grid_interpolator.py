@@ -0,0 +1,225 @@
+import numpy as np
+import pytest
+
+from conftest import SMALL, coefficients, make_LUT, random_points
+from grid_interpolator import CubicGridInterpolator, GridInterpolator
+import kernels
+from atmcorr import correct, correct_parallel, float32_error, surface_reflectance
+
+
+def linear(points):
+  x = np.asarray(points, dtype=np.float64)
+  return np.stack([x @ [1, -2, 3, 0.5, 4] + 7, x @ [0.1, 0, -1, 2, 0]], axis=-1)
+
+
+def test_exact_on_grid_nodes(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  points = np.array([[20, 2, 0.4, 1, 4], [75, 8.5, 0.8, 3, 7.75], [0, 0, 0, 0, 0]])
+  np.testing.assert_allclose(grid(points), coefficients(points), rtol=1e-12)
+
+
+def test_reproduces_linear_functions():
+  grid = GridInterpolator.from_LUT(make_LUT(SMALL, linear))
+  points = random_points(SMALL, 1000)
+  np.testing.assert_allclose(grid(points), linear(points), rtol=1e-10, atol=1e-10)
+
+
+def test_accuracy_comparable_to_delaunay(small_LUT):
+  from scipy.interpolate import LinearNDInterpolator
+
+  points = random_points(SMALL, 2000)
+  truth = coefficients(points)[:, 0]
+
+  grid = GridInterpolator.from_LUT(small_LUT)
+  nodes = np.array(np.meshgrid(*grid.axes, indexing='ij')).reshape(5, -1).T
+  delaunay = LinearNDInterpolator(nodes, grid.flat_values[:, 0])
+
+  kuhn = np.abs(grid(points)[:, 0] - truth).max()
+  scipy = np.nanmax(np.abs(delaunay(points) - truth))
+  assert kuhn < 1.5 * scipy
+
+
+def test_scalar_and_broadcast_arguments(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  a, b = grid(30, 1, 0.4, 0.5, 2)
+  assert np.ndim(a) == 0
+  values = grid(np.array([30, 40]), 1, 0.4, 0.5, 2)
+  assert values.shape == (2, 2)
+  np.testing.assert_allclose(values[0], [a, b])
+
+
+def test_numba_and_numpy_reflectance_agree(full_LUT, monkeypatch):
+  pytest.importorskip('numba')
+
+  grid = GridInterpolator.from_LUT(full_LUT)
+  points = random_points(full_LUT['config']['invars'], 5000)
+  L = np.random.RandomState(1).uniform(20, 200, len(points))
+
+  compiled = grid.reflectance(L, points, correction=1.01)
+  monkeypatch.setattr(kernels, '_numba_kernel', False)
+  interpreted = grid.reflectance(L, points, correction=1.01)
+
+  np.testing.assert_allclose(compiled, interpreted, rtol=1e-12, atol=1e-12)
+
+
+def test_parallel_tiles_match_correct(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  rng = np.random.RandomState(2)
+  L = rng.uniform(20, 200, (30, 11))
+  invars = random_points(SMALL, L.size).T.reshape(5, 30, 11)
+
+  ρ = correct(grid, L, *invars, doy=180)
+  ρ_parallel = correct_parallel(grid, L, *invars, doy=180, threads=3, tile_rows=7)
+
+  np.testing.assert_allclose(ρ_parallel, ρ, rtol=1e-12)
+
+
+def test_float32_error_below_tolerance(full_LUT):
+  grid = GridInterpolator.from_LUT(full_LUT)
+  assert grid.astype(np.float32).dtype == np.float32
+  assert float32_error(grid, n=20000)['max'] < 0.0005
+
+
+def test_scalar_surface_reflectance():
+  ref = surface_reflectance(60.0, 20.0, 100.0)
+  assert np.ndim(ref) == 0
+  assert ref == pytest.approx(0.4)
+  np.testing.assert_allclose(surface_reflectance(np.array([60.0, 120.0]), 20.0, 100.0), [0.4, 1.0])
+
+
+def test_out_of_range_policies():
+  grid = GridInterpolator.from_LUT(make_LUT(SMALL, linear))
+  inside = [30, 1, 0.4, 0.5, 7.75]
+  above = [30, 1, 0.4, 0.5, 9.0]
+
+  assert np.isnan(grid(above)).all()
+  np.testing.assert_allclose(grid(above, policy='clamp'), grid(inside))
+  np.testing.assert_allclose(grid(above, policy={'alt':'linear'}), linear([above])[0])
+  with pytest.raises(ValueError, match='alt'):
+    grid(above, policy='raise')
+
+
+def test_policy_per_axis_and_report():
+  grid = GridInterpolator.from_LUT(make_LUT(SMALL, linear), policy={'alt':'clamp'})
+  report = {}
+  values = grid(np.array([[30, 1, 0.4, 0.5, 9.0], [30, 1, 0.4, 5.0, 2.0]]), report=report)
+
+  assert np.isfinite(values[0]).all()
+  assert np.isnan(values[1]).all()
+  assert report['out_of_range']['alt'] == 1
+  assert report['out_of_range']['AOT'] == 1
+  with pytest.raises(ValueError, match='unknown'):
+    grid(30, 1, 0.4, 0.5, 2.0, policy={'altitude':'clamp'})
+  with pytest.raises(ValueError, match='not recognized'):
+    grid(30, 1, 0.4, 0.5, 2.0, policy='wrap')
+
+
+def cell_interior_points(grid, n, seed=0):
+  """
+  Random points with distinct fractional coordinates in their cell (apart
+  from each other and from the cell faces), i.e. well inside one simplex
+  """
+  rng = np.random.RandomState(seed)
+  fractions = np.array([rng.permutation([0.1, 0.25, 0.4, 0.55, 0.7]) for _ in range(n)])
+  fractions += rng.uniform(0, 0.05, fractions.shape)
+  points = np.empty((n, grid.ndim))
+  for k, axis in enumerate(grid.axes):
+    cell = rng.randint(0, len(axis) - 1, n)
+    points[:, k] = axis[cell] + fractions[:, k]*(axis[cell + 1] - axis[cell])
+  return points
+
+
+def central_differences(function, points, steps):
+  """
+  Central difference derivatives of function along each axis, (..., ndim)
+  """
+  differences = []
+  for k, h in enumerate(steps):
+    step = np.zeros(points.shape[-1])
+    step[k] = h
+    differences.append((function(points + step) - function(points - step)) / (2*h))
+  return np.stack(differences, axis=-1)
+
+
+def test_linear_gradient_matches_finite_differences(small_LUT):
+  from atmcorr import correction_coefficients, correction_gradients
+
+  grid = GridInterpolator.from_LUT(small_LUT)
+  points = cell_interior_points(grid, 200)
+  steps = [1e-4*np.diff(axis).min() for axis in grid.axes]
+
+  # (the interpolant is linear in a simplex, i.e. central differences are
+  # exact up to rounding)
+  values, jacobian = grid.gradient(points)
+  np.testing.assert_allclose(values, grid(points), rtol=1e-12)
+  np.testing.assert_allclose(jacobian, central_differences(grid, points, steps),
+                             rtol=1e-7, atol=1e-9)
+
+  a, b, da, db = correction_gradients(grid, *points.T, doy=30)
+  coefficients = lambda x: np.stack(correction_coefficients(grid, *x.T, doy=30), axis=-1)
+  differences = central_differences(coefficients, points, steps)
+  np.testing.assert_allclose(da, differences[:, 0], rtol=1e-7, atol=1e-9)
+  np.testing.assert_allclose(db, differences[:, 1], rtol=1e-7, atol=1e-9)
+
+
+def test_cubic_matches_scipy_pchip(small_LUT):
+  from scipy.interpolate import PchipInterpolator
+
+  grid = CubicGridInterpolator.from_LUT(small_LUT)
+  solar_z = np.linspace(0, 75, 101)
+
+  # other variables on grid levels, i.e. 1D interpolation along solar_z
+  values = grid(solar_z, 2, 0.4, 1, 4)
+  levels = np.array(SMALL['solar_zs'], dtype=float)
+  nodes = coefficients(np.stack(np.broadcast_arrays(levels, 2, 0.4, 1, 4), axis=-1))
+
+  np.testing.assert_allclose(values, PchipInterpolator(levels, nodes)(solar_z), rtol=1e-12)
+
+
+def test_cubic_gradient_matches_finite_differences(small_LUT):
+  grid = CubicGridInterpolator.from_LUT(small_LUT)
+  points = random_points(SMALL, 200)
+  values, jacobian = grid.gradient(points)
+
+  np.testing.assert_allclose(values, grid(points), rtol=1e-12)
+  eps = 1e-6
+  for k in range(grid.ndim):
+    step = np.zeros(grid.ndim)
+    step[k] = eps
+    difference = (grid(points + step) - grid(points - step)) / (2*eps)
+    np.testing.assert_allclose(jacobian[..., k], difference, atol=1e-6)
+
+
+def test_cubic_gradient_at_the_grid_ends():
+  from scipy.interpolate import PchipInterpolator
+
+  # not monotone along solar_z (i.e. local extrema, where PCHIP derivatives
+  # are 0) and curved at both ends (one-sided derivatives)
+  wavy = lambda points: np.stack([np.sin(np.radians(3*points[:, 0])) + points[:, 3],
+                                  points[:, 0]**2 / 100 - points[:, 4]], axis=-1)
+  invars = dict(SMALL, solar_zs=[0, 10, 20, 30, 45, 60, 75])
+  grid = CubicGridInterpolator.from_LUT(make_LUT(invars, wavy))
+
+  # 1D along solar_z, including the levels and the edge cells
+  levels = np.array(invars['solar_zs'], dtype=float)
+  solar_z = np.concatenate([levels, np.linspace(0, 75, 151)])
+  values, jacobian = grid.gradient(solar_z, 2, 0.4, 1, 4)
+  nodes = wavy(np.stack(np.broadcast_arrays(levels, 2, 0.4, 1, 4), axis=-1))
+  np.testing.assert_allclose(jacobian[..., 0], PchipInterpolator(levels, nodes).derivative()(solar_z),
+                             rtol=1e-10, atol=1e-12)
+
+  # and in the first and last cell of each axis
+  points = random_points(invars, 40)
+  for k, axis in enumerate(grid.axes):
+    ends = points.copy()
+    ends[:20, k] = axis[0] + np.linspace(0.1, 0.9, 20)*(axis[1] - axis[0])
+    ends[20:, k] = axis[-2] + np.linspace(0.1, 0.9, 20)*(axis[-1] - axis[-2])
+    steps = [1e-6]*grid.ndim
+    np.testing.assert_allclose(grid.gradient(ends)[1], central_differences(grid, ends, steps),
+                               atol=1e-6)
+
+  # beyond the grid (policy 'linear') the derivative is the slope of the edge cell
+  beyond = np.array([[80, 2, 0.4, 1, 4], [-5, 2, 0.4, 1, 4]], dtype=float)
+  jacobian = grid.gradient(beyond, policy='linear')[1]
+  edge_slopes = [(nodes[-1] - nodes[-2]) / 15, (nodes[1] - nodes[0]) / 10]
+  np.testing.assert_allclose(jacobian[..., 0], edge_slopes, rtol=1e-12)
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from conftest import SMALL, coefficients, make_LUT, random_points
+from grid_interpolator import GridInterpolator
+from hyperspectral import HyperspectralLUTs
+import atmcorr
+
+
+def band_LUTs(n=3):
+  """
+  Look up tables of n bands, each scaling the synthetic coefficients
+  """
+  return {'B{}'.format(i):make_LUT(SMALL, lambda points, i=i: coefficients(points)*(1 + 0.1*i))
+          for i in range(n)}
+
+
+def test_from_iLUTs_matches_each_band():
+  iLUTs = {band:GridInterpolator.from_LUT(LUT) for band, LUT in band_LUTs().items()}
+  LUTs = HyperspectralLUTs.from_iLUTs(iLUTs, max_bytes=4096)
+  points = random_points(SMALL, 300)
+
+  a, b = LUTs.coefficients(*points.T, doy=10)
+  assert a.shape == (300, 3)
+  for i, band in enumerate(LUTs.bands):
+    a_band, b_band = atmcorr.correction_coefficients(iLUTs[band], *points.T, doy=10)
+    np.testing.assert_allclose(a[:, i], a_band, rtol=1e-12)
+    np.testing.assert_allclose(b[:, i], b_band, rtol=1e-12)
+
+  # the caller's grid keeps its chunk size
+  grid = GridInterpolator(LUTs.grid.axes, LUTs.grid.values)
+  chunk_size = grid.chunk_size
+  assert HyperspectralLUTs(grid, LUTs.bands, max_bytes=4096).grid.chunk_size == LUTs.block_size
+  assert grid.chunk_size == chunk_size != LUTs.block_size
+
+
+def test_from_LUTs_and_different_grids():
+  LUTs = HyperspectralLUTs.from_LUTs(band_LUTs(), dtype=np.float32)
+  assert LUTs.dtype == np.float32
+  assert LUTs.bands == ['B0', 'B1', 'B2']
+
+  other = dict(SMALL, alts=[0, 2, 4, 7.75])
+  with pytest.raises(ValueError, match='B3'):
+    HyperspectralLUTs.from_LUTs(dict(band_LUTs(), B3=make_LUT(other)))
+
+
+def test_select_keeps_band_order():
+  LUTs = HyperspectralLUTs.from_LUTs(band_LUTs())
+  subset = LUTs.select(['B2', 'B0'])
+  points = random_points(SMALL, 50)
+
+  a, b = LUTs.coefficients(*points.T)
+  a_subset, b_subset = subset.coefficients(*points.T)
+  np.testing.assert_array_equal(a_subset, a[:, [2, 0]])
+  np.testing.assert_array_equal(b_subset, b[:, [2, 0]])
+  with pytest.raises(KeyError):
+    LUTs.select(['B9'])
+
+
+def test_correct_in_blocks_matches_coefficients():
+  # blocks of a few pixels, i.e. many blocks per scene
+  LUTs = HyperspectralLUTs.from_LUTs(band_LUTs(), max_bytes=2048)
+  assert LUTs.block_size < 10
+
+  points = random_points(SMALL, 12*7)
+  invars = [x.reshape(12, 7) for x in points.T]
+  L = np.random.RandomState(0).uniform(50, 150, (12, 7, 3))
+
+  ρ = LUTs.correct(L, *invars, doy=200)
+  a, b = LUTs.coefficients(*invars, doy=200)
+  np.testing.assert_allclose(ρ, (L - a) / b, rtol=1e-12)
+
+  # scalar input variables
+  ρ = LUTs.correct(L, 30, 1, 0.4, 0.5, 2)
+  a, b = LUTs.coefficients(30, 1, 0.4, 0.5, 2)
+  np.testing.assert_allclose(ρ, (L - a) / b, rtol=1e-12)
+
+  with pytest.raises(ValueError, match='radiance'):
+    LUTs.correct(L[..., :2], *invars)
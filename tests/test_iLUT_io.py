@@ -0,0 +1,107 @@
+import os
+import pickle
+import sys
+import zipfile
+
+import numpy as np
+import pytest
+
+from conftest import SMALL, make_LUT, random_points
+from grid_interpolator import GridInterpolator
+from LUT_store import LUT_Store
+import iLUT_io
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_round_trip_with_memory_mapped_values(tmp_path, small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  filepath = iLUT_io.save_iLUT(str(tmp_path / 'TEST_01.ilut'), grid)
+  assert iLUT_io.is_array_file(filepath)
+
+  loaded = iLUT_io.load_iLUT(filepath)
+  assert isinstance(loaded.values, np.memmap) or isinstance(loaded.values.base, np.memmap)
+  assert loaded.names == grid.names
+  points = random_points(SMALL, 100)
+  np.testing.assert_array_equal(loaded(points), grid(points))
+
+  loaded = iLUT_io.load_iLUT(filepath, mmap=False, dtype=np.float32)
+  assert loaded.dtype == np.float32
+  np.testing.assert_allclose(loaded(points), grid(points), rtol=1e-6)
+
+
+def test_memmap_member_offsets(tmp_path):
+  # arrays of several dtypes, orders and header sizes in one archive
+  arrays = {'values':np.arange(24, dtype=np.float64).reshape(2, 3, 4),
+            'small':np.array([1, 2, 3], dtype=np.int16),
+            'fortran':np.asfortranarray(np.arange(12, dtype=np.float32).reshape(3, 4)),
+            'long_name_{}'.format('x'*100):np.ones(5)}
+  filepath = str(tmp_path / 'arrays.npz')
+  np.savez(filepath, **arrays)
+
+  for name, array in arrays.items():
+    mapped = iLUT_io._memmap_member(filepath, name + '.npy')
+    assert isinstance(mapped, np.memmap)
+    assert mapped.dtype == array.dtype and mapped.shape == array.shape
+    np.testing.assert_array_equal(mapped, array)
+
+
+def save_arrays(filepath, grid, savez=np.savez, format_version=iLUT_io.FORMAT_VERSION):
+  """
+  Writes the arrays of an .ilut file (e.g. as another writer might)
+  """
+  with open(filepath, 'wb') as f:
+    savez(f, format_version=np.array(format_version), names=np.array(grid.names),
+          values=grid.values, **{'axis_{}'.format(k):ax for k, ax in enumerate(grid.axes)})
+
+
+def test_compressed_files_are_read(tmp_path, small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  filepath = str(tmp_path / 'TEST_01.ilut')
+  save_arrays(filepath, grid, savez=np.savez_compressed)
+
+  with zipfile.ZipFile(filepath) as zf:
+    assert zf.getinfo('values.npy').compress_type == zipfile.ZIP_DEFLATED
+  assert iLUT_io._memmap_member(filepath, 'values.npy') is None
+
+  loaded = iLUT_io.load_iLUT(filepath)
+  assert not isinstance(loaded.values, np.memmap)
+  np.testing.assert_array_equal(loaded.values, grid.values)
+
+
+def test_newer_format_version_is_refused(tmp_path, small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  filepath = str(tmp_path / 'TEST_01.ilut')
+  save_arrays(filepath, grid, format_version=iLUT_io.FORMAT_VERSION + 1)
+
+  with pytest.raises(ValueError, match='newer'):
+    iLUT_io.load_iLUT(filepath)
+
+
+def test_migrate_pickled_LinearNDInterpolator(tmp_path, monkeypatch, small_LUT):
+  from scipy.interpolate import LinearNDInterpolator
+
+  grid = GridInterpolator.from_LUT(small_LUT)
+  nodes = np.array(np.meshgrid(*grid.axes, indexing='ij')).reshape(5, -1).T
+  interpolator = LinearNDInterpolator(nodes, grid.flat_values)
+
+  # an older (pickled) iLUT in a LUT store
+  store = LUT_Store(str(tmp_path / 'store'))
+  config = {'spectrum':'TEST_01', 'aerosol_profile':'Continental', 'view_zenith':0,
+            'invars':SMALL}
+  filepath = store.put(config, 'ilut', lambda f: pickle.dump(interpolator, f))
+  assert not iLUT_io.is_array_file(filepath)
+
+  monkeypatch.syspath_prepend(ROOT)
+  import migrate_iLUTs
+  monkeypatch.setattr(sys, 'argv', ['migrate_iLUTs.py', filepath])
+  migrate_iLUTs.main()
+
+  assert iLUT_io.is_array_file(filepath)
+  assert store.get(config, 'ilut', verify=True) == filepath
+  migrated = iLUT_io.load_iLUT(filepath)
+  points = random_points(SMALL, 200)
+  np.testing.assert_allclose(migrated(points), grid(points), rtol=1e-10)
+
+  # (files in the array format are left as they are)
+  assert migrate_iLUTs.migrate(str(tmp_path / 'store')) == 0
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+BIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin')
+
+
+def test_correction_path_imports_neither_Py6S_nor_scipy():
+  code = '\n'.join([
+    'import sys',
+    'sys.path.insert(0, {!r})'.format(BIN),
+    'from interpolated_LUTs import Interpolated_LUTs',
+    'iLUTs = Interpolated_LUTs("COPERNICUS/S2")',
+    'import atmcorr',
+    'print(" ".join(m for m in ["Py6S", "scipy", "urllib.request"] if m in sys.modules))'])
+  output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+  assert output.split() == []
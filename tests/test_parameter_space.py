@@ -0,0 +1,79 @@
+from itertools import product
+
+import numpy as np
+import pytest
+
+from conftest import SMALL, SMALL_MIXTURE
+from parameter_space import ParameterGrid, input_variables, permutate_invars, progressive_invars
+
+
+def test_points_in_LUT_order():
+  grid = permutate_invars(SMALL_MIXTURE)
+  keys = ['solar_zs', 'H2Os', 'O3s', 'AOTs', 'alts', 'aerosol_mixtures']
+
+  assert len(grid) == np.prod([len(SMALL_MIXTURE[k]) for k in keys])
+  assert list(grid) == list(product(*[SMALL_MIXTURE[k] for k in keys]))
+  assert grid[5:9] == list(grid)[5:9]
+  assert grid[-1] == tuple(SMALL_MIXTURE[k][-1] for k in keys)
+
+
+def test_ravel_and_unravel_round_trip():
+  grid = ParameterGrid(SMALL)
+  for i in range(len(grid)):
+    assert grid.ravel(grid.unravel(i)) == i
+    assert grid.index(grid[i]) == i
+  assert grid.ravel([-1]*grid.ndim) == len(grid) - 1
+
+  with pytest.raises(IndexError):
+    grid.unravel(len(grid))
+  with pytest.raises(IndexError):
+    grid.ravel([0, 0, 0, 3, 0])
+
+
+def test_wrong_length_points_are_rejected():
+  grid = ParameterGrid(SMALL_MIXTURE)
+  with pytest.raises(ValueError, match='6 level indices'):
+    grid.ravel([0, 0, 0, 0, 0])
+  with pytest.raises(ValueError, match='6 variables'):
+    grid.index((0, 0, 0, 0, 0))
+  with pytest.raises(ValueError, match='6 variables'):
+    grid.index((0, 0, 0, 0, 0, 0, 0))
+  with pytest.raises(ValueError, match='not a grid point'):
+    grid.index((1, 0, 0, 0, 0, 0))
+
+
+@pytest.mark.parametrize('n', [1, 3, 7, 1000])
+def test_shards_cover_the_grid_once(n):
+  grid = ParameterGrid(SMALL)
+  shards = grid.shards(n)
+
+  assert len(shards) == n
+  covered = [i for shard in shards for i in shard]
+  assert covered == list(range(len(grid)))
+  assert max(len(s) for s in shards) - min(len(s) for s in shards) <= 1
+
+
+def test_coordinates():
+  grid = ParameterGrid(SMALL_MIXTURE)
+  coordinates = grid.coordinates()
+
+  assert coordinates.shape == (len(grid), grid.ndim)
+  np.testing.assert_array_equal(coordinates, np.array(list(grid), dtype=float))
+  np.testing.assert_array_equal(grid.coordinates(10, 20), coordinates[10:20])
+  assert grid.coordinates(dtype=np.float32).dtype == np.float32
+  assert ParameterGrid(input_variables('test')).coordinates().shape == (1, 5)
+
+
+def test_is_sorted():
+  assert ParameterGrid(SMALL).is_sorted()
+  assert ParameterGrid(input_variables('validation')).is_sorted()
+  assert not ParameterGrid(dict(SMALL, alts=[0, 7.75, 4])).is_sorted()
+  assert not ParameterGrid(dict(SMALL, alts=[0, 4, 4])).is_sorted()
+
+
+def test_progressive_stages_are_subgrids():
+  stages = progressive_invars(input_variables('full'))
+  assert stages[-1] == input_variables('full')
+  for coarse, fine in zip(stages[:-1], stages[1:]):
+    for k in coarse:
+      assert set(coarse[k]) < set(fine[k]) or coarse[k] == fine[k]
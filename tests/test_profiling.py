@@ -0,0 +1,87 @@
+import asyncio
+import os
+import pickle
+import threading
+
+from conftest import SMALL, make_LUT
+from grid_interpolator import GridInterpolator
+from profiling import Profiler
+from async_LUTs import AsyncInterpolated_LUTs
+import iLUT_io
+
+
+def work(n=20000):
+  return sum(i*i for i in range(n))
+
+
+def test_disabled_profiler_does_nothing(tmp_path):
+  profiler = Profiler()
+  with profiler.phase('work'):
+    work()
+  assert profiler.phases == []
+  assert profiler.write(str(tmp_path / 'artifact')) is None
+  assert os.listdir(str(tmp_path)) == []
+
+
+def test_phases_are_written_next_to_the_artifact(tmp_path):
+  profiler = Profiler(enabled=True)
+  with profiler.phase('outer'):
+    with profiler.phase('inner'):
+      work()
+  with profiler.phase('second'):
+    work()
+
+  assert [phase['name'] for phase in profiler.phases] == ['outer', 'second']
+  report_path = profiler.write(str(tmp_path / 'artifact'))
+  with open(report_path) as f:
+    report = f.read()
+  assert '== outer' in report and '== second' in report and 'work' in report
+  assert os.path.isfile(str(tmp_path / 'artifact.prof'))
+  assert profiler.phases == []
+
+
+def test_threads_take_turns_and_write_their_own_phases(tmp_path):
+  profiler = Profiler(enabled=True)
+  errors = []
+
+  def run(name):
+    try:
+      for k in range(3):
+        with profiler.phase('{} {}'.format(name, k)):
+          work()
+      profiler.write(str(tmp_path / name))
+    except Exception as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=run, args=('thread{}'.format(i),)) for i in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert errors == []
+  for i in range(4):
+    with open(str(tmp_path / 'thread{}.profile.txt'.format(i))) as f:
+      names = [line.split(':')[0] for line in f if line.startswith('== ')]
+    assert names == ['== thread{} {}'.format(i, k) for k in range(3)]
+
+
+def test_profiler_pickles_without_its_phases():
+  profiler = Profiler(enabled=True, top=5)
+  with profiler.phase('work'):
+    work()
+  copy = pickle.loads(pickle.dumps(profiler))
+  assert (copy.enabled, copy.top, copy.phases) == (True, 5, [])
+
+
+def test_async_loading_is_profiled(tmp_path):
+  iLUTs = AsyncInterpolated_LUTs('LANDSAT/LC8', profile=True)
+  iLUTs.iLUTs_dir = str(tmp_path)
+  grid = GridInterpolator.from_LUT(make_LUT(SMALL))
+  for band in ['01', '02']:
+    iLUT_io.save_iLUT(str(tmp_path / 'LANDSAT_OLI_{}.ilut'.format(band)), grid)
+
+  loaded = asyncio.run(iLUTs.get_async())
+  assert sorted(loaded) == ['01', '02']
+  for band in ['01', '02']:
+    assert os.path.isfile(str(tmp_path / 'LANDSAT_OLI_{}.ilut.profile.txt'.format(band)))
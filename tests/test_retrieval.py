@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from conftest import SMALL, SMALL_MIXTURE, random_points
+from grid_interpolator import GridInterpolator
+from retrieval import invert_AOT, reflectance_curves, retrieve_AOT
+
+
+def radiance(grid, points, target):
+  a, b = np.moveaxis(grid(points), -1, 0)
+  return a + target*b
+
+
+def test_retrieve_AOT_round_trip(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  points = random_points(SMALL, 2000)
+  L = radiance(grid, points, 0.01)
+
+  solar_z, H2O, O3, AOT, alt = points.T
+  report = {}
+  retrieved = retrieve_AOT(grid, L, 0.01, solar_z, H2O, O3, alt, report=report)
+
+  np.testing.assert_allclose(retrieved, AOT, atol=1e-9)
+  assert report['no_solution'] == 0
+
+
+def test_retrieve_AOT_without_refinement_on_grid_nodes(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  AOT = np.linspace(0, 3, 50)
+  L = radiance(grid, np.stack(np.broadcast_arrays(40, 2, 0.4, AOT, 4), axis=-1), 0.05)
+
+  retrieved = retrieve_AOT(grid, L, 0.05, 40, 2, 0.4, 4, refine=False)
+
+  np.testing.assert_allclose(retrieved, AOT, atol=1e-9)
+
+
+def test_no_solution_outside_AOT_range(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  L = radiance(grid, [30, 1, 0.4, 3, 2], 0.01)
+
+  report = {}
+  retrieved = retrieve_AOT(grid, L, 0.005, 30, 1, 0.4, 2, report=report, fill_value=-1)
+
+  assert retrieved == -1
+  assert report['no_solution'] == 1
+
+
+def test_invert_reflectance_curves(small_LUT):
+  grid = GridInterpolator.from_LUT(small_LUT)
+  L = radiance(grid, [[30, 1, 0.4, 1, 2], [40, 2, 0.4, 0.5, 4]], 0.02)
+
+  levels, curves = reflectance_curves(grid, L, [30, 40], [1, 2], 0.4, [2, 4])
+
+  assert curves.shape == (2, len(SMALL['AOTs']))
+  AOT = invert_AOT(levels, curves, 0.02)
+
+  # (exact on AOT levels, reflectance is not linear in AOT between them)
+  assert AOT[0] == pytest.approx(1, abs=1e-12)
+  assert AOT[1] == pytest.approx(0.5, abs=0.1)
+
+
+def test_retrieve_AOT_with_aerosol_mixture(mixture_LUT):
+  grid = GridInterpolator.from_LUT(mixture_LUT)
+  points = random_points(SMALL_MIXTURE, 500)
+  L = radiance(grid, points, 0.01)
+
+  solar_z, H2O, O3, AOT, alt, mixture = points.T
+  retrieved = retrieve_AOT(grid, L, 0.01, solar_z, H2O, O3, alt, aerosol_mixture=mixture)
+
+  np.testing.assert_allclose(retrieved, AOT, atol=1e-9)
+  with pytest.raises(ValueError, match='aerosol_mixture'):
+    retrieve_AOT(grid, L, 0.01, solar_z, H2O, O3, alt)
+
+
+def test_retrieve_AOT_with_a_surrogate(full_LUT):
+  from surrogate import ChebyshevSurrogate
+
+  surrogate = ChebyshevSurrogate.from_LUT(full_LUT)
+  points = random_points(full_LUT['config']['invars'], 500)
+  L = radiance(surrogate, points, 0.01)
+
+  solar_z, H2O, O3, AOT, alt = points.T
+  refined = retrieve_AOT(surrogate, L, 0.01, solar_z, H2O, O3, alt)
+  coarse = retrieve_AOT(surrogate, L, 0.01, solar_z, H2O, O3, alt, refine=False)
+
+  # (a surrogate is refined on a subdivision of the AOT cell, i.e. approximately)
+  np.testing.assert_allclose(refined, AOT, atol=1e-5)
+  assert np.abs(refined - AOT).max() < np.abs(coarse - AOT).max()
+
+
+def test_retrieve_AOT_with_cubic_interpolation(small_LUT):
+  from grid_interpolator import CubicGridInterpolator
+
+  grid = CubicGridInterpolator.from_LUT(small_LUT)
+  points = random_points(SMALL, 1000)
+  L = radiance(grid, points, 0.01)
+
+  solar_z, H2O, O3, AOT, alt = points.T
+  retrieved = retrieve_AOT(grid, L, 0.01, solar_z, H2O, O3, alt)
+
+  # (cubic iLUTs are refined on a subdivision of the AOT cell, i.e. approximately)
+  np.testing.assert_allclose(retrieved, AOT, atol=5e-5)
@@ -0,0 +1,57 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from conftest import SMALL, coefficients, make_LUT, random_points
+from grid_interpolator import CubicGridInterpolator, GridInterpolator
+import shared_LUTs
+
+
+def interpolate_shared(args):
+  """
+  (worker) interpolates a band of iLUTs attached to a shared memory block
+  """
+  spec, band, points = args
+  iLUTs = shared_LUTs.attach(spec)
+  assert not iLUTs[band].values.flags.writeable
+  return iLUTs[band](points)
+
+
+def test_workers_attach_to_shared_iLUTs(small_LUT):
+  if 'fork' not in multiprocessing.get_all_start_methods():
+    pytest.skip('needs fork (workers inherit the test path)')
+
+  iLUTs = {'B1':GridInterpolator.from_LUT(small_LUT),
+           'B2':GridInterpolator.from_LUT(make_LUT(SMALL, lambda x: 2*coefficients(x)))}
+  points = random_points(SMALL, 100)
+
+  with shared_LUTs.SharedLUTs(iLUTs, dtype=np.float32) as shared:
+    with multiprocessing.get_context('fork').Pool(2) as pool:
+      results = pool.map(interpolate_shared, [(shared.spec, band, points) for band in ['B1', 'B2']])
+    name = shared.spec['name']
+
+  for band, values in zip(['B1', 'B2'], results):
+    np.testing.assert_allclose(values, iLUTs[band](points), rtol=1e-5)
+
+  # the block is removed once published iLUTs are closed
+  with pytest.raises(FileNotFoundError):
+    shared_LUTs._open(name)
+
+
+def test_shared_LUTs_keep_the_interpolation_method(small_LUT):
+  grid = CubicGridInterpolator.from_LUT(small_LUT)
+  with shared_LUTs.SharedLUTs({'B1':grid}) as shared:
+    attached = shared_LUTs.attach(shared.spec)['B1']
+    assert isinstance(attached, CubicGridInterpolator)
+    np.testing.assert_array_equal(attached(30, 1, 0.4, 0.5, 2), grid(30, 1, 0.4, 0.5, 2))
+    shared_LUTs.detach(shared.spec)
+
+
+def test_shared_LUTs_keep_the_axis_names(mixture_LUT):
+  grid = GridInterpolator.from_LUT(mixture_LUT)
+  with shared_LUTs.SharedLUTs({'B1':grid}) as shared:
+    attached = shared_LUTs.attach(shared.spec)['B1']
+    assert attached.names == grid.names
+    assert np.isfinite(attached(30, 1, 0.4, 0.5, 2, 3, policy={'aerosol_mixture':'clamp'})).all()
+    shared_LUTs.detach(shared.spec)
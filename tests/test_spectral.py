@@ -0,0 +1,104 @@
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+from conftest import SMALL, coefficients
+from parameter_space import permutate_invars
+import spectral
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def spectral_LUT(start=0.4, end=0.5):
+  """
+  Spectral LUT of the synthetic coefficients scaled by wavelength, with a
+  spherical albedo column
+  """
+  wavelengths = spectral.wavelengths(start, end)
+  points = np.array(list(permutate_invars(SMALL)), dtype=float)
+  outputs = coefficients(points)[:, None, :] * wavelengths[None, :, None]
+  config = {'spectrum':{'spectral':[start, end, spectral.STEP]}, 'invars':SMALL,
+            'aerosol_profile':'Continental', 'view_zenith':0, 'build_type':'test',
+            'wavelengths':[float(w) for w in wavelengths], 'filename':'spectral.lut'}
+  return {'config':config, 'outputs':outputs,
+          'columns':{'spherical_albedo':np.tile(wavelengths, (len(points), 1))}}
+
+
+def test_flat_srf_gives_the_spectral_mean():
+  LUT = spectral_LUT()
+  wavelengths = np.asarray(LUT['config']['wavelengths'])
+  flat = (wavelengths, np.ones_like(wavelengths))
+
+  coeffs = spectral.convolve(LUT, [flat])
+  assert coeffs.shape == (len(LUT['outputs']), 1, 2)
+  np.testing.assert_allclose(coeffs[:, 0], LUT['outputs'].mean(axis=1), rtol=1e-12)
+
+
+def test_delta_srf_gives_that_wavelength():
+  LUT = spectral_LUT()
+  wavelengths = np.asarray(LUT['config']['wavelengths'])
+  k = 17
+  delta = (wavelengths[k-1:k+2], np.array([0, 1, 0]))
+
+  coeffs = spectral.convolve(LUT, [delta])
+  np.testing.assert_allclose(coeffs[:, 0], LUT['outputs'][:, k], rtol=1e-12)
+
+  with pytest.raises(ValueError, match='outside'):
+    spectral.convolve(LUT, [(np.array([1.0, 1.1]), np.array([1, 1]))])
+
+
+def test_channel_LUTs():
+  LUT = spectral_LUT()
+  wavelengths = np.asarray(LUT['config']['wavelengths'])
+  channels = {'FLAT':(wavelengths, np.ones_like(wavelengths)),
+              'DELTA':(wavelengths[16:19], np.array([0, 1, 0]))}
+
+  LUTs = spectral.channel_LUTs(LUT, channels)
+  assert list(LUTs) == ['FLAT', 'DELTA']
+  delta = LUTs['DELTA']
+  assert 'wavelengths' not in delta['config']
+  assert delta['config']['filename'] == 'DELTA.lut'
+  assert delta['config']['spectrum']['channel'] == 'DELTA'
+  np.testing.assert_allclose(delta['outputs'], LUT['outputs'][:, 17], rtol=1e-12)
+  np.testing.assert_allclose(delta['columns']['spherical_albedo'], wavelengths[17])
+  np.testing.assert_allclose(LUTs['FLAT']['columns']['spherical_albedo'], wavelengths.mean())
+
+
+def test_LUT_convolve_srf_file(tmp_path, monkeypatch):
+  from LUT_store import LUT_Store
+
+  LUT = spectral_LUT()
+  wavelengths = np.asarray(LUT['config']['wavelengths'])
+  LUT_path = str(tmp_path / 'spectral.lut')
+  with open(LUT_path, 'wb') as f:
+    pickle.dump(LUT, f)
+
+  # one csv file of two channels: flat and a delta at the 18th wavelength
+  srf_path = str(tmp_path / 'SENSOR.csv')
+  response = np.zeros_like(wavelengths)
+  response[17] = 1
+  np.savetxt(srf_path, np.stack([wavelengths, np.ones_like(wavelengths), response], axis=1),
+             delimiter=',', header='wavelength, flat, delta')
+
+  monkeypatch.syspath_prepend(ROOT)
+  import LUT_convolve
+  assert list(LUT_convolve.read_srfs(srf_path)) == ['SENSOR_01', 'SENSOR_02']
+
+  store_root = str(tmp_path / 'store')
+  monkeypatch.setattr(sys, 'argv', ['LUT_convolve.py', LUT_path, '--srf', srf_path,
+                                    '--sensor', 'SENSOR', '--store', store_root])
+  LUT_convolve.main()
+
+  stored = {}
+  for key, filepath in LUT_Store(store_root).find('lut', sensor='SENSOR', build_type='test'):
+    with open(filepath, 'rb') as f:
+      channel_LUT = pickle.load(f)
+    stored[channel_LUT['config']['filename']] = channel_LUT
+  assert sorted(stored) == ['SENSOR_01.lut', 'SENSOR_02.lut']
+  np.testing.assert_allclose(stored['SENSOR_01.lut']['outputs'], LUT['outputs'].mean(axis=1),
+                             rtol=1e-12)
+  np.testing.assert_allclose(stored['SENSOR_02.lut']['outputs'], LUT['outputs'][:, 17],
+                             rtol=1e-12)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from conftest import SMALL, make_LUT, random_points
+from grid_interpolator import GridInterpolator
+from parameter_space import input_variables
+from surrogate import ChebyshevSurrogate, validation_error
+
+
+@pytest.fixture
+def surrogate(full_LUT):
+  return ChebyshevSurrogate.from_LUT(full_LUT)
+
+
+def test_fit_error_against_the_iLUT(full_LUT, surrogate):
+  grid = GridInterpolator.from_LUT(full_LUT)
+  validation = make_LUT(input_variables('validation'))
+
+  # (the synthetic table is smooth, i.e. the series beats linear interpolation)
+  error = validation_error(surrogate, validation)
+  assert error['max'] < validation_error(grid, validation)['max']
+  assert error['mean'] < 0.01
+
+  points = random_points(full_LUT['config']['invars'], 2000)
+  np.testing.assert_allclose(surrogate(points), grid(points), rtol=0.05)
+
+
+def test_save_load_round_trip(surrogate, tmp_path):
+  surrogate.validation = {'max':0.001, 'mean':0.0001}
+  filepath = surrogate.save(str(tmp_path / 'B1.surrogate'))
+
+  loaded = ChebyshevSurrogate.load(filepath)
+  assert loaded.names == surrogate.names
+  assert loaded.validation == surrogate.validation
+  np.testing.assert_array_equal(loaded.coefficients, surrogate.coefficients)
+  np.testing.assert_array_equal(loaded(30, 1, 0.4, 0.5, 2), surrogate(30, 1, 0.4, 0.5, 2))
+  assert loaded.astype(np.float32)(30, 1, 0.4, 0.5, 2).dtype == np.float32
+
+
+def test_out_of_range_policies(small_LUT):
+  surrogate = ChebyshevSurrogate.from_LUT(small_LUT)
+  above = [30, 1, 0.4, 0.5, 9.0]
+
+  report = {}
+  assert np.isnan(surrogate(above, report=report)).all()
+  assert report['out_of_range']['alt'] == 1
+  np.testing.assert_allclose(surrogate(above, policy='clamp'), surrogate(30, 1, 0.4, 0.5, 7.75))
+  assert np.isfinite(surrogate(above, policy={'alt':'linear'})).all()
+  with pytest.raises(ValueError, match='alt'):
+    surrogate(above, policy='raise')
+
+
+def test_gradient_matches_finite_differences(small_LUT):
+  surrogate = ChebyshevSurrogate.from_LUT(small_LUT)
+  points = random_points(SMALL, 200)
+  values, jacobian = surrogate.gradient(points)
+
+  np.testing.assert_allclose(values, surrogate(points))
+  eps = 1e-6
+  for k in range(surrogate.ndim):
+    step = np.zeros(surrogate.ndim)
+    step[k] = eps
+    difference = (surrogate(points + step, policy='linear') -
+                  surrogate(points - step, policy='linear')) / (2*eps)
+    np.testing.assert_allclose(jacobian[..., k], difference, rtol=1e-5, atol=1e-6)
+
+
+def test_gradient_is_zero_along_clamped_axes(small_LUT):
+  surrogate = ChebyshevSurrogate.from_LUT(small_LUT)
+  _, jacobian = surrogate.gradient(30, 1, 0.4, 0.5, 9.0, policy='clamp')
+  assert (jacobian[..., 4] == 0).all()
+  assert (jacobian[..., 3] != 0).all()